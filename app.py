@@ -1,15 +1,29 @@
-from flask import Flask, render_template, request, jsonify, g
+from flask import Flask, render_template, request, jsonify, g, Response
 from silicon_flow_api import SiliconFlowAPI
 from dida365_api import DidaAPI
-from prompts.task_prompts import TASK_ANALYSIS_PROMPT
+from sync_scheduler import SyncScheduler
+from outbox import TaskOutbox
+from speech_stream import SpeechJob, SpeechJobs
+from streaming_asr import DEFAULT_STREAMING_ASR_CONFIG, TranscriptionStream, TranscriptionStreams
+from llm_cache import LLMResultCache, is_read_only, previous_reply
+from fast_path import match_intent, format_reply, degraded_intent, format_degraded_reply
+from circuit_breaker import CircuitOpenError, breakers
+from conversation import ConversationStore
+from tts_cache import TTSCache
+from audio_upload import (AudioSpool, AudioTooLarge, DEFAULT_SPOOL_BYTES, MAX_AUDIO_BYTES,
+                          MULTIPART_OVERHEAD_BYTES, audio_filename, audio_type)
+from http_session import sessions
+from metrics import metrics
+from pipeline import (build_task_messages, parse_llm_reply, collect_actions, group_actions,
+                      summarize_action_results, truncate_response, ResponseFieldParser)
 from logging_config import setup_logging
+import io
 import os
-import tempfile
 import base64
-from datetime import datetime
-import pytz
 import json
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 # 设置日志记录器
 logger = setup_logging()
@@ -36,8 +50,94 @@ app = Flask(__name__)
 # 初始化API客户端
 silicon_api = SiliconFlowAPI()
 
-# 存储会话状态
-session_state = {}
+# 多轮对话的会话记录，按浏览器传来的 session_id 区分
+conversations = ConversationStore(config.get('conversation'))
+
+# 流式LLM回复中 response 字段一结束，就在这个线程池中提前合成语音；分句合成也在这里执行
+tts_executor = ThreadPoolExecutor(
+    max_workers=config['silicon_flow'].get('tts_concurrency', 8),
+    thread_name_prefix='tts'
+)
+
+# 等待浏览器读取的分句合成任务
+speech_jobs = SpeechJobs()
+
+# TTS音频缓存（内存 + 磁盘），所有线程共享
+tts_cache_config = config.get('tts_cache', {})
+tts_cache = TTSCache(
+    directory=tts_cache_config.get('directory', 'tts_cache'),
+    memory_max_bytes=tts_cache_config.get('memory_max_bytes', 32 * 1024 * 1024),
+    disk_max_bytes=tts_cache_config.get('disk_max_bytes', 256 * 1024 * 1024)
+) if tts_cache_config.get('enabled', True) else None
+
+# 只读指令的LLM分析结果缓存
+llm_cache_config = config.get('llm_cache', {})
+llm_cache = LLMResultCache(
+    max_entries=llm_cache_config.get('max_entries', 256),
+    ttl=llm_cache_config.get('ttl', 300)
+)
+
+# 语音上传的大小上限和内存缓冲区大小
+audio_upload_config = config.get('audio_upload', {})
+
+# 录音过程中的流式识别：按静音切分出的语音段在这个线程池中并发识别
+streaming_asr_config = {**DEFAULT_STREAMING_ASR_CONFIG, **config.get('streaming_asr', {})}
+asr_executor = ThreadPoolExecutor(
+    max_workers=streaming_asr_config['concurrency'],
+    thread_name_prefix='asr'
+)
+transcription_streams = TranscriptionStreams(ttl=streaming_asr_config['ttl'])
+
+# 常见查询指令的规则快速路径
+fast_path_config = config.get('fast_path', {})
+
+def run_sync():
+    """在当前线程中执行一次与滴答清单的同步，任务有变化时清空LLM结果缓存"""
+    dida_api = DidaAPI.shared()
+    try:
+        with metrics.timer('sync'):
+            stats = dida_api.sync_with_server()
+        if stats.get('tasks_written') or stats.get('tasks_completed') or stats.get('tasks_deleted'):
+            llm_cache.invalidate('sync')
+        return stats
+    finally:
+        dida_api.close()
+
+# 后台同步调度器：定时同步，并合并并发的同步请求
+sync_scheduler = SyncScheduler(
+    run_sync,
+    interval=config['dida365'].get('sync_interval', 300),
+    debounce=config['dida365'].get('sync_debounce', 30)
+)
+
+# 任务写入的 write-behind outbox，首次使用时创建
+_task_outbox = None
+_task_outbox_lock = threading.Lock()
+
+def get_task_outbox():
+    """获取进程内共享的任务 outbox，首次调用时创建并启动后台发送线程"""
+    global _task_outbox
+    if _task_outbox is None:
+        with _task_outbox_lock:
+            if _task_outbox is None:
+                dida_config = config['dida365']
+                outbox = TaskOutbox(
+                    DidaAPI.shared(),
+                    merge_window=dida_config.get('outbox_merge_window', 2),
+                    max_attempts=dida_config.get('outbox_max_attempts', 8)
+                )
+                outbox.start()
+                _task_outbox = outbox
+    return _task_outbox
+
+def get_task_writer():
+    """获取任务写入接口：write_behind 模式下写入 outbox 后立即返回，否则直接调用滴答清单API
+    
+    滴答清单熔断中时也写入 outbox，熔断器恢复后由后台线程写回
+    """
+    if config['dida365'].get('write_mode') == 'write_behind' or not breakers.get('dida365').available():
+        return get_task_outbox()
+    return get_dida_api()
 
 def save_config():
     """保存配置到文件"""
@@ -66,14 +166,14 @@ def handle_settings():
             return jsonify({'status': 'error', 'message': str(e)}), 500
 
 def get_dida_api():
-    """获取当前请求的DidaAPI实例"""
+    """获取进程内共享的DidaAPI实例，并记录当前请求使用了它"""
     if 'dida_api' not in g:
-        g.dida_api = DidaAPI()
+        g.dida_api = DidaAPI.shared()
     return g.dida_api
 
 @app.teardown_appcontext
 def close_dida_api(error):
-    """在请求结束时关闭数据库连接"""
+    """在请求结束时把数据库连接归还连接池"""
     dida_api = g.pop('dida_api', None)
     if dida_api is not None:
         dida_api.close()
@@ -85,9 +185,8 @@ def index():
 
 @app.route('/api/speech-to-text', methods=['POST'])
 def speech_to_text():
-    """处理语音转文字请求"""
+    """处理语音转文字请求（音频以 base64 编码放在JSON中，新客户端请使用 /api/speech-to-text/upload）"""
     total_start_time = time.time()
-    temp_path = None
     
     try:
         logger.info("=== 阶段1：语音输入 ===")
@@ -111,43 +210,171 @@ def speech_to_text():
         
         # 解码音频数据
         audio_bytes = base64.b64decode(encoded)
-        if len(audio_bytes) > 50 * 1024 * 1024:
+        if len(audio_bytes) > audio_upload_config.get('max_bytes', MAX_AUDIO_BYTES):
             return jsonify({'error': '音频文件过大（超过50MB）'}), 400
         
-        # 保存临时文件并处理
-        with tempfile.NamedTemporaryFile(suffix='.webm', delete=False) as temp_file:
-            temp_file.write(audio_bytes)
-            temp_path = temp_file.name
-            temp_file.flush()
-            os.fsync(temp_file.fileno())
+        # 直接从内存上传，不写临时文件
+        return transcribe_upload(io.BytesIO(audio_bytes), 'audio.webm', 'audio/webm', total_start_time)
+    
+    except Exception as e:
+        print("语音识别失败")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/speech-to-text/upload', methods=['POST'])
+def upload_speech():
+    """处理语音转文字请求，音频不经过 base64 编码和临时文件
+    
+    请求体为音频的二进制数据（Content-Type 为 audio/webm 等音频类型），
+    或 multipart/form-data 中名为 audio 的文件字段。
+    """
+    total_start_time = time.time()
+    max_bytes = audio_upload_config.get('max_bytes', MAX_AUDIO_BYTES)
+    
+    try:
+        logger.info("=== 阶段1：语音输入 ===")
         
-        # 调用ASR服务
-        logger.info("=== 阶段1.1：调用ASR服务 ===")
-        result = silicon_api.transcribe_audio(temp_path)
-        logger.debug(f"ASR服务返回结果: {json.dumps(result, ensure_ascii=False, indent=2)}")
+        # 请求体声明的长度已经超过上限时不读取
+        if request.content_length and request.content_length > max_bytes + MULTIPART_OVERHEAD_BYTES:
+            return jsonify({'error': f'音频文件过大（超过{max_bytes // (1024 * 1024)}MB）'}), 413
         
-        # 处理ASR结果
-        if 'error' in result:
-            return jsonify({'error': result['error']}), 500
+        if request.mimetype == 'multipart/form-data':
+            # multipart 请求中的文件已由 werkzeug 解析到内存或临时文件中，直接上传
+            upload = request.files.get('audio')
+            if upload is None:
+                return jsonify({'error': '未提供音频数据'}), 400
+            content_type = audio_type(upload.mimetype or 'application/octet-stream')
+            if content_type is None:
+                return jsonify({'error': f'不支持的音频格式：{upload.mimetype}'}), 415
+            return transcribe_upload(upload.stream, audio_filename(content_type), content_type,
+                                     total_start_time, max_bytes)
         
-        transcribed_text = result.get('text', '')
-        if not transcribed_text.strip():
-            return jsonify({'error': '未能识别出有效的语音内容'}), 400
+        content_type = audio_type(request.mimetype)
+        if content_type is None:
+            return jsonify({'error': f'不支持的音频格式：{request.mimetype}'}), 415
         
-        print("语音识别成功")
-        return jsonify({'text': transcribed_text})
+        # 请求体按块读入有大小上限的缓冲区，较大的音频转存到临时文件（不 fsync）
+        with AudioSpool(max_bytes, audio_upload_config.get('spool_memory_bytes', DEFAULT_SPOOL_BYTES)) as spool:
+            spool.read_from(request.stream)
+            return transcribe_upload(spool.open(), audio_filename(content_type), content_type, total_start_time)
     
+    except AudioTooLarge as e:
+        return jsonify({'error': str(e)}), 413
     except Exception as e:
         print("语音识别失败")
         return jsonify({'error': str(e)}), 500
+
+def transcribe_segment(wav):
+    """识别流式识别中切分出的一个语音段"""
+    with metrics.timer('asr', op='segment') as stage:
+        result = silicon_api.transcribe_audio(io.BytesIO(wav), 'segment.wav', 'audio/wav')
+        if 'error' in result:
+            stage.fail()
+    return result
+
+@app.route('/api/asr-stream', methods=['POST'])
+def start_asr_stream():
+    """开始一次流式识别，返回识别流ID和浏览器应上传的PCM采样率"""
+    if not streaming_asr_config.get('enabled', True):
+        return jsonify({'error': '未启用流式识别'}), 404
+    if not breakers.get('asr').available():
+        return jsonify({'error': '语音识别服务暂时不可用，请使用文字输入', 'degraded': 'asr'}), 503
+    stream = TranscriptionStream(transcribe_segment, asr_executor, streaming_asr_config)
+    return jsonify({'stream_id': transcription_streams.add(stream), 'sample_rate': stream.sample_rate})
+
+@app.route('/api/asr-stream/<stream_id>', methods=['POST'])
+def feed_asr_stream(stream_id):
+    """接收一块录音（16位小端单声道PCM），在静音处切分出的语音段立即开始识别
     
-    finally:
-        # 清理临时文件
-        if temp_path:
-            try:
-                os.unlink(temp_path)
-            except Exception:
-                pass
+    Returns:
+        Response: {"segments": 已开始识别的语音段数, "text": 已按顺序识别完成的文字}
+    """
+    stream = transcription_streams.get(stream_id)
+    if stream is None:
+        return jsonify({'error': '识别流不存在或已结束'}), 404
+    try:
+        segments = stream.feed(request.get_data(cache=False))
+    except ValueError as e:
+        transcription_streams.pop(stream_id)
+        stream.cancel()
+        return jsonify({'error': str(e)}), 413
+    return jsonify({'segments': segments, 'text': stream.partial_text()})
+
+@app.route('/api/asr-stream/<stream_id>', methods=['DELETE'])
+def cancel_asr_stream(stream_id):
+    """取消识别流：浏览器改为上传整段录音、不再需要流式识别结果时调用"""
+    stream = transcription_streams.pop(stream_id)
+    if stream is None:
+        return jsonify({'error': '识别流不存在或已结束'}), 404
+    stream.cancel()
+    return jsonify({'cancelled': True})
+
+@app.route('/api/asr-stream/<stream_id>/finish', methods=['POST'])
+def finish_asr_stream(stream_id):
+    """录音结束，等待最后的语音段识别完成并返回全部文字（响应格式同 /api/speech-to-text）"""
+    total_start_time = time.time()
+    stream = transcription_streams.pop(stream_id)
+    if stream is None:
+        return jsonify({'error': '识别流不存在或已结束'}), 404
+    
+    logger.info("=== 阶段1：流式语音识别结束 ===")
+    result = stream.finish()
+    logger.info(f"录音结束后等待识别耗时: {format_time_cost(total_start_time)}，"
+                f"共 {result.get('segments', 0)} 个语音段")
+    
+    if result.get('degraded'):
+        return jsonify({'error': '语音识别服务暂时不可用，请使用文字输入', 'degraded': 'asr'}), 503
+    if 'error' in result:
+        return jsonify({'error': result['error']}), 500
+    if not result['text']:
+        return jsonify({'error': '未能识别出有效的语音内容'}), 400
+    
+    print("语音识别成功")
+    return jsonify({'text': result['text']})
+
+def transcribe_upload(audio_file, filename, content_type, total_start_time, max_bytes=None):
+    """调用ASR服务识别上传的音频并返回识别结果
+    
+    Args:
+        audio_file (BinaryIO): 音频内容，从当前位置读取到结尾
+        filename (str): 上传给ASR服务的文件名
+        content_type (str): 音频的 Content-Type
+        total_start_time (float): 开始处理请求的时间
+        max_bytes (int, optional): 音频的最大字节数，调用方未检查大小时提供
+    
+    Returns:
+        Response: JSON响应
+    """
+    start = audio_file.tell()
+    size = audio_file.seek(0, os.SEEK_END) - start
+    audio_file.seek(start)
+    if not size:
+        return jsonify({'error': '未提供音频数据'}), 400
+    if max_bytes is not None and size > max_bytes:
+        return jsonify({'error': f'音频文件过大（超过{max_bytes // (1024 * 1024)}MB）'}), 413
+    
+    # 调用ASR服务
+    logger.info("=== 阶段1.1：调用ASR服务 ===")
+    asr_start_time = time.time()
+    with metrics.timer('asr') as stage:
+        result = silicon_api.transcribe_audio(audio_file, filename, content_type)
+        if 'error' in result:
+            stage.fail()
+    logger.info(f"ASR耗时: {format_time_cost(asr_start_time)}，音频大小: {size} 字节")
+    logger.debug(f"ASR服务返回结果: {json.dumps(result, ensure_ascii=False, indent=2)}")
+    
+    # 处理ASR结果
+    if result.get('degraded'):
+        return jsonify({'error': '语音识别服务暂时不可用，请使用文字输入', 'degraded': 'asr'}), 503
+    if 'error' in result:
+        return jsonify({'error': result['error']}), 500
+    
+    transcribed_text = result.get('text', '')
+    if not transcribed_text.strip():
+        return jsonify({'error': '未能识别出有效的语音内容'}), 400
+    
+    print("语音识别成功")
+    logger.info(f"语音识别总耗时: {format_time_cost(total_start_time)}")
+    return jsonify({'text': transcribed_text})
 
 def execute_task_action(action_data):
     """执行任务操作"""
@@ -182,7 +409,7 @@ def execute_task_action(action_data):
                 if 'startDate' in task_data or 'dueDate' in task_data:
                     task_data.setdefault('timeZone', 'Asia/Shanghai')
                 
-                result = dida_api.create_task(**task_data)
+                result = get_task_writer().create_task(**task_data)
                 success_msg = f"已成功创建任务：{task_data.get('title')}"
                 logger.info(f"成功: {success_msg}")
                 logger.debug(f"创建结果: {json.dumps(result, ensure_ascii=False, indent=2)}")
@@ -211,7 +438,7 @@ def execute_task_action(action_data):
                 task_id = task_data.pop('id')
                 project_id = task_data.pop('projectId')
                 
-                result = dida_api.update_task(task_id, project_id, **task_data)
+                result = get_task_writer().update_task(task_id, project_id, **task_data)
                 success_msg = f"已更新任务：{result.get('title', '未知任务')}"
                 logger.info(f"成功: {success_msg}")
                 logger.debug(f"更新结果: {json.dumps(result, ensure_ascii=False, indent=2)}")
@@ -228,29 +455,18 @@ def execute_task_action(action_data):
             try:
                 # 检查必填字段
                 if not task_data.get('id'):
-                    # 如果没有任务ID，但有日期和项目ID，则返回该项目的任务列表
-                    if task_data.get('projectId'):
+                    # 如果没有任务ID，但有日期或项目ID，则从本地数据库查询任务列表
+                    if task_data.get('projectId') or task_data.get('date'):
                         tasks = dida_api.get_local_tasks(
                             include_completed=False,
-                            project_id=task_data.get('projectId')
+                            project_id=task_data.get('projectId'),
+                            date=task_data.get('date')
                         )
                         if not tasks:
+                            if task_data.get('date'):
+                                return False, f"在指定日期没有找到任何任务"
                             return False, "没有找到任何任务"
                             
-                        # 如果指定了日期，过滤出该日期的任务
-                        if task_data.get('date'):
-                            target_date = task_data.get('date')
-                            filtered_tasks = []
-                            for task in tasks:
-                                start_date = task.get('startDate', '').split('T')[0]
-                                due_date = task.get('dueDate', '').split('T')[0]
-                                if start_date == target_date or due_date == target_date:
-                                    filtered_tasks.append(task)
-                            tasks = filtered_tasks
-                            
-                        if not tasks:
-                            return False, f"在指定日期没有找到任何任务"
-                            
                         task_list = "\n".join([f"- {task.get('title')}" for task in tasks])
                         success_msg = f"找到以下任务：\n{task_list}"
                         logger.info(f"成功: {success_msg}")
@@ -262,7 +478,13 @@ def execute_task_action(action_data):
                 if not task_data.get('projectId'):
                     return False, "缺少项目ID"
                 
-                result = dida_api.get_task(task_data['projectId'], task_data['id'])
+                try:
+                    result = dida_api.get_task(task_data['projectId'], task_data['id'])
+                except CircuitOpenError:
+                    # 滴答清单熔断中，使用本地缓存的任务
+                    result = dida_api.get_local_task(task_data['id'])
+                    if result is None:
+                        raise
                 success_msg = f"已找到任务：{result.get('title', '未知任务')}"
                 logger.info(f"成功: {success_msg}")
                 logger.debug(f"任务详情: {json.dumps(result, ensure_ascii=False, indent=2)}")
@@ -286,9 +508,311 @@ def execute_task_action(action_data):
         print("任务执行失败")
         return False, error_msg
 
+def execute_task_actions(actions):
+    """并发执行多个任务操作
+    
+    针对同一任务（相同任务ID）的操作按顺序执行，不同任务的操作在有界线程池中并发执行。
+    
+    Args:
+        actions (list): 操作列表，每项格式同 execute_task_action 的参数
+    
+    Returns:
+        list: 与 actions 顺序一致的 (是否成功, 结果信息) 列表
+    """
+    def run(indexes):
+        for index in indexes:
+            action = actions[index]
+            with metrics.timer('action', op=str(action.get('action'))) as stage:
+                results[index] = execute_task_action(action)
+                if not results[index][0]:
+                    stage.fail()
+    
+    def run_in_worker(indexes):
+        # 工作线程没有请求上下文，使用独立的应用上下文，结束时归还数据库连接
+        with app.app_context():
+            run(indexes)
+    
+    results = [None] * len(actions)
+    groups = group_actions(actions)
+    
+    if len(groups) == 1:
+        run(groups[0])
+        return results
+    
+    max_workers = min(len(groups), config['dida365'].get('action_concurrency', 4))
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='task-action') as executor:
+        list(executor.map(run_in_worker, groups))
+    return results
+
+def text_to_speech(text, op=''):
+    """合成语音并记录耗时，相同文字、音色和模型的音频直接从缓存读取"""
+    if tts_cache is None:
+        with metrics.timer('tts', op=op):
+            return silicon_api.text_to_speech(text)
+    
+    tts_model = silicon_api.models['tts']
+    key = tts_cache.key(text, tts_model['default_voice'], tts_model['model'])
+    audio_data = tts_cache.get(key)
+    if audio_data is None:
+        with metrics.timer('tts', op=op):
+            audio_data = silicon_api.text_to_speech(text)
+        tts_cache.put(key, audio_data)
+    return audio_data
+
+def warm_up_tts_cache():
+    """预先合成配置中的常用语句"""
+    tts_model = silicon_api.models['tts']
+    count = tts_cache.warm_up(
+        tts_cache_config.get('warmup_phrases', []),
+        tts_model['default_voice'],
+        tts_model['model'],
+        silicon_api.text_to_speech
+    )
+    logger.info(f"TTS缓存预热完成，新合成 {count} 条常用语句")
+
+def tts_available():
+    """TTS服务是否可用；熔断中时只返回文字回复，不合成语音"""
+    return breakers.get('tts').available()
+
+def start_early_tts(text):
+    """在后台合成整段回复（截断到 MAX_RESPONSE_CHARS）
+    
+    Returns:
+        tuple: (合成的文本, Future)
+    """
+    text = truncate_response(text)
+    return text, tts_executor.submit(text_to_speech, text, 'early')
+
+def start_speech_job(text):
+    """创建分句合成任务，浏览器通过 /api/tts-stream/<任务ID> 按顺序接收每句语音
+    
+    Returns:
+        tuple: (合成的文本, 任务ID)
+    """
+    silicon_config = config['silicon_flow']
+    job = SpeechJob(
+        text,
+        lambda sentence: text_to_speech(sentence, 'sentence'),
+        tts_executor,
+        concurrency=silicon_config.get('tts_sentence_concurrency', 3),
+        max_chars=silicon_config.get('tts_max_sentence_chars', 80)
+    )
+    return text, speech_jobs.add(job)
+
+def request_llm_reply(messages, command, start_speech=start_early_tts):
+    """调用LLM分析指令
+    
+    按指令复杂度选择模型，慢请求向备用模型发出对冲请求，见 model_router.ModelRouter。
+    开启流式模式（silicon_flow.llm_stream）时边接收边解析，response 字段一结束就
+    在后台开始合成语音，不必等待其余内容（如 actions）生成完毕。
+    
+    Args:
+        messages (list): chat_completion 的 messages 参数
+        command (str): 用户指令，用于选择模型
+        start_speech (callable): 开始合成语音的函数，start_early_tts 或 start_speech_job
+    
+    Returns:
+        tuple: (LLM回复的文本, 提前合成的语音)；调用失败时回复文本为None。
+            提前合成的语音为 start_speech 的返回值，没有提前合成时为None
+    """
+    if not config['silicon_flow'].get('llm_stream'):
+        try:
+            llm_response = silicon_api.routed_chat_completion(messages, command)
+        except Exception as e:
+            logger.error(f"LLM调用失败: {str(e)}")
+            return None, None
+        logger.debug(f"LLM返回结果: {json.dumps(llm_response, ensure_ascii=False, indent=2)}")
+        if not llm_response or 'choices' not in llm_response:
+            return None, None
+        return llm_response['choices'][0]['message']['content'], None
+    
+    parser = ResponseFieldParser()
+    early_tts = None
+    start_time = time.time()
+    try:
+        for delta in silicon_api.routed_chat_completion_stream(messages, command):
+            response = parser.feed(delta)
+            if response is None:
+                continue
+            metrics.observe('llm_response_field', time.time() - start_time)
+            if response and tts_available():
+                early_tts = start_speech(response)
+    except Exception as e:
+        logger.error(f"LLM流式调用失败: {str(e)}")
+        return None, early_tts
+    logger.debug(f"LLM返回结果: {parser.text}")
+    return parser.text, early_tts
+
+def analyze_command(command, messages, context, start_speech):
+    """分析指令：缓存中有相同指令和任务上下文的结果时直接使用，否则调用LLM
+    
+    Args:
+        command (str): 用户指令
+        messages (list): chat_completion 的 messages 参数
+        context (dict): 提示词中使用的任务上下文
+        start_speech (callable): 提前开始合成语音的函数，见 request_llm_reply
+    
+    Returns:
+        tuple: (LLM回复的文本, 提前合成的语音, 缓存键)；缓存键只在调用了LLM时返回，
+            回复中只有只读操作时调用方用它保存结果
+    """
+    if not llm_cache_config.get('enabled', True):
+        cache_key = None
+    else:
+        # 对冲请求由备用模型回答时，结果也保存在主模型的键下：同一指令总是路由到同一主模型
+        model = silicon_api.router.primary_model(command, silicon_api.models['llm'])
+        cache_key = llm_cache.make_key(command, context, model, previous_reply(messages))
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            logger.info("LLM分析结果缓存命中")
+            metrics.inc('command_path', path='llm_cache')
+            return cached, None, None
+    
+    metrics.inc('command_path', path='llm')
+    with metrics.timer('llm') as stage:
+        llm_content, early_tts = request_llm_reply(messages, command, start_speech)
+        if llm_content is None:
+            stage.fail()
+    return llm_content, early_tts, cache_key
+
+def synthesize_reply(text, early_tts=None):
+    """合成语音回复；提前合成的文本与最终回复一致时直接使用提前合成的结果
+    
+    Args:
+        text (str): 最终播放给用户的回复
+        early_tts (tuple, optional): request_llm_reply 返回的提前合成的语音
+    
+    Returns:
+        bytes: 音频数据
+    """
+    if early_tts is not None:
+        early_text, future = early_tts
+        if early_text == text:
+            metrics.inc('early_tts', result='used')
+            return future.result()
+        # 操作失败等情况下回复内容有变化，重新合成
+        future.cancel()
+        metrics.inc('early_tts', result='discarded')
+    return text_to_speech(text)
+
+def speech_for_reply(text, early_speech=None):
+    """获取回复的分句合成任务ID；提前创建的任务文本与最终回复一致时直接使用
+    
+    Args:
+        text (str): 最终播放给用户的回复
+        early_speech (tuple, optional): request_llm_reply 返回的 (文本, 任务ID)
+    
+    Returns:
+        str: 任务ID
+    """
+    if early_speech is not None:
+        early_text, speech_id = early_speech
+        if early_text == text:
+            metrics.inc('early_tts', result='used')
+            return speech_id
+        speech_jobs.cancel(speech_id)
+        metrics.inc('early_tts', result='discarded')
+    return start_speech_job(text)[1]
+
+def cancel_early_speech(early_speech, stream_audio):
+    """取消提前开始的语音合成，回复不再使用它时调用
+    
+    Args:
+        early_speech (tuple): request_llm_reply 返回的 (文本, 任务ID) 或 (文本, Future)，没有时为None
+        stream_audio (bool): 浏览器是否通过 /api/tts-stream 接收语音
+    """
+    if early_speech is None:
+        return
+    if stream_audio:
+        speech_jobs.cancel(early_speech[1])
+    else:
+        early_speech[1].cancel()
+
+@app.route('/api/tts-stream/<speech_id>', methods=['GET'])
+def tts_stream(speech_id):
+    """按顺序推送分句合成的语音（Server-Sent Events）
+    
+    每句合成完成后立即发送一条消息，包含该句的文本和 base64 编码的音频，
+    全部发送后发送 done 事件。任务只能读取一次。
+    """
+    job = speech_jobs.pop(speech_id)
+    if job is None:
+        return jsonify({'error': '语音不存在或已过期'}), 404
+    return Response(job.events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def reply_with_speech(response_text, early_tts, stream_audio, total_start_time, session_id, degraded=None):
+    """返回成功处理指令的回复：分句推送时返回语音任务ID，否则截断回复并附带整段语音
+    
+    Args:
+        response_text (str): 回复文本
+        early_tts (tuple): 提前合成的语音，没有时为None
+        stream_audio (bool): 浏览器是否通过 /api/tts-stream 接收语音
+        total_start_time (float): 开始处理指令的时间
+        session_id (str): 会话ID，浏览器在后续指令中带上以继续对话
+        degraded (list, optional): 本次回复降级的上游服务，如 ['llm']
+    
+    Returns:
+        Response: JSON响应
+    """
+    degraded = list(degraded or [])
+    # LLM 不可用时的回复只是查询本地缓存或提示稍后再试，指令并未被执行
+    executed = 'llm' not in degraded
+    if not tts_available():
+        logger.info(f"指令处理总耗时: {format_time_cost(total_start_time)}，TTS服务熔断中，只返回文字")
+        return jsonify({
+            'text': response_text if stream_audio else truncate_response(response_text),
+            'session_id': session_id,
+            'executed': executed,
+            'degraded': degraded + ['tts']
+        })
+    extra = {'degraded': degraded} if degraded else {}
+    
+    if stream_audio:
+        logger.info(f"指令处理总耗时: {format_time_cost(total_start_time)}，语音分句推送")
+        return jsonify({
+            'text': response_text,
+            'speech_id': speech_for_reply(response_text, early_tts),
+            'session_id': session_id,
+            'executed': executed,
+            **extra
+        })
+    
+    response_text = truncate_response(response_text)
+    
+    try:
+        logger.info("=== 阶段4：生成语音回复 ===")
+        stage_start_time = time.time()
+        audio_data = synthesize_reply(response_text, early_tts)
+        print("语音合成成功")
+        logger.info(f"TTS耗时: {format_time_cost(stage_start_time)}，"
+                    f"指令处理总耗时: {format_time_cost(total_start_time)}")
+        
+        return jsonify({
+            'text': response_text,
+            'audio': f'data:audio/wav;base64,{base64.b64encode(audio_data).decode("utf-8")}',
+            'session_id': session_id,
+            'executed': executed,
+            **extra
+        })
+    except Exception:
+        print("语音合成失败")
+        return jsonify({
+            'text': response_text,
+            'session_id': session_id,
+            'executed': executed,
+            **extra
+        })
+
 @app.route('/api/process-command', methods=['POST'])
 def process_command():
     """处理用户指令"""
+    with metrics.timer('command'):
+        return _process_command()
+
+def _process_command():
+    """处理用户指令的各个阶段，每个阶段的耗时记录到 metrics 中"""
+    total_start_time = time.time()
     try:
         # 验证请求格式
         if not request.is_json or request.json is None:
@@ -296,129 +820,162 @@ def process_command():
         
         logger.info("=== 阶段1：处理用户指令 ===")
         command = request.json.get('command')
+        # 浏览器通过 /api/tts-stream 接收分句合成的语音，回复不截断
+        stream_audio = bool(request.json.get('stream_audio'))
         logger.debug(f"收到指令: {command}")
         
         if not command:
             return jsonify({'error': 'No command provided'}), 400
         
-        # 获取任务和项目信息
+        conversation = conversations.get(request.json.get('session_id'))
         dida_api = get_dida_api()
-        tasks = dida_api.get_local_tasks(include_completed=False)  # 只获取未完成的任务
-        projects = dida_api.get_projects()
+        projects = dida_api.get_cached_projects()
+        
+        # 按日期/项目查询任务这类常见指令直接查询本地数据库回答，不调用LLM
+        intent = match_intent(command, projects) if fast_path_config.get('enabled', True) else None
+        if intent is not None:
+            logger.info(f"=== 快速路径：{intent['label']}的任务 ===")
+            with metrics.timer('fast_path', op=intent['rule']):
+                project_id = intent['project'].get('id') if intent['project'] else None
+                tasks = dida_api.get_local_tasks(include_completed=False, date=intent['date'],
+                                                 project_id=project_id)
+                response_text = format_reply(intent, tasks)
+            metrics.inc('command_path', path=f"fast_{intent['rule']}")
+            conversations.record(conversation, command, response_text)
+            return reply_with_speech(response_text, None, stream_audio, total_start_time, conversation.id)
+        
+        # 获取任务和项目信息
+        stage_start_time = time.time()
+        with metrics.timer('context'):
+            tasks = dida_api.get_local_tasks(include_completed=False)  # 只获取未完成的任务
+            # 按相关性排序并在 token 预算内截断任务列表，会话历史放在固定的系统提示词之后
+            messages, context = build_task_messages(command, tasks, projects, config.get('context'),
+                                                    history=conversation.history())
+        logger.info(f"加载任务上下文耗时: {format_time_cost(stage_start_time)}")
+        conversations.measure(conversation, messages)
         
         logger.debug(f"当前任务列表: {json.dumps(tasks, ensure_ascii=False, indent=2)}")
         logger.debug(f"当前项目列表: {json.dumps(projects, ensure_ascii=False, indent=2)}")
         
-        # 获取当前时间，包含星期信息
-        current_datetime = datetime.now(pytz.timezone('Asia/Shanghai'))
-        weekday_map = {
-            0: '一',
-            1: '二',
-            2: '三',
-            3: '四',
-            4: '五',
-            5: '六',
-            6: '日'
-        }
-        current_time = current_datetime.strftime(f"%Y年%m月%d日 星期{weekday_map[current_datetime.weekday()]} %H:%M")
-        
         logger.info("=== 阶段2：分析指令 ===")
-        llm_response = silicon_api.chat_completion([
-            {"role": "user", "content": TASK_ANALYSIS_PROMPT.format(
-                current_time=current_time,
-                command=command,
-                tasks=tasks,
-                projects=projects
-            )}
-        ])
-        logger.debug(f"LLM返回结果: {json.dumps(llm_response, ensure_ascii=False, indent=2)}")
+        stage_start_time = time.time()
+        llm_content, early_tts, cache_key = analyze_command(
+            command, messages, context, start_speech_job if stream_audio else start_early_tts)
+        logger.info(f"LLM耗时: {format_time_cost(stage_start_time)}")
         
-        if not llm_response or 'choices' not in llm_response:
+        if llm_content is None:
+            # LLM调用失败或熔断中：能确定日期或项目的查询用本地任务回答，其余指令提示稍后再试
             print("指令分析失败")
-            return jsonify({'error': 'AI服务暂时不可用，请稍后重试'}), 500
+            cancel_early_speech(early_tts, stream_audio)
+            intent = degraded_intent(command, projects)
+            tasks = []
+            if intent is not None:
+                project_id = intent['project'].get('id') if intent['project'] else None
+                tasks = dida_api.get_local_tasks(include_completed=False, date=intent['date'],
+                                                 project_id=project_id)
+            metrics.inc('command_path', path='degraded')
+            return reply_with_speech(format_degraded_reply(intent, tasks), None, stream_audio,
+                                     total_start_time, conversation.id, degraded=['llm'])
         
         print("指令分析成功")
-        response_content = llm_response['choices'][0]['message']['content']
-        cleaned_content = response_content.strip()
-        
-        try:
-            # 尝试解析JSON响应
-            if cleaned_content.startswith('```json'):
-                cleaned_content = cleaned_content[7:]
-            if cleaned_content.endswith('```'):
-                cleaned_content = cleaned_content[:-3]
-            response_data = json.loads(cleaned_content.strip())
-        except json.JSONDecodeError:
-            # 如果不是JSON格式，创建一个普通响应
-            response_data = {
-                "response": cleaned_content
-            }
+        response_data = parse_llm_reply(llm_content)
         
         # 如果需要执行任务操作
-        if 'action' in response_data and 'task_data' in response_data:
-            logger.info("=== 阶段3：执行任务操作 ===")
-            success, result_message = execute_task_action(response_data)
+        actions = collect_actions(response_data)
+        if cache_key and is_read_only(actions):
+            llm_cache.put(cache_key, llm_content)
+        if actions:
+            logger.info(f"=== 阶段3：执行任务操作（{len(actions)}个） ===")
+            stage_start_time = time.time()
+            results = execute_task_actions(actions)
+            llm_cache.invalidate_on_writes(actions, results)
+            logger.info(f"执行任务操作耗时: {format_time_cost(stage_start_time)}")
+            
+            success, response_text, result_message = summarize_action_results(response_data, results)
+            conversations.record(conversation, command, response_text, actions)
             
+            if not success and stream_audio:
+                return jsonify({
+                    'text': response_text,
+                    'speech_id': speech_for_reply(response_text, early_tts) if tts_available() else None,
+                    'session_id': conversation.id,
+                    'error': result_message
+                }), 500
             if not success:
                 try:
                     logger.info("=== 阶段4：生成错误语音回复 ===")
-                    error_response = f"抱歉，{result_message}"
-                    audio_data = silicon_api.text_to_speech(error_response)
+                    error_response = response_text
+                    audio_data = synthesize_reply(error_response, early_tts)
                     print("语音合成成功")
                     return jsonify({
                         'text': error_response,
                         'audio': f'data:audio/wav;base64,{base64.b64encode(audio_data).decode("utf-8")}',
+                        'session_id': conversation.id,
                         'error': result_message
                     }), 500
                 except Exception:
                     print("语音合成失败")
                     return jsonify({
                         'text': error_response,
+                        'session_id': conversation.id,
                         'error': result_message
                     }), 500
-            
-            # 使用LLM返回的友好回复
-            response_text = response_data.get('response', f"好的，{result_message}")
         else:
             # 如果只是普通回复，只使用response字段中的内容
-            response_text = response_data.get('response', cleaned_content)
-        
-        # 如果响应文本太长，只取前500个字符
-        if len(response_text) > 500:
-            response_text = response_text[:497] + "..."
+            response_text = response_data.get('response', llm_content.strip())
+            conversations.record(conversation, command, response_text)
         
-        try:
-            logger.info("=== 阶段4：生成语音回复 ===")
-            audio_data = silicon_api.text_to_speech(response_text)
-            print("语音合成成功")
-            
-            return jsonify({
-                'text': response_text,
-                'audio': f'data:audio/wav;base64,{base64.b64encode(audio_data).decode("utf-8")}',
-                'executed': True
-            })
-        except Exception:
-            print("语音合成失败")
-            return jsonify({
-                'text': response_text,
-                'executed': True
-            })
+        return reply_with_speech(response_text, early_tts, stream_audio, total_start_time, conversation.id)
             
     except Exception as e:
         print("指令处理失败")
         return jsonify({'error': str(e)}), 500
 
+def preconnect_upstreams():
+    """预先建立到硅基流动和滴答清单的keep-alive连接"""
+    sessions.preconnect('silicon_flow', config['silicon_flow']['api_base_url'], connections=2)
+    sessions.preconnect('dida365', config['dida365']['api_base_url'])
+
 @app.route('/api/sync', methods=['POST'])
 def sync_tasks():
-    """同步任务数据"""
+    """同步任务数据
+    
+    已有同步在进行时等待并返回其结果；去抖窗口内的重复请求直接返回上次结果
+    """
     logger.info("=== 同步数据 ===")
-    try:
-        get_dida_api().sync_with_server()
-        print("数据同步成功")
-        return jsonify({'status': 'success'})
-    except Exception as e:
+    result = sync_scheduler.request_sync(force=request.args.get('force') == '1')
+    if result['status'] != 'success':
         print("数据同步失败")
-        return jsonify({'error': str(e)}), 500
+        return jsonify({'error': result['error'], 'sync': result}), 500
+    print("数据同步成功")
+    return jsonify({'status': 'success', 'stats': result['stats'], 'sync': result})
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """以 Prometheus 文本格式输出各阶段的延迟和错误指标"""
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/cache/status', methods=['GET'])
+def cache_status():
+    """获取LLM结果缓存、TTS缓存的命中率，以及会话提示词前缀的复用情况"""
+    return jsonify({
+        'llm': llm_cache.stats(),
+        'tts': tts_cache.stats() if tts_cache else None,
+        'prompt': conversations.stats()
+    })
+
+@app.route('/api/upstreams/status', methods=['GET'])
+def upstreams_status():
+    """获取各上游服务（asr、llm、tts、dida365）熔断器的状态"""
+    return jsonify(breakers.status())
+
+@app.route('/api/sync/status', methods=['GET'])
+def sync_status():
+    """获取同步状态、最近的同步记录，以及 outbox 中待写回的修改"""
+    status = sync_scheduler.status()
+    if config['dida365'].get('write_mode') == 'write_behind' or _task_outbox is not None:
+        status['outbox'] = get_task_outbox().status()
+    return jsonify(status)
 
 if __name__ == '__main__':
     # 使用配置文件中的服务器设置
@@ -432,16 +989,32 @@ if __name__ == '__main__':
         r'ssl\cr8z.me.key'
     )
     
+    # 预先建立到上游服务的连接，减少首次请求的握手延迟
+    if config.get('http', {}).get('preconnect'):
+        threading.Thread(target=preconnect_upstreams, daemon=True).start()
+    
     # 程序启动时同步数据库
     logger.info("=== 初始化：同步数据 ===")
-    try:
-        with app.app_context():
-            dida_api = get_dida_api()
-            dida_api.sync_with_server()
-            print("初始数据同步成功")
-    except Exception as e:
+    result = sync_scheduler.request_sync(force=True, trigger='startup')
+    if result['status'] == 'success':
+        print("初始数据同步成功")
+    else:
         print("初始数据同步失败")
-        logger.error(f"初始同步失败: {str(e)}")
+        logger.error(f"初始同步失败: {result['error']}")
+    
+    # 启动后台定时同步
+    sync_scheduler.start()
+    
+    # 访问令牌过期前在后台主动刷新
+    DidaAPI.shared().start_token_refresher(margin=config['dida365'].get('token_refresh_margin', 3600))
+    
+    # 在后台预先合成常用语句
+    if tts_cache is not None:
+        threading.Thread(target=warm_up_tts_cache, name='tts-warmup', daemon=True).start()
+    
+    # 继续发送上次退出时未写回的修改
+    if config['dida365'].get('write_mode') == 'write_behind':
+        get_task_outbox()
     
     # 启动服务器
     app.run(
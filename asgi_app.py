@@ -0,0 +1,728 @@
+from quart import Quart, render_template, request, jsonify, Response
+from async_api import AsyncSiliconFlowAPI, AsyncDidaAPI, create_async_client
+from dida365_api import DidaAPI
+from sync_scheduler import SyncScheduler
+from outbox import TaskOutbox
+from speech_stream import AsyncSpeechJob, SpeechJobs
+from streaming_asr import DEFAULT_STREAMING_ASR_CONFIG, AsyncTranscriptionStream, TranscriptionStreams
+from llm_cache import LLMResultCache, is_read_only, previous_reply
+from fast_path import match_intent, format_reply, degraded_intent, format_degraded_reply
+from circuit_breaker import CircuitOpenError, breakers
+from conversation import ConversationStore
+from tts_cache import TTSCache
+from audio_upload import (AudioSpool, AudioTooLarge, DEFAULT_SPOOL_BYTES, MAX_AUDIO_BYTES,
+                          MULTIPART_OVERHEAD_BYTES, audio_filename, audio_type)
+from metrics import metrics
+from pipeline import (build_task_messages, parse_llm_reply, collect_actions, group_actions,
+                      summarize_action_results, truncate_response, ResponseFieldParser)
+from logging_config import setup_logging
+import asyncio
+import base64
+import json
+import time
+
+# asyncio 版本的语音指令服务：ASR → LLM → 滴答清单 → TTS 整条链路在事件循环中执行，
+# 等待上游响应时不占用线程。接口与 app.py 相同，使用 ASGI 服务器运行：
+#     uvicorn asgi_app:app --host 0.0.0.0 --port 1005
+
+# 设置日志记录器
+logger = setup_logging()
+
+def format_time_cost(start_time):
+    """计算并格式化耗时"""
+    return f"{time.time() - start_time:.2f}秒"
+
+# 加载配置文件
+with open('config.json', 'r', encoding='utf-8') as f:
+    config = json.load(f)
+
+app = Quart(__name__)
+
+# 语音上传的大小上限和内存缓冲区大小；Quart 默认限制请求体为16MB
+audio_upload_config = config.get('audio_upload', {})
+app.config['MAX_CONTENT_LENGTH'] = audio_upload_config.get('max_bytes', MAX_AUDIO_BYTES) + MULTIPART_OVERHEAD_BYTES
+
+# 录音过程中的流式识别，所有识别流共享同时识别的语音段数
+streaming_asr_config = {**DEFAULT_STREAMING_ASR_CONFIG, **config.get('streaming_asr', {})}
+asr_semaphore = asyncio.Semaphore(streaming_asr_config['concurrency'])
+transcription_streams = TranscriptionStreams(ttl=streaming_asr_config['ttl'])
+
+# 异步客户端在服务启动时创建（需要运行中的事件循环）
+silicon_api: AsyncSiliconFlowAPI = None
+dida_api: AsyncDidaAPI = None
+task_outbox: TaskOutbox = None
+_task_outbox_lock = asyncio.Lock()
+_http_clients = []
+
+# 等待浏览器读取的分句合成任务
+speech_jobs = SpeechJobs()
+
+# TTS音频缓存（内存 + 磁盘），磁盘读写在线程中执行
+tts_cache_config = config.get('tts_cache', {})
+tts_cache = TTSCache(
+    directory=tts_cache_config.get('directory', 'tts_cache'),
+    memory_max_bytes=tts_cache_config.get('memory_max_bytes', 32 * 1024 * 1024),
+    disk_max_bytes=tts_cache_config.get('disk_max_bytes', 256 * 1024 * 1024)
+) if tts_cache_config.get('enabled', True) else None
+
+# 只读指令的LLM分析结果缓存
+llm_cache_config = config.get('llm_cache', {})
+llm_cache = LLMResultCache(
+    max_entries=llm_cache_config.get('max_entries', 256),
+    ttl=llm_cache_config.get('ttl', 300)
+)
+
+# 常见查询指令的规则快速路径
+fast_path_config = config.get('fast_path', {})
+
+# 多轮对话的会话记录，按浏览器传来的 session_id 区分
+conversations = ConversationStore(config.get('conversation'))
+
+def run_sync():
+    """在当前线程中执行一次与滴答清单的同步，任务有变化时清空LLM结果缓存"""
+    api = DidaAPI.shared()
+    try:
+        with metrics.timer('sync'):
+            stats = api.sync_with_server()
+        if stats.get('tasks_written') or stats.get('tasks_completed') or stats.get('tasks_deleted'):
+            llm_cache.invalidate('sync')
+        return stats
+    finally:
+        api.close()
+
+# 后台同步调度器：同步本身在线程中执行
+sync_scheduler = SyncScheduler(
+    run_sync,
+    interval=config['dida365'].get('sync_interval', 300),
+    debounce=config['dida365'].get('sync_debounce', 30)
+)
+
+def write_behind():
+    return config['dida365'].get('write_mode') == 'write_behind'
+
+@app.before_serving
+async def startup():
+    """创建异步客户端，执行初始同步并启动后台任务"""
+    global silicon_api, dida_api
+    silicon_client = create_async_client(config.get('http'))
+    dida_client = create_async_client(config.get('http'))
+    _http_clients.extend([silicon_client, dida_client])
+
+    shared_dida = await asyncio.to_thread(DidaAPI.shared)
+    silicon_api = AsyncSiliconFlowAPI(silicon_client)
+    dida_api = AsyncDidaAPI(shared_dida, dida_client)
+
+    logger.info("=== 初始化：同步数据 ===")
+    result = await asyncio.to_thread(sync_scheduler.request_sync, True, 'startup')
+    if result['status'] != 'success':
+        logger.error(f"初始同步失败: {result['error']}")
+    sync_scheduler.start()
+    shared_dida.start_token_refresher(margin=config['dida365'].get('token_refresh_margin', 3600))
+    if tts_cache is not None:
+        app.add_background_task(warm_up_tts_cache)
+
+    if write_behind():
+        await get_task_outbox()
+
+async def get_task_outbox():
+    """获取任务 outbox，首次调用时创建并启动后台发送线程（同 app.get_task_outbox）"""
+    global task_outbox
+    async with _task_outbox_lock:
+        if task_outbox is None:
+            outbox = TaskOutbox(
+                dida_api.dida_api,
+                merge_window=config['dida365'].get('outbox_merge_window', 2),
+                max_attempts=config['dida365'].get('outbox_max_attempts', 8)
+            )
+            await asyncio.to_thread(outbox.start)
+            task_outbox = outbox
+    return task_outbox
+
+@app.after_serving
+async def shutdown():
+    """停止后台任务并关闭异步客户端"""
+    sync_scheduler.stop(timeout=1)
+    if task_outbox:
+        task_outbox.stop(timeout=1)
+    for client in _http_clients:
+        await client.close()
+
+def save_config():
+    """保存配置到文件"""
+    with open('config.json', 'w', encoding='utf-8') as f:
+        json.dump(config, f, ensure_ascii=False, indent=4)
+
+@app.route('/api/settings', methods=['GET', 'POST'])
+async def handle_settings():
+    """处理设置的获取和更新"""
+    if request.method == 'GET':
+        return jsonify({
+            'llm_model': config.get('llm_model', 'gpt-4')
+        })
+    try:
+        data = await request.get_json()
+        if 'llm_model' in data:
+            config['llm_model'] = data['llm_model']
+            config['silicon_flow']['models']['llm'] = data['llm_model']
+            silicon_api.models['llm'] = data['llm_model']
+            await asyncio.to_thread(save_config)
+        return jsonify({'status': 'success'})
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@app.route('/')
+async def index():
+    """渲染主页"""
+    return await render_template('index.html')
+
+@app.route('/api/speech-to-text', methods=['POST'])
+async def speech_to_text():
+    """处理语音转文字请求，音频直接在内存中上传给ASR服务"""
+    total_start_time = time.time()
+    try:
+        data = await request.get_json(silent=True)
+        if data is None:
+            return jsonify({'error': '请求必须是JSON格式'}), 400
+
+        audio_data = data.get('audio')
+        if not audio_data:
+            return jsonify({'error': '未提供音频数据'}), 400
+
+        if ',' in audio_data:
+            header, encoded = audio_data.split(',', 1)
+            if 'audio/webm' not in header:
+                return jsonify({'error': '不支持的音频格式，仅支持WEBM格式'}), 400
+        else:
+            encoded = audio_data
+
+        audio_bytes = base64.b64decode(encoded)
+        if len(audio_bytes) > audio_upload_config.get('max_bytes', MAX_AUDIO_BYTES):
+            return jsonify({'error': '音频文件过大（超过50MB）'}), 400
+
+        return await transcribe_upload(audio_bytes, 'audio.webm', 'audio/webm', total_start_time)
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/speech-to-text/upload', methods=['POST'])
+async def upload_speech():
+    """处理语音转文字请求，音频不经过 base64 编码（同 app.upload_speech）
+
+    请求体按块读入有大小上限的缓冲区，较大的音频转存到临时文件，再由 aiohttp 按块上传
+    """
+    total_start_time = time.time()
+    max_bytes = audio_upload_config.get('max_bytes', MAX_AUDIO_BYTES)
+    spool = AudioSpool(max_bytes, audio_upload_config.get('spool_memory_bytes', DEFAULT_SPOOL_BYTES))
+    try:
+        if request.content_length and request.content_length > max_bytes + MULTIPART_OVERHEAD_BYTES:
+            return jsonify({'error': f'音频文件过大（超过{max_bytes // (1024 * 1024)}MB）'}), 413
+
+        if request.mimetype == 'multipart/form-data':
+            upload = (await request.files).get('audio')
+            if upload is None:
+                return jsonify({'error': '未提供音频数据'}), 400
+            content_type = audio_type(upload.mimetype or 'application/octet-stream')
+            if content_type is None:
+                return jsonify({'error': f'不支持的音频格式：{upload.mimetype}'}), 415
+            await asyncio.to_thread(spool.read_from, upload.stream)
+        else:
+            content_type = audio_type(request.mimetype)
+            if content_type is None:
+                return jsonify({'error': f'不支持的音频格式：{request.mimetype}'}), 415
+            async for chunk in request.body:
+                if spool.in_memory:
+                    spool.write(chunk)
+                else:
+                    await asyncio.to_thread(spool.write, chunk)
+
+        if not spool.size:
+            return jsonify({'error': '未提供音频数据'}), 400
+        return await transcribe_upload(spool.payload(), audio_filename(content_type), content_type,
+                                       total_start_time)
+
+    except AudioTooLarge as e:
+        return jsonify({'error': str(e)}), 413
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        spool.close()
+
+async def transcribe_segment(wav):
+    """识别流式识别中切分出的一个语音段"""
+    async with asr_semaphore:
+        with metrics.timer('asr', op='segment') as stage:
+            result = await silicon_api.transcribe_audio(wav, 'segment.wav', 'audio/wav')
+            if 'error' in result:
+                stage.fail()
+    return result
+
+@app.route('/api/asr-stream', methods=['POST'])
+async def start_asr_stream():
+    """开始一次流式识别（同 app.start_asr_stream）"""
+    if not streaming_asr_config.get('enabled', True):
+        return jsonify({'error': '未启用流式识别'}), 404
+    if not breakers.get('asr').available():
+        return jsonify({'error': '语音识别服务暂时不可用，请使用文字输入', 'degraded': 'asr'}), 503
+    stream = AsyncTranscriptionStream(transcribe_segment, streaming_asr_config)
+    return jsonify({'stream_id': transcription_streams.add(stream), 'sample_rate': stream.sample_rate})
+
+@app.route('/api/asr-stream/<stream_id>', methods=['POST'])
+async def feed_asr_stream(stream_id):
+    """接收一块录音（16位小端单声道PCM），同 app.feed_asr_stream"""
+    stream = transcription_streams.get(stream_id)
+    if stream is None:
+        return jsonify({'error': '识别流不存在或已结束'}), 404
+    try:
+        segments = stream.feed(await request.get_data(cache=False))
+    except ValueError as e:
+        transcription_streams.pop(stream_id)
+        stream.cancel()
+        return jsonify({'error': str(e)}), 413
+    return jsonify({'segments': segments, 'text': stream.partial_text()})
+
+@app.route('/api/asr-stream/<stream_id>', methods=['DELETE'])
+async def cancel_asr_stream(stream_id):
+    """取消识别流（同 app.cancel_asr_stream）"""
+    stream = transcription_streams.pop(stream_id)
+    if stream is None:
+        return jsonify({'error': '识别流不存在或已结束'}), 404
+    stream.cancel()
+    return jsonify({'cancelled': True})
+
+@app.route('/api/asr-stream/<stream_id>/finish', methods=['POST'])
+async def finish_asr_stream(stream_id):
+    """录音结束，等待最后的语音段识别完成并返回全部文字（同 app.finish_asr_stream）"""
+    total_start_time = time.time()
+    stream = transcription_streams.pop(stream_id)
+    if stream is None:
+        return jsonify({'error': '识别流不存在或已结束'}), 404
+
+    result = await stream.finish()
+    logger.info(f"录音结束后等待识别耗时: {format_time_cost(total_start_time)}，"
+                f"共 {result.get('segments', 0)} 个语音段")
+
+    if result.get('degraded'):
+        return jsonify({'error': '语音识别服务暂时不可用，请使用文字输入', 'degraded': 'asr'}), 503
+    if 'error' in result:
+        return jsonify({'error': result['error']}), 500
+    if not result['text']:
+        return jsonify({'error': '未能识别出有效的语音内容'}), 400
+    return jsonify({'text': result['text']})
+
+async def transcribe_upload(audio, filename, content_type, total_start_time):
+    """调用ASR服务识别音频并返回识别结果（同 app.transcribe_upload）"""
+    with metrics.timer('asr') as stage:
+        result = await silicon_api.transcribe_audio(audio, filename, content_type)
+        if 'error' in result:
+            stage.fail()
+
+    if result.get('degraded'):
+        return jsonify({'error': '语音识别服务暂时不可用，请使用文字输入', 'degraded': 'asr'}), 503
+    if 'error' in result:
+        return jsonify({'error': result['error']}), 500
+
+    transcribed_text = result.get('text', '')
+    if not transcribed_text.strip():
+        return jsonify({'error': '未能识别出有效的语音内容'}), 400
+
+    logger.info(f"语音识别总耗时: {format_time_cost(total_start_time)}")
+    return jsonify({'text': transcribed_text})
+
+async def write_task(method, *args, **kwargs):
+    """创建或更新任务：write_behind 模式或滴答清单熔断中时写入 outbox（本地操作），否则异步调用滴答清单API"""
+    if write_behind() or not breakers.get('dida365').available():
+        outbox = await get_task_outbox()
+        return await dida_api.run_local(getattr(outbox, method), *args, **kwargs)
+    return await getattr(dida_api, method)(*args, **kwargs)
+
+async def execute_task_action(action_data):
+    """执行任务操作（同 app.execute_task_action）
+
+    Returns:
+        tuple: (是否成功, 结果信息)
+    """
+    action = action_data.get('action')
+    task_data = dict(action_data.get('task_data') or {})
+    if not action:
+        return False, "缺少操作类型"
+
+    if action == 'create_task':
+        if not task_data.get('title'):
+            return False, "任务标题不能为空"
+        if 'startDate' in task_data or 'dueDate' in task_data:
+            task_data.setdefault('timeZone', 'Asia/Shanghai')
+        try:
+            await write_task('create_task', **task_data)
+        except Exception as e:
+            return False, f"创建任务失败：{str(e)}"
+        return True, f"已成功创建任务：{task_data.get('title')}"
+
+    if action == 'update_task':
+        if not task_data.get('id'):
+            return False, "缺少任务ID"
+        if not task_data.get('projectId'):
+            return False, "缺少项目ID"
+        if 'startDate' in task_data or 'dueDate' in task_data:
+            task_data.setdefault('timeZone', 'Asia/Shanghai')
+        task_id = task_data.pop('id')
+        project_id = task_data.pop('projectId')
+        try:
+            result = await write_task('update_task', task_id, project_id, **task_data)
+        except Exception as e:
+            return False, f"更新任务失败：{str(e)}"
+        return True, f"已更新任务：{result.get('title', '未知任务')}"
+
+    if action == 'get_task':
+        try:
+            if not task_data.get('id'):
+                if not (task_data.get('projectId') or task_data.get('date')):
+                    return False, "缺少任务ID"
+                tasks = await dida_api.get_local_tasks(
+                    include_completed=False,
+                    project_id=task_data.get('projectId'),
+                    date=task_data.get('date')
+                )
+                if not tasks:
+                    if task_data.get('date'):
+                        return False, "在指定日期没有找到任何任务"
+                    return False, "没有找到任何任务"
+                task_list = "\n".join([f"- {task.get('title')}" for task in tasks])
+                return True, f"找到以下任务：\n{task_list}"
+
+            if not task_data.get('projectId'):
+                return False, "缺少项目ID"
+            try:
+                result = await dida_api.get_task(task_data['projectId'], task_data['id'])
+            except CircuitOpenError:
+                # 滴答清单熔断中，使用本地缓存的任务
+                result = await dida_api.run_local(dida_api.dida_api.get_local_task, task_data['id'])
+                if result is None:
+                    raise
+            return True, f"已找到任务：{result.get('title', '未知任务')}"
+        except Exception as e:
+            return False, f"获取任务失败：{str(e)}"
+
+    return False, f"不支持的操作类型：{action}"
+
+async def execute_task_actions(actions):
+    """并发执行多个任务操作（同 app.execute_task_actions）"""
+    results = [None] * len(actions)
+    semaphore = asyncio.Semaphore(config['dida365'].get('action_concurrency', 4))
+
+    async def run(indexes):
+        async with semaphore:
+            for index in indexes:
+                action = actions[index]
+                with metrics.timer('action', op=str(action.get('action'))) as stage:
+                    results[index] = await execute_task_action(action)
+                    if not results[index][0]:
+                        stage.fail()
+
+    await asyncio.gather(*(run(indexes) for indexes in group_actions(actions)))
+    return results
+
+async def text_to_speech(text, op=''):
+    """合成语音并记录耗时，相同文字、音色和模型的音频直接从缓存读取"""
+    if tts_cache is None:
+        with metrics.timer('tts', op=op):
+            return await silicon_api.text_to_speech(text)
+
+    tts_model = silicon_api.models['tts']
+    key = tts_cache.key(text, tts_model['default_voice'], tts_model['model'])
+    audio_data = tts_cache.get(key, memory_only=True)
+    if audio_data is None:
+        audio_data = await asyncio.to_thread(tts_cache.get, key)
+    if audio_data is None:
+        with metrics.timer('tts', op=op):
+            audio_data = await silicon_api.text_to_speech(text)
+        await asyncio.to_thread(tts_cache.put, key, audio_data)
+    return audio_data
+
+async def warm_up_tts_cache():
+    """预先合成配置中的常用语句（同 app.warm_up_tts_cache）"""
+    for phrase in tts_cache_config.get('warmup_phrases', []):
+        try:
+            await text_to_speech(phrase, 'warmup')
+        except Exception as e:
+            logger.error(f"预合成语音失败（{phrase}）: {str(e)}")
+
+def _discard_result(task):
+    # 取出被丢弃任务的异常，避免 "Task exception was never retrieved" 警告
+    if not task.cancelled():
+        task.exception()
+
+def tts_available():
+    """TTS服务是否可用；熔断中时只返回文字回复，不合成语音"""
+    return breakers.get('tts').available()
+
+def start_early_tts(text):
+    """在后台合成整段回复（截断到 MAX_RESPONSE_CHARS），返回 (合成的文本, asyncio.Task)"""
+    text = truncate_response(text)
+    task = asyncio.create_task(text_to_speech(text, 'early'))
+    task.add_done_callback(_discard_result)
+    return text, task
+
+def start_speech_job(text):
+    """创建分句合成任务，返回 (合成的文本, 任务ID)"""
+    silicon_config = config['silicon_flow']
+    job = AsyncSpeechJob(
+        text,
+        lambda sentence: text_to_speech(sentence, 'sentence'),
+        concurrency=silicon_config.get('tts_sentence_concurrency', 3),
+        max_chars=silicon_config.get('tts_max_sentence_chars', 80)
+    )
+    return text, speech_jobs.add(job)
+
+async def request_llm_reply(messages, command, start_speech=start_early_tts):
+    """调用LLM分析指令（同 app.request_llm_reply）"""
+    if not config['silicon_flow'].get('llm_stream'):
+        try:
+            llm_response = await silicon_api.routed_chat_completion(messages, command)
+        except Exception as e:
+            logger.error(f"LLM调用失败: {str(e)}")
+            return None, None
+        if not llm_response or 'choices' not in llm_response:
+            return None, None
+        return llm_response['choices'][0]['message']['content'], None
+
+    parser = ResponseFieldParser()
+    early_tts = None
+    start_time = time.time()
+    try:
+        async for delta in silicon_api.routed_chat_completion_stream(messages, command):
+            response = parser.feed(delta)
+            if response is None:
+                continue
+            metrics.observe('llm_response_field', time.time() - start_time)
+            if response and tts_available():
+                early_tts = start_speech(response)
+    except Exception as e:
+        logger.error(f"LLM流式调用失败: {str(e)}")
+        return None, early_tts
+    return parser.text, early_tts
+
+async def synthesize(text, early_tts=None):
+    """生成语音回复，提前合成的文本与最终回复一致时直接使用；失败时返回None"""
+    try:
+        if early_tts is not None and early_tts[0] == text:
+            metrics.inc('early_tts', result='used')
+            audio_data = await early_tts[1]
+        else:
+            if early_tts is not None:
+                early_tts[1].cancel()
+                metrics.inc('early_tts', result='discarded')
+            audio_data = await text_to_speech(text)
+        return f'data:audio/wav;base64,{base64.b64encode(audio_data).decode("utf-8")}'
+    except Exception as e:
+        logger.error(f"语音合成失败: {str(e)}")
+        return None
+
+async def analyze_command(command, messages, context, start_speech):
+    """分析指令，只读指令优先使用缓存的结果（同 app.analyze_command）"""
+    if not llm_cache_config.get('enabled', True):
+        cache_key = None
+    else:
+        # 对冲请求由备用模型回答时，结果也保存在主模型的键下：同一指令总是路由到同一主模型
+        model = silicon_api.router.primary_model(command, silicon_api.models['llm'])
+        cache_key = llm_cache.make_key(command, context, model, previous_reply(messages))
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            metrics.inc('command_path', path='llm_cache')
+            return cached, None, None
+
+    metrics.inc('command_path', path='llm')
+    with metrics.timer('llm') as stage:
+        llm_content, early_tts = await request_llm_reply(messages, command, start_speech)
+        if llm_content is None:
+            stage.fail()
+    return llm_content, early_tts, cache_key
+
+def speech_for_reply(text, early_speech=None):
+    """获取回复的分句合成任务ID（同 app.speech_for_reply）"""
+    if early_speech is not None:
+        early_text, speech_id = early_speech
+        if early_text == text:
+            metrics.inc('early_tts', result='used')
+            return speech_id
+        speech_jobs.cancel(speech_id)
+        metrics.inc('early_tts', result='discarded')
+    return start_speech_job(text)[1]
+
+def cancel_early_speech(early_speech, stream_audio):
+    if early_speech is None:
+        return
+    if stream_audio:
+        speech_jobs.cancel(early_speech[1])
+    else:
+        early_speech[1].cancel()
+
+@app.route('/api/tts-stream/<speech_id>', methods=['GET'])
+async def tts_stream(speech_id):
+    """按顺序推送分句合成的语音（Server-Sent Events，同 app.tts_stream）"""
+    job = speech_jobs.pop(speech_id)
+    if job is None:
+        return jsonify({'error': '语音不存在或已过期'}), 404
+    response = Response(job.events(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.timeout = None
+    return response
+
+async def reply_with_speech(response_text, early_tts, stream_audio, total_start_time, session_id, degraded=None):
+    """返回成功处理指令的回复（同 app.reply_with_speech）"""
+    degraded = list(degraded or [])
+    # LLM 不可用时的回复只是查询本地缓存或提示稍后再试，指令并未被执行
+    executed = 'llm' not in degraded
+    if not tts_available():
+        logger.info(f"指令处理总耗时: {format_time_cost(total_start_time)}，TTS服务熔断中，只返回文字")
+        return jsonify({
+            'text': response_text if stream_audio else truncate_response(response_text),
+            'session_id': session_id,
+            'executed': executed,
+            'degraded': degraded + ['tts']
+        })
+    extra = {'degraded': degraded} if degraded else {}
+
+    if stream_audio:
+        logger.info(f"指令处理总耗时: {format_time_cost(total_start_time)}，语音分句推送")
+        return jsonify({
+            'text': response_text,
+            'speech_id': speech_for_reply(response_text, early_tts),
+            'session_id': session_id,
+            'executed': executed,
+            **extra
+        })
+
+    response_text = truncate_response(response_text)
+    body = {'text': response_text, 'session_id': session_id, 'executed': executed, **extra}
+    audio = await synthesize(response_text, early_tts)
+    if audio:
+        body['audio'] = audio
+    logger.info(f"指令处理总耗时: {format_time_cost(total_start_time)}")
+    return jsonify(body)
+
+@app.route('/api/process-command', methods=['POST'])
+async def process_command():
+    """处理用户指令"""
+    with metrics.timer('command'):
+        return await _process_command()
+
+async def _process_command():
+    total_start_time = time.time()
+    try:
+        data = await request.get_json(silent=True)
+        if data is None:
+            return jsonify({'error': 'Content-Type must be application/json'}), 400
+        command = data.get('command')
+        if not command:
+            return jsonify({'error': 'No command provided'}), 400
+        stream_audio = bool(data.get('stream_audio'))
+
+        conversation = conversations.get(data.get('session_id'))
+        projects = await dida_api.get_cached_projects()
+        intent = match_intent(command, projects) if fast_path_config.get('enabled', True) else None
+        if intent is not None:
+            with metrics.timer('fast_path', op=intent['rule']):
+                project_id = intent['project'].get('id') if intent['project'] else None
+                tasks = await dida_api.get_local_tasks(include_completed=False, date=intent['date'],
+                                                       project_id=project_id)
+                response_text = format_reply(intent, tasks)
+            metrics.inc('command_path', path=f"fast_{intent['rule']}")
+            conversations.record(conversation, command, response_text)
+            return await reply_with_speech(response_text, None, stream_audio, total_start_time, conversation.id)
+
+        with metrics.timer('context'):
+            tasks = await dida_api.get_local_tasks(include_completed=False)
+            messages, context = build_task_messages(command, tasks, projects, config.get('context'),
+                                                    history=conversation.history())
+        conversations.measure(conversation, messages)
+
+        llm_content, early_tts, cache_key = await analyze_command(
+            command, messages, context, start_speech_job if stream_audio else start_early_tts)
+        if llm_content is None:
+            # LLM调用失败或熔断中：能确定日期或项目的查询用本地任务回答，其余指令提示稍后再试
+            cancel_early_speech(early_tts, stream_audio)
+            intent = degraded_intent(command, projects)
+            tasks = []
+            if intent is not None:
+                project_id = intent['project'].get('id') if intent['project'] else None
+                tasks = await dida_api.get_local_tasks(include_completed=False, date=intent['date'],
+                                                       project_id=project_id)
+            metrics.inc('command_path', path='degraded')
+            return await reply_with_speech(format_degraded_reply(intent, tasks), None, stream_audio,
+                                           total_start_time, conversation.id, degraded=['llm'])
+
+        response_data = parse_llm_reply(llm_content)
+
+        actions = collect_actions(response_data)
+        if cache_key and is_read_only(actions):
+            llm_cache.put(cache_key, llm_content)
+        if actions:
+            results = await execute_task_actions(actions)
+            llm_cache.invalidate_on_writes(actions, results)
+            success, response_text, result_message = summarize_action_results(response_data, results)
+            conversations.record(conversation, command, response_text, actions)
+            if not success:
+                body = {'text': response_text, 'session_id': conversation.id, 'error': result_message}
+                if stream_audio:
+                    if tts_available():
+                        body['speech_id'] = speech_for_reply(response_text, early_tts)
+                else:
+                    audio = await synthesize(response_text, early_tts)
+                    if audio:
+                        body['audio'] = audio
+                return jsonify(body), 500
+        else:
+            response_text = response_data.get('response', llm_content.strip())
+            conversations.record(conversation, command, response_text)
+
+        return await reply_with_speech(response_text, early_tts, stream_audio, total_start_time, conversation.id)
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/sync', methods=['POST'])
+async def sync_tasks():
+    """同步任务数据（同步在线程中执行，并发请求共享同一次同步）"""
+    result = await asyncio.to_thread(sync_scheduler.request_sync, request.args.get('force') == '1')
+    if result['status'] != 'success':
+        return jsonify({'error': result['error'], 'sync': result}), 500
+    return jsonify({'status': 'success', 'stats': result['stats'], 'sync': result})
+
+@app.route('/api/metrics', methods=['GET'])
+async def get_metrics():
+    """以 Prometheus 文本格式输出各阶段的延迟和错误指标"""
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/cache/status', methods=['GET'])
+async def cache_status():
+    """获取LLM结果缓存、TTS缓存的命中率，以及会话提示词前缀的复用情况"""
+    return jsonify({
+        'llm': llm_cache.stats(),
+        'tts': tts_cache.stats() if tts_cache else None,
+        'prompt': conversations.stats()
+    })
+
+@app.route('/api/upstreams/status', methods=['GET'])
+async def upstreams_status():
+    """获取各上游服务（asr、llm、tts、dida365）熔断器的状态"""
+    return jsonify(breakers.status())
+
+@app.route('/api/sync/status', methods=['GET'])
+async def sync_status():
+    """获取同步状态、最近的同步记录，以及 outbox 中待写回的修改"""
+    status = sync_scheduler.status()
+    if task_outbox:
+        status['outbox'] = await dida_api.run_local(task_outbox.status)
+    return jsonify(status)
+
+if __name__ == '__main__':
+    import uvicorn
+
+    server_config = config.get('server', {})
+    uvicorn.run(
+        app,
+        host=server_config.get('host', '0.0.0.0'),
+        port=server_config.get('port', 1005),
+        ssl_certfile=r'ssl\cr8z.me_public.crt',
+        ssl_keyfile=r'ssl\cr8z.me.key'
+    )
@@ -0,0 +1,496 @@
+# -*- coding: utf-8 -*-
+"""硅基流动和滴答清单的 asyncio 客户端，供 asgi_app.py 使用
+
+网络请求使用 aiohttp，在等待上游响应时不占用线程；
+本地SQLite读写耗时很短，通过 asyncio.to_thread 在线程池中执行，并复用 DidaAPI 的令牌、
+限流调度器和本地数据库。
+"""
+import asyncio
+import json
+import time
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import aiohttp
+
+from circuit_breaker import CircuitOpenError, breakers
+from dida365_api import DidaAPI, DidaAPIError, DidaAuthRequired, is_upstream_failure
+from http_session import sessions
+from metrics import metrics
+from model_router import ModelRouter
+from rate_limiter import INTERACTIVE, RETRYABLE_STATUS
+from silicon_flow_api import parse_stream_line
+
+# 流式请求结束的标记
+_STREAM_END = object()
+
+# 每个上游服务的默认最大并发连接数；asyncio 版本可以同时保持大量进行中的请求
+DEFAULT_ASYNC_MAX_CONNECTIONS = 200
+
+
+def create_async_client(http_config: Optional[Dict] = None) -> aiohttp.ClientSession:
+    """创建 keep-alive 异步HTTP会话（需在事件循环中调用）
+
+    超时按操作在每个请求上单独设置，见 request_timeout()。
+
+    Args:
+        http_config (Dict, optional): 配置文件中的 http 配置段
+
+    Returns:
+        aiohttp.ClientSession: 异步会话，使用完毕后需调用 close()
+    """
+    http_config = http_config or {}
+    sessions.configure(http_config)
+    max_connections = http_config.get('async_max_connections', DEFAULT_ASYNC_MAX_CONNECTIONS)
+    connector = aiohttp.TCPConnector(limit=max_connections, limit_per_host=max_connections)
+    return aiohttp.ClientSession(connector=connector)
+
+
+def request_timeout(operation: str) -> aiohttp.ClientTimeout:
+    """把 http 配置中的 (连接超时, 读取超时) 转换为 aiohttp 的超时设置"""
+    connect, read = sessions.timeout(operation)
+    return aiohttp.ClientTimeout(total=None, sock_connect=connect, sock_read=read)
+
+
+class AsyncSiliconFlowAPI:
+    """SiliconFlowAPI 的 asyncio 版本，接口和返回格式与同步版本一致"""
+
+    def __init__(self, client: aiohttp.ClientSession, config_path: str = "config.json"):
+        """初始化异步硅基流动客户端
+
+        Args:
+            client (aiohttp.ClientSession): 共享的异步HTTP会话
+            config_path (str): 配置文件路径
+        """
+        with open(config_path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+
+        silicon_config = config['silicon_flow']
+        self.api_token = silicon_config['api_token']
+        self.base_url = silicon_config['api_base_url']
+        self.models = silicon_config['models']
+        self.headers = {
+            "Authorization": f"Bearer {self.api_token}"
+        }
+        self.client = client
+        # 按指令复杂度选择模型，慢请求向备用模型发出对冲请求（同 SiliconFlowAPI）
+        self.router = ModelRouter(silicon_config.get('routing'))
+
+    async def transcribe_audio(self, audio, filename: str = 'audio.webm',
+                               content_type: str = 'audio/webm') -> dict:
+        """ASR模块：将音频数据转换为文字（直接上传内存中的音频，不写临时文件）
+
+        Args:
+            audio (bytes | BinaryIO): 音频数据，或由 aiohttp 按块读取的文件对象（见 AudioSpool.payload）
+            filename (str): 上传使用的文件名，ASR服务据此判断音频格式
+            content_type (str): 音频的 Content-Type
+
+        Returns:
+            dict: 成功时为 {"text": "转录文本"}，失败时为 {"error": "错误信息", "text": ""}，
+                熔断中时另有 "degraded": "asr"
+        """
+        breaker = breakers.get('asr')
+        try:
+            breaker.acquire()
+        except CircuitOpenError as e:
+            return {"error": str(e), "text": "", "degraded": "asr"}
+        start_time = time.monotonic()
+        try:
+            result = await self._transcribe_audio(audio, filename, content_type)
+        except BaseException:
+            breaker.release()
+            raise
+        breaker.record('error' not in result, time.monotonic() - start_time)
+        return result
+
+    async def _transcribe_audio(self, audio, filename: str, content_type: str) -> dict:
+        form = aiohttp.FormData()
+        form.add_field('file', audio, filename=filename, content_type=content_type)
+        form.add_field('model', "FunAudioLLM/SenseVoiceSmall")
+        try:
+            async with self.client.post(f"{self.base_url}/audio/transcriptions", headers=self.headers,
+                                        data=form, timeout=request_timeout('asr')) as response:
+                status = response.status
+                body = await response.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            return {"error": f"语音识别过程发生异常: {str(e)}", "text": ""}
+
+        if status != 200:
+            error_msg = f"API错误 (状态码: {status})"
+            print(f"错误: {error_msg}")
+            return {"error": error_msg, "text": ""}
+        try:
+            return json.loads(body)
+        except json.JSONDecodeError as e:
+            return {"error": f"解析响应失败: {str(e)}", "text": ""}
+
+    async def chat_completion(self, messages: list, model: Optional[str] = None) -> dict:
+        """LLM模块：调用大语言模型进行对话
+
+        Args:
+            messages (list): 对话历史消息列表
+            model (str, optional): 模型名称，默认使用配置中的 models.llm
+
+        Returns:
+            dict: 模型回复
+        """
+        with breakers.get('llm').guard():
+            async with self.client.post(
+                f"{self.base_url}/chat/completions",
+                json={"model": model or self.models['llm'], "messages": messages},
+                headers=self.headers,
+                timeout=request_timeout('llm')
+            ) as response:
+                if response.status >= 500:
+                    raise Exception(f"LLM API错误 (状态码: {response.status})")
+                return await response.json(content_type=None)
+
+    async def chat_completion_stream(self, messages: list, model: Optional[str] = None) -> AsyncIterator[str]:
+        """LLM模块：以流式方式调用大语言模型（同 SiliconFlowAPI.chat_completion_stream）
+
+        Yields:
+            str: 依次返回的回复片段
+        """
+        breaker = breakers.get('llm')
+        breaker.acquire()
+        start_time = time.monotonic()
+        recorded = False
+        try:
+            async with self.client.post(
+                f"{self.base_url}/chat/completions",
+                json={"model": model or self.models['llm'], "messages": messages, "stream": True},
+                headers=self.headers,
+                timeout=request_timeout('llm')
+            ) as response:
+                if response.status != 200:
+                    raise Exception(f"LLM API错误 (状态码: {response.status})")
+                async for line in response.content:
+                    done, content = parse_stream_line(line)
+                    if done:
+                        break
+                    if content:
+                        if not recorded:
+                            breaker.record(True, time.monotonic() - start_time)
+                            recorded = True
+                        yield content
+            if not recorded:
+                breaker.record(True, time.monotonic() - start_time)
+                recorded = True
+        except Exception:
+            if not recorded:
+                breaker.record(False, time.monotonic() - start_time)
+                recorded = True
+            raise
+        finally:
+            # 请求被取消（对冲请求落选等）时不计入熔断统计
+            if not recorded:
+                breaker.release()
+
+    async def _timed_chat_completion(self, messages: list, model: str) -> dict:
+        start_time = time.time()
+        result = await self.chat_completion(messages, model)
+        if result and 'choices' in result:
+            self.router.record(model, time.time() - start_time)
+        return result
+
+    async def routed_chat_completion(self, messages: list, command: str) -> dict:
+        """按指令选择模型调用LLM，超过 p95 延迟时发出对冲请求并取消落选的请求
+        （同 SiliconFlowAPI.routed_chat_completion）
+        """
+        primary, fallback = self.router.route(command, self.models['llm'])
+        start_time = time.time()
+        tasks = {asyncio.create_task(self._timed_chat_completion(messages, primary)): primary}
+        hedged = fallback is None
+        racing = False
+        delay = self.router.hedge_delay(primary) if fallback else None
+        last_result, last_error = None, None
+        try:
+            while tasks:
+                done, _ = await asyncio.wait(tasks, timeout=None if hedged else delay,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    print(f"{primary} 超过 {delay:.1f} 秒未返回，向 {fallback} 发出对冲请求")
+                    metrics.inc('llm_hedge', result='sent')
+                    tasks[asyncio.create_task(self._timed_chat_completion(messages, fallback))] = fallback
+                    hedged = racing = True
+                    continue
+                for task in done:
+                    model = tasks.pop(task)
+                    try:
+                        result = task.result()
+                    except Exception as e:
+                        last_error = e
+                        continue
+                    if result and 'choices' in result:
+                        if racing:
+                            self.router.record_hedge(model, primary, time.time() - start_time)
+                        return result
+                    last_result = result
+                if not hedged and not tasks:
+                    metrics.inc('llm_hedge', result='failover')
+                    tasks[asyncio.create_task(self._timed_chat_completion(messages, fallback))] = fallback
+                    hedged = True
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        if last_result is not None:
+            return last_result
+        raise last_error
+
+    async def _run_stream_attempt(self, messages: list, model: str, events: asyncio.Queue):
+        """读取一个模型的流式回复，把回复片段、结束标记或异常放入队列"""
+        start_time = time.time()
+        first = True
+        try:
+            async for content in self.chat_completion_stream(messages, model):
+                if first:
+                    self.router.record(model, time.time() - start_time)
+                    first = False
+                events.put_nowait((model, content))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            events.put_nowait((model, e))
+            return
+        events.put_nowait((model, _STREAM_END))
+
+    async def routed_chat_completion_stream(self, messages: list, command: str) -> AsyncIterator[str]:
+        """按指令选择模型，以流式方式调用LLM，先输出的模型胜出，另一个请求被取消
+        （同 SiliconFlowAPI.routed_chat_completion_stream）
+
+        Yields:
+            str: 胜出模型依次返回的回复片段
+        """
+        primary, fallback = self.router.route(command, self.models['llm'])
+        events = asyncio.Queue()
+        tasks = {}
+
+        def start(model):
+            tasks[model] = asyncio.create_task(self._run_stream_attempt(messages, model, events))
+
+        start_time = time.time()
+        start(primary)
+        deadline = time.monotonic() + self.router.hedge_delay(primary) if fallback else None
+        winner = None
+        failures = 0
+        try:
+            while True:
+                timeout = None
+                if winner is None and len(tasks) == 1 and deadline is not None:
+                    timeout = max(0.0, deadline - time.monotonic())
+                try:
+                    model, item = await asyncio.wait_for(events.get(), timeout)
+                except asyncio.TimeoutError:
+                    print(f"{primary} 超过 p95 首字延迟仍未输出，向 {fallback} 发出对冲请求")
+                    metrics.inc('llm_hedge', result='sent')
+                    start(fallback)
+                    continue
+
+                if winner is None:
+                    if isinstance(item, Exception):
+                        failures += 1
+                        if fallback and len(tasks) == 1:
+                            metrics.inc('llm_hedge', result='failover')
+                            start(fallback)
+                        elif failures == len(tasks):
+                            raise item
+                        continue
+                    winner = model
+                    for other, task in tasks.items():
+                        if other != winner:
+                            task.cancel()
+                    if len(tasks) > 1 and failures == 0:
+                        self.router.record_hedge(winner, primary, time.time() - start_time)
+
+                if model != winner:
+                    continue
+                if item is _STREAM_END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            for task in tasks.values():
+                task.cancel()
+
+    async def text_to_speech(self, text: str, voice: Optional[str] = None) -> bytes:
+        """TTS模块：将文字转换为语音
+
+        Returns:
+            bytes: 音频数据
+
+        Raises:
+            Exception: 当API调用失败时抛出异常
+        """
+        payload = {
+            "model": self.models['tts']['model'],
+            "input": text,
+            "voice": voice or self.models['tts']['default_voice']
+        }
+        try:
+            with breakers.get('tts').guard():
+                async with self.client.post(
+                    f"{self.base_url}/audio/speech",
+                    json=payload,
+                    headers=self.headers,
+                    timeout=request_timeout('tts')
+                ) as response:
+                    if response.status != 200:
+                        raise Exception(f"TTS API错误 (状态码: {response.status})")
+                    content_type = response.headers.get('Content-Type', '')
+                    if not content_type.startswith('audio/'):
+                        raise Exception(f"TTS API返回了非音频数据: {content_type}")
+                    return await response.read()
+        except asyncio.TimeoutError:
+            raise Exception("TTS API请求超时")
+        except aiohttp.ClientError as e:
+            raise Exception(f"TTS API请求失败: {str(e)}")
+
+
+class AsyncDidaAPI:
+    """DidaAPI 的 asyncio 版本
+
+    网络请求通过 aiohttp 异步发送，与同步客户端共用令牌、限流调度器和本地数据库：
+    - 限流使用 RequestScheduler.try_acquire，等待时让出事件循环
+    - 401 时通过同步客户端的 refresh_access_token 刷新令牌（与线程版共用同一次刷新）
+    - 重试规则与 DidaAPI._request_with_retry 相同
+    """
+
+    def __init__(self, dida_api: DidaAPI, client: aiohttp.ClientSession):
+        """初始化异步滴答清单客户端
+
+        Args:
+            dida_api (DidaAPI): 共享的同步客户端，提供令牌、限流调度器和本地数据库
+            client (aiohttp.ClientSession): 共享的异步HTTP会话
+        """
+        self.dida_api = dida_api
+        self.client = client
+        self.base_url = dida_api.config['api_base_url']
+
+    async def run_local(self, func, *args, **kwargs):
+        """在线程池中执行本地数据库操作，结束后把该线程的连接归还连接池"""
+        def call():
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.dida_api.close()
+        return await asyncio.to_thread(call)
+
+    async def get_local_tasks(self, **kwargs) -> List[Dict]:
+        """从本地数据库获取任务（参数同 DidaAPI.get_local_tasks）"""
+        return await self.run_local(self.dida_api.get_local_tasks, **kwargs)
+
+    async def get_cached_projects(self) -> List[Dict]:
+        """获取缓存的项目列表（参数同 DidaAPI.get_cached_projects）"""
+        return await self.run_local(self.dida_api.get_cached_projects)
+
+    async def _acquire(self, lane: str):
+        scheduler = self.dida_api.scheduler
+        waited = 0.0
+        while True:
+            wait = scheduler.try_acquire(lane)
+            if not wait:
+                break
+            await asyncio.sleep(wait)
+            waited += wait
+        if waited:
+            metrics.inc('upstream_throttled', upstream=scheduler.name, lane=lane)
+            metrics.observe('throttle_wait', waited, op=f'{scheduler.name}:{lane}')
+
+    async def _send(self, method: str, url: str, headers: Dict, **kwargs) -> Tuple[int, Dict, str]:
+        async with self.client.request(method, url, headers=headers, timeout=request_timeout('dida365'),
+                                       **kwargs) as response:
+            return response.status, dict(response.headers), await response.text()
+
+    async def _request_with_retry(self, method: str, url: str, headers: Dict, lane: str,
+                                  **kwargs) -> Tuple[int, Dict, str]:
+        """经过限流调度发送请求，重试规则同 DidaAPI._request_with_retry
+
+        Returns:
+            Tuple[int, Dict, str]: 最后一次请求的 (状态码, 响应头, 响应内容)
+        """
+        scheduler = self.dida_api.scheduler
+        idempotent = method.upper() == 'GET'
+        scheduler.record_request()
+        attempt = 0
+        while True:
+            await self._acquire(lane)
+            try:
+                status, response_headers, body = await self._send(method, url, headers, **kwargs)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if not idempotent or not scheduler.allow_retry(attempt, type(e).__name__):
+                    raise
+                delay = scheduler.backoff(attempt)
+            else:
+                retryable = status == 429 or (idempotent and status in RETRYABLE_STATUS)
+                if not retryable or not scheduler.allow_retry(attempt, str(status)):
+                    return status, response_headers, body
+                delay = scheduler.backoff(attempt, response_headers.get('Retry-After'))
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _make_request(self, method: str, endpoint: str, lane: str = INTERACTIVE, **kwargs) -> dict:
+        """发送API请求（参数和异常同 DidaAPI._make_request）"""
+        with metrics.timer('dida', op=f'{method} {DidaAPI._endpoint_template(endpoint)}'), \
+                breakers.get('dida365').guard(is_upstream_failure):
+            token = self.dida_api.access_token
+            if not token:
+                raise DidaAuthRequired()
+            headers = {
+                'Authorization': f'Bearer {token}',
+                'Accept': 'application/json'
+            }
+            url = f"{self.base_url}/{endpoint.lstrip('/')}"
+            try:
+                status, _, body = await self._request_with_retry(method, url, headers, lane, **kwargs)
+                if status == 401:
+                    await asyncio.to_thread(self._refresh_token, token)
+                    headers['Authorization'] = f'Bearer {self.dida_api.access_token}'
+                    status, _, body = await self._request_with_retry(method, url, headers, lane, **kwargs)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                raise DidaAPIError(f"API请求失败: {str(e) or type(e).__name__}")
+            if status >= 400:
+                raise DidaAPIError(f"API请求失败: HTTP {status} - {body}", status)
+
+            if not body:
+                return {}
+            try:
+                return json.loads(body)
+            except ValueError as e:
+                raise Exception(f"无效的JSON响应: {str(e)}\n响应内容: {body[:500]}...")
+
+    def _refresh_token(self, stale_token: str):
+        try:
+            self.dida_api.refresh_access_token(stale_token=stale_token)
+        finally:
+            self.dida_api.close()
+
+    async def get_task(self, project_id: str, task_id: str) -> Dict:
+        """Get task details by project ID and task ID（同 DidaAPI.get_task）"""
+        return await self._make_request('GET', f'project/{project_id}/task/{task_id}')
+
+    async def create_task(self, title: str, project_id: Optional[str] = None, **kwargs) -> dict:
+        """Create new task（参数同 DidaAPI.create_task）"""
+        task_data = {'title': title, **kwargs}
+        if project_id:
+            task_data['projectId'] = project_id
+        new_task = await self._make_request('POST', 'task', json=task_data)
+        await self._save_local(new_task)
+        return new_task
+
+    async def update_task(self, task_id: str, project_id: str, **kwargs) -> dict:
+        """Update existing task（参数同 DidaAPI.update_task）"""
+        task_data = {'id': task_id, 'projectId': project_id, **kwargs}
+        updated_task = await self._make_request('POST', f'task/{task_id}', json=task_data)
+        await self._save_local({'id': task_id, 'projectId': project_id, **updated_task})
+        return updated_task
+
+    async def _save_local(self, task: Dict):
+        """把服务端返回的任务写入本地数据库，失败时只打印提示"""
+        def upsert():
+            with metrics.timer('sqlite', op='upsert_task'), self.dida_api._transaction():
+                self.dida_api._upsert_tasks([self.dida_api._task_row(task)])
+        try:
+            await self.run_local(upsert)
+        except Exception as e:
+            print(f"任务已写入服务端，但同步到本地数据库失败: {str(e)}")
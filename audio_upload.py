@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""语音上传：把浏览器上传的原始音频转交给ASR服务
+
+旧的 /api/speech-to-text 接收 JSON 中 base64 编码的音频，解码后写入临时文件并 fsync，
+再重新打开文件上传，高峰时同一段音频在内存中有多份完整拷贝。上传接口直接接收二进制或
+multipart 请求体：
+
+- 请求体按块写入 AudioSpool，不超过 memory_bytes 时保存在内存中，超过后转存到匿名临时文件
+  （不 fsync，关闭即删除），总大小超过 max_bytes 时拒绝
+- 上传给ASR服务时，MultipartBody 按需从缓冲区读取音频，不在内存中拼出完整的请求体
+"""
+import io
+import tempfile
+import uuid
+from typing import BinaryIO, Dict, Optional
+
+MAX_AUDIO_BYTES = 50 * 1024 * 1024
+# 缓冲区在内存中保存的最大字节数，超过后转存到临时文件
+DEFAULT_SPOOL_BYTES = 1024 * 1024
+READ_CHUNK_BYTES = 64 * 1024
+# multipart 请求中除音频外的字段、分隔符等允许占用的字节数
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+# 支持的音频类型及上传给ASR服务时使用的文件名
+AUDIO_FILENAMES = {
+    'audio/webm': 'audio.webm',
+    'audio/ogg': 'audio.ogg',
+    'audio/wav': 'audio.wav',
+    'audio/x-wav': 'audio.wav',
+    'audio/wave': 'audio.wav',
+    'audio/mpeg': 'audio.mp3',
+    'audio/mp4': 'audio.m4a',
+    'audio/x-m4a': 'audio.m4a',
+    # 未标明类型的二进制请求体按浏览器录音的默认格式处理
+    'application/octet-stream': 'audio.webm'
+}
+
+
+class AudioTooLarge(Exception):
+    """上传的音频超过大小限制"""
+
+
+def audio_type(content_type: Optional[str]) -> Optional[str]:
+    """规范化音频的 Content-Type（去掉 codecs 等参数），不支持的类型返回None"""
+    mimetype = (content_type or '').split(';', 1)[0].strip().lower()
+    return mimetype if mimetype in AUDIO_FILENAMES else None
+
+
+def audio_filename(content_type: str) -> str:
+    """获取音频类型对应的上传文件名"""
+    return AUDIO_FILENAMES.get(audio_type(content_type), 'audio.webm')
+
+
+class AudioSpool:
+    """有大小上限的音频缓冲区，较小的音频保存在内存中，较大的转存到临时文件"""
+
+    def __init__(self, max_bytes: int = MAX_AUDIO_BYTES, memory_bytes: int = DEFAULT_SPOOL_BYTES):
+        """初始化缓冲区
+
+        Args:
+            max_bytes (int): 允许的最大音频字节数
+            memory_bytes (int): 在内存中保存的最大字节数
+        """
+        self.max_bytes = max_bytes
+        self.memory_bytes = memory_bytes
+        self.size = 0
+        self._file: BinaryIO = io.BytesIO()
+        self._in_memory = True
+
+    @property
+    def in_memory(self) -> bool:
+        return self._in_memory
+
+    def write(self, chunk: bytes):
+        """追加一块音频数据
+
+        Raises:
+            AudioTooLarge: 累计大小超过 max_bytes
+        """
+        if not chunk:
+            return
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise AudioTooLarge(f"音频文件过大（超过{self.max_bytes // (1024 * 1024)}MB）")
+        if self._in_memory and self.size > self.memory_bytes:
+            spilled = tempfile.TemporaryFile()
+            spilled.write(self._file.getvalue())
+            self._file.close()
+            self._file = spilled
+            self._in_memory = False
+        self._file.write(chunk)
+
+    def read_from(self, stream: BinaryIO) -> 'AudioSpool':
+        """从同步的请求体流中按块读取全部音频"""
+        while True:
+            chunk = stream.read(READ_CHUNK_BYTES)
+            if not chunk:
+                return self
+            self.write(chunk)
+
+    def open(self) -> BinaryIO:
+        """回到开头，返回可读取全部音频的文件对象（归缓冲区所有，不要单独关闭）"""
+        self._file.seek(0)
+        return self._file
+
+    def payload(self):
+        """供 aiohttp 上传的数据：在内存中时返回 bytes，否则返回文件对象，由 aiohttp 按块读取"""
+        if self._in_memory:
+            return self._file.getvalue()
+        return self.open()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self) -> 'AudioSpool':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class MultipartBody:
+    """按需读取的 multipart/form-data 请求体，包含若干文本字段和一个文件
+
+    requests 的 files 参数会在内存中拼出完整的请求体；这里实现 read() 和长度，
+    requests 据此设置 Content-Length，并在发送时按块读取文件内容。
+    """
+
+    def __init__(self, fields: Dict[str, str], file_field: str, fileobj: BinaryIO, size: int,
+                 filename: str, content_type: str):
+        """初始化请求体
+
+        Args:
+            fields (Dict[str, str]): 文本字段
+            file_field (str): 文件字段名
+            fileobj (BinaryIO): 文件内容，从当前位置读取 size 个字节
+            size (int): 文件字节数
+            filename (str): 文件名
+            content_type (str): 文件的 Content-Type
+        """
+        boundary = uuid.uuid4().hex
+        self.content_type = f'multipart/form-data; boundary={boundary}'
+        head = ''.join(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'
+            for name, value in fields.items()
+        )
+        head += (f'--{boundary}\r\nContent-Disposition: form-data; name="{file_field}"; '
+                 f'filename="{filename}"\r\nContent-Type: {content_type}\r\n\r\n')
+        self._parts = [io.BytesIO(head.encode('utf-8')), fileobj, io.BytesIO(f'\r\n--{boundary}--\r\n'.encode())]
+        self._remaining = [len(self._parts[0].getvalue()), size, len(self._parts[2].getvalue())]
+        self._length = sum(self._remaining)
+
+    def __len__(self) -> int:
+        return self._length
+
+    def read(self, size: int = -1) -> bytes:
+        chunks = []
+        while self._parts and size != 0:
+            want = self._remaining[0] if size < 0 else min(size, self._remaining[0])
+            chunk = self._parts[0].read(want) if want else b''
+            if not chunk:
+                self._parts.pop(0)
+                self._remaining.pop(0)
+                continue
+            chunks.append(chunk)
+            self._remaining[0] -= len(chunk)
+            if size > 0:
+                size -= len(chunk)
+        return b''.join(chunks)
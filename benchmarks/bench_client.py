@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""DidaAPI 每请求开销基准测试
+
+对比两种获取客户端的方式在每个请求上的开销（每个请求在新线程中执行，模拟Werkzeug的线程模型）：
+1. 每请求新建：DidaAPI() 读取配置、执行建表/迁移检查、查询令牌、打开新连接，请求结束后释放
+2. 进程内共享：DidaAPI.shared() 复用同一实例，数据库连接从连接池取出并在请求结束后归还
+
+每个请求执行一次 get_local_tasks(include_completed=False)，与 /api/process-command 的上下文加载相同。
+
+用法（在仓库根目录执行）：
+    python benchmarks/bench_client.py --requests 2000 --tasks 200
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+from bench_sync import SyntheticDidaAPI, build_server, percentile
+
+
+def run_requests(get_client, num_requests: int) -> tuple:
+    """依次在新线程中执行请求
+    
+    Returns:
+        tuple: (客户端准备耗时列表, 请求总耗时列表)，单位毫秒；
+            准备耗时包括获取客户端和拿到可用的数据库连接
+    """
+    setup, total = [], []
+    
+    def handle():
+        start = time.perf_counter()
+        client = get_client()
+        client.conn
+        ready = time.perf_counter()
+        client.get_local_tasks(include_completed=False)
+        client.close()
+        end = time.perf_counter()
+        setup.append((ready - start) * 1000)
+        total.append((end - start) * 1000)
+    
+    for _ in range(num_requests):
+        thread = threading.Thread(target=handle)
+        thread.start()
+        thread.join()
+    return setup, total
+
+
+def report(label: str, latencies: tuple):
+    setup, total = latencies
+    print(f"{label}: 准备 p50={statistics.median(setup):.3f}ms p95={percentile(setup, 95):.3f}ms | "
+          f"请求 p50={statistics.median(total):.3f}ms p95={percentile(total, 95):.3f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='DidaAPI 每请求开销基准测试')
+    parser.add_argument('--requests', type=int, default=2000, help='请求数')
+    parser.add_argument('--tasks', type=int, default=200, help='本地任务数')
+    args = parser.parse_args()
+    
+    workdir = tempfile.mkdtemp(prefix='aristotle-bench-')
+    config_path = os.path.join(workdir, 'config.json')
+    with open(config_path, 'w', encoding='utf-8') as f:
+        json.dump({'dida365': {'db_path': os.path.join(workdir, 'bench.db')}}, f)
+    
+    server = build_server(args.tasks, max(1, args.tasks // 250))
+    with contextlib.redirect_stdout(io.StringIO()):
+        seed = SyntheticDidaAPI(config_path, server)
+        seed.sync_with_server()
+        seed.close()
+    
+    shared = SyntheticDidaAPI(config_path, server)
+    
+    print(f"请求数: {args.requests}，本地任务数: {args.tasks}")
+    report("每请求新建 DidaAPI()", run_requests(lambda: SyntheticDidaAPI(config_path, server), args.requests))
+    report("共享实例 + 连接池    ", run_requests(lambda: shared, args.requests))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""语音指令流水线吞吐量基准测试：线程版（app.py）对比 asyncio 版（asgi_app.py）
+
+启动一个模拟的硅基流动和滴答清单上游（按配置的延迟返回），分别以
+Werkzeug 多线程服务器运行 app.py、以 uvicorn 运行 asgi_app.py，
+在不同并发数下持续发送 /api/process-command 请求（LLM回复包含一次更新任务操作，
+write_mode 为 sync，因此每个请求依次等待 LLM、滴答清单和 TTS 三个上游），
+记录吞吐量、延迟分位数，以及服务进程的峰值内存和线程数。
+
+用法（在仓库根目录执行）：
+    python benchmarks/bench_pipeline.py --concurrency 20 100 400 --requests 800
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import aiohttp
+
+from bench_sync import percentile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LLM_REPLY = json.dumps({
+    'action': 'update_task',
+    'task_data': {'id': 't1', 'projectId': 'p1', 'priority': 3},
+    'response': '好的，已经把写周报设为紧急'
+}, ensure_ascii=False)
+
+
+def upstream_app(delays: dict):
+    """模拟上游服务的ASGI应用：每个接口等待指定延迟后返回固定数据"""
+    audio = b'\0' * 32 * 1024
+
+    async def app(scope, receive, send):
+        if scope['type'] != 'http':
+            return
+        while (await receive()).get('more_body'):
+            pass
+        path = scope['path']
+        content_type, status = 'application/json', 200
+        if path.endswith('/chat/completions'):
+            await asyncio.sleep(delays['llm'])
+            body = json.dumps({'choices': [{'message': {'content': LLM_REPLY}}]}).encode()
+        elif path.endswith('/audio/speech'):
+            await asyncio.sleep(delays['tts'])
+            body, content_type = audio, 'audio/wav'
+        elif path.endswith('/audio/transcriptions'):
+            await asyncio.sleep(delays['asr'])
+            body = json.dumps({'text': '把写周报设为紧急'}).encode()
+        elif path.endswith('/project'):
+            body = json.dumps([{'id': 'p1', 'name': '工作'}]).encode()
+        elif '/data' in path:
+            body = json.dumps({'project': {'id': 'p1'}, 'tasks': [
+                {'id': 't1', 'projectId': 'p1', 'title': '写周报', 'status': 0}
+            ]}).encode()
+        elif '/task/' in path:
+            await asyncio.sleep(delays['dida'])
+            body = json.dumps({'id': 't1', 'projectId': 'p1', 'title': '写周报', 'priority': 3}).encode()
+        else:
+            body, status = b'{}', 404
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', content_type.encode())]})
+        await send({'type': 'http.response.body', 'body': body})
+
+    return app
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port: int, timeout: float = 30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"端口 {port} 未就绪")
+
+
+def prepare_workdir(upstream_port: int) -> str:
+    """创建服务进程的工作目录：配置指向模拟上游，数据库中预置访问令牌"""
+    workdir = tempfile.mkdtemp(prefix='bench_pipeline_')
+    with open(os.path.join(REPO_ROOT, 'config.json'), 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    base = f'http://127.0.0.1:{upstream_port}'
+    config['silicon_flow']['api_base_url'] = f'{base}/v1'
+    config['dida365'].update({
+        'api_base_url': f'{base}/open/v1',
+        'db_path': os.path.join(workdir, 'dida_local.db'),
+        'sync_interval': 0,
+        'write_mode': 'sync',
+        'rate_limit': {'rate': 100000, 'burst': 100000}
+    })
+    config.setdefault('http', {})['preconnect'] = False
+    with open(os.path.join(workdir, 'config.json'), 'w', encoding='utf-8') as f:
+        json.dump(config, f, ensure_ascii=False, indent=4)
+
+    conn = sqlite3.connect(config['dida365']['db_path'])
+    conn.execute('CREATE TABLE auth (id INTEGER PRIMARY KEY, access_token TEXT, '
+                 'created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)')
+    conn.execute("INSERT INTO auth (access_token) VALUES ('bench')")
+    conn.commit()
+    conn.close()
+    shutil.copytree(os.path.join(REPO_ROOT, 'templates'), os.path.join(workdir, 'templates'))
+    return workdir
+
+
+def start_server(kind: str, workdir: str, port: int) -> subprocess.Popen:
+    if kind == 'threaded':
+        command = [sys.executable, '-c',
+                   f"import app; app.app.run(host='127.0.0.1', port={port}, threaded=True)"]
+    else:
+        command = [sys.executable, '-m', 'uvicorn', 'asgi_app:app', '--host', '127.0.0.1',
+                   '--port', str(port), '--log-level', 'warning', '--backlog', '4096']
+    env = {**os.environ, 'PYTHONPATH': REPO_ROOT}
+    process = subprocess.Popen(command, cwd=workdir, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for_port(port)
+    return process
+
+
+class ProcessSampler:
+    """定期读取 /proc/<pid>/status，记录峰值常驻内存和线程数"""
+
+    def __init__(self, pid: int, interval: float = 0.05):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss_mb = 0.0
+        self.peak_threads = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                with open(f'/proc/{self.pid}/status') as f:
+                    for line in f:
+                        if line.startswith('VmRSS:'):
+                            self.peak_rss_mb = max(self.peak_rss_mb, int(line.split()[1]) / 1024)
+                        elif line.startswith('Threads:'):
+                            self.peak_threads = max(self.peak_threads, int(line.split()[1]))
+            except OSError:
+                return
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+async def run_load(port: int, concurrency: int, num_requests: int) -> dict:
+    """以固定并发数发送 num_requests 个指令请求"""
+    url = f'http://127.0.0.1:{port}/api/process-command'
+    latencies, errors = [], 0
+    remaining = num_requests
+    connector = aiohttp.TCPConnector(limit=concurrency)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=120)) as client:
+        async def worker():
+            nonlocal remaining, errors
+            while remaining > 0:
+                remaining -= 1
+                start = time.perf_counter()
+                try:
+                    async with client.post(url, json={'command': '把写周报设为紧急'}) as response:
+                        await response.read()
+                        if response.status != 200:
+                            errors += 1
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    errors += 1
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    return {
+        'throughput': num_requests / elapsed,
+        'p50': statistics.median(latencies),
+        'p95': percentile(latencies, 95),
+        'errors': errors
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='语音指令流水线吞吐量基准测试（线程版 vs asyncio 版）')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[20, 100, 400], help='并发请求数')
+    parser.add_argument('--requests', type=int, default=800, help='每轮请求总数')
+    parser.add_argument('--llm-delay', type=float, default=0.8, help='模拟LLM延迟（秒）')
+    parser.add_argument('--tts-delay', type=float, default=0.3, help='模拟TTS延迟（秒）')
+    parser.add_argument('--dida-delay', type=float, default=0.1, help='模拟滴答清单写入延迟（秒）')
+    parser.add_argument('--servers', nargs='+', default=['threaded', 'asyncio'], help='要测试的实现')
+    args = parser.parse_args()
+
+    import uvicorn
+
+    delays = {'llm': args.llm_delay, 'tts': args.tts_delay, 'dida': args.dida_delay, 'asr': 0.3}
+    upstream_port = free_port()
+    upstream = uvicorn.Server(uvicorn.Config(upstream_app(delays), host='127.0.0.1', port=upstream_port,
+                                             log_level='warning', backlog=4096))
+    threading.Thread(target=upstream.run, daemon=True).start()
+    wait_for_port(upstream_port)
+
+    chain = args.llm_delay + args.dida_delay + args.tts_delay
+    print(f"上游延迟: LLM {args.llm_delay}s + 滴答清单 {args.dida_delay}s + TTS {args.tts_delay}s "
+          f"= 单请求下限 {chain:.2f}s，每轮 {args.requests} 个请求")
+    print(f"{'实现':<10}{'并发':>6}{'吞吐(req/s)':>14}{'p50(s)':>9}{'p95(s)':>9}"
+          f"{'错误':>6}{'峰值内存(MB)':>15}{'峰值线程':>10}{'req/s/100MB':>13}")
+
+    for kind in args.servers:
+        for concurrency in args.concurrency:
+            workdir = prepare_workdir(upstream_port)
+            port = free_port()
+            process = start_server(kind, workdir, port)
+            try:
+                # 预热：加载项目缓存、建立上游连接
+                asyncio.run(run_load(port, 2, 4))
+                with ProcessSampler(process.pid) as sampler:
+                    result = asyncio.run(run_load(port, concurrency, args.requests))
+            finally:
+                process.terminate()
+                process.wait()
+                shutil.rmtree(workdir, ignore_errors=True)
+            efficiency = result['throughput'] / sampler.peak_rss_mb * 100 if sampler.peak_rss_mb else 0
+            print(f"{kind:<10}{concurrency:>6}{result['throughput']:>14.1f}{result['p50']:>9.2f}"
+                  f"{result['p95']:>9.2f}{result['errors']:>6}{sampler.peak_rss_mb:>15.1f}"
+                  f"{sampler.peak_threads:>10}{efficiency:>13.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""本地任务库同步基准测试
+
+使用合成数据（默认50k任务）驱动 DidaAPI.sync_with_server，不访问滴答清单服务器。
+测量内容：
+1. 全量同步耗时
+2. 无变化时的增量同步耗时
+3. 1% 任务变化时的增量同步耗时
+4. 同步进行期间，另一线程执行 get_local_tasks 的读延迟
+
+用法（在仓库根目录执行）：
+    python benchmarks/bench_sync.py --tasks 50000 --projects 200
+    python benchmarks/bench_sync.py --journal-mode DELETE   # 对比回滚日志模式
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dida365_api import DidaAPI
+
+
+class SyntheticDidaAPI(DidaAPI):
+    """用内存中的合成数据代替服务端接口的 DidaAPI"""
+    
+    def __init__(self, config_path: str, server: dict):
+        self.server = server
+        super().__init__(config_path)
+    
+    def _authorize(self):
+        self._save_token('benchmark-token')
+    
+    def _make_request(self, method: str, endpoint: str, **kwargs) -> dict:
+        if endpoint == 'project':
+            return self.server['projects']
+        project_id = endpoint.split('/')[1]
+        return {'project': {'id': project_id}, 'tasks': self.server['tasks'][project_id]}
+
+
+def build_server(num_tasks: int, num_projects: int) -> dict:
+    """生成合成的项目和任务数据"""
+    projects = [{'id': f'p{i}', 'name': f'项目{i}', 'color': '#F18181'} for i in range(num_projects)]
+    tasks = {project['id']: [] for project in projects}
+    for i in range(num_tasks):
+        project_id = f'p{i % num_projects}'
+        tasks[project_id].append({
+            'id': f't{i}',
+            'projectId': project_id,
+            'title': f'合成任务 {i}',
+            'content': '基准测试数据' * 4,
+            'status': 0,
+            'priority': i % 4,
+            'startDate': '2025-07-11T09:00:00+0800',
+            'dueDate': '2025-07-11T10:00:00+0800',
+            'timeZone': 'Asia/Shanghai'
+        })
+    return {'projects': projects, 'tasks': tasks}
+
+
+def timed_sync(api: DidaAPI, **kwargs):
+    """执行一次同步并返回 (耗时秒数, 统计信息)"""
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        stats = api.sync_with_server(**kwargs)
+    return time.perf_counter() - start, stats
+
+
+def measure_reads_during_sync(config_path: str, server: dict, num_projects: int) -> list:
+    """在后台线程执行全量同步，同时在当前线程持续读取，返回读延迟列表（毫秒）"""
+    writer_done = threading.Event()
+    
+    def writer():
+        api = SyntheticDidaAPI(config_path, server)
+        try:
+            timed_sync(api, incremental=False)
+        finally:
+            api.close()
+            writer_done.set()
+    
+    reader = SyntheticDidaAPI(config_path, server)
+    thread = threading.Thread(target=writer)
+    thread.start()
+    
+    latencies = []
+    i = 0
+    while not writer_done.is_set():
+        start = time.perf_counter()
+        reader.get_local_tasks(project_id=f'p{i % num_projects}', include_completed=False)
+        latencies.append((time.perf_counter() - start) * 1000)
+        i += 1
+    thread.join()
+    reader.close()
+    return latencies
+
+
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地任务库同步基准测试')
+    parser.add_argument('--tasks', type=int, default=50000, help='合成任务数')
+    parser.add_argument('--projects', type=int, default=200, help='合成项目数')
+    parser.add_argument('--journal-mode', default='WAL', help='SQLite journal_mode（WAL / DELETE）')
+    args = parser.parse_args()
+    
+    workdir = tempfile.mkdtemp(prefix='aristotle-bench-')
+    config_path = os.path.join(workdir, 'config.json')
+    with open(config_path, 'w', encoding='utf-8') as f:
+        json.dump({'dida365': {
+            'db_path': os.path.join(workdir, 'bench.db'),
+            'sync_concurrency': 1,
+            'sqlite_pragmas': {'journal_mode': args.journal_mode}
+        }}, f)
+    
+    server = build_server(args.tasks, args.projects)
+    api = SyntheticDidaAPI(config_path, server)
+    
+    print(f"任务数: {args.tasks}，项目数: {args.projects}，journal_mode: {args.journal_mode}")
+    
+    cost, stats = timed_sync(api, incremental=False)
+    print(f"全量同步（空库）:       {cost:.3f}秒  写入 {stats['tasks_written']} 个任务")
+    
+    cost, stats = timed_sync(api, incremental=True)
+    print(f"增量同步（无变化）:     {cost:.3f}秒  跳过 {stats['skipped_projects']} 个项目")
+    
+    changed = 0
+    for project_tasks in server['tasks'].values():
+        for task in project_tasks[::100]:
+            task['title'] += '（已修改）'
+            changed += 1
+    cost, stats = timed_sync(api, incremental=True)
+    print(f"增量同步（{changed} 个变化）: {cost:.3f}秒  写入 {stats['tasks_written']} 个任务")
+    
+    cost, stats = timed_sync(api, incremental=False)
+    print(f"全量同步（覆盖）:       {cost:.3f}秒  写入 {stats['tasks_written']} 个任务")
+    api.close()
+    
+    latencies = measure_reads_during_sync(config_path, server, args.projects)
+    print(f"同步期间读取 {len(latencies)} 次: "
+          f"p50={statistics.median(latencies):.2f}ms "
+          f"p95={percentile(latencies, 95):.2f}ms "
+          f"max={max(latencies):.2f}ms")
+
+
+if __name__ == '__main__':
+    main()
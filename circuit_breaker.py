@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""上游服务的熔断器
+
+硅基流动（ASR、LLM、TTS）或滴答清单变慢、出错时，每个请求都要等到超时才失败，处理请求的
+线程很快全部阻塞在这些请求上。熔断器统计每个上游最近的调用结果：
+
+- closed：正常调用；滑动窗口内失败或慢调用的比例超过阈值时打开
+- open：直接抛出 CircuitOpenError，不再发出请求，调用方改用降级响应
+- half_open：打开 open_seconds 秒后放行少量探测请求，成功则关闭，失败则重新打开
+"""
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+from metrics import metrics
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+DEFAULT_BREAKER_CONFIG = {
+    'window': 20,              # 统计最近多少次调用
+    'window_seconds': 60,      # 只统计这么多秒内的调用
+    'min_calls': 5,            # 窗口内调用次数不足时不打开
+    'failure_ratio': 0.5,      # 失败比例超过该值时打开
+    'slow_call_seconds': 10,   # 超过该耗时的成功调用记为慢调用
+    'slow_ratio': 0.8,         # 慢调用比例超过该值时打开
+    'open_seconds': 30,        # 打开后多久进入半开状态
+    'half_open_calls': 1       # 半开状态下同时放行的探测请求数，全部成功后关闭
+}
+
+
+class CircuitOpenError(Exception):
+    """熔断器处于打开状态，请求未发出
+
+    Attributes:
+        upstream (str): 上游服务名称
+        retry_after (float): 距离允许探测请求还有多少秒
+    """
+
+    def __init__(self, upstream: str, retry_after: float):
+        super().__init__(f"{upstream} 服务暂时不可用（熔断中，{retry_after:.0f}秒后重试）")
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """单个上游服务的熔断器，线程安全，同步和 asyncio 代码共用"""
+
+    def __init__(self, name: str, config: Optional[Dict] = None):
+        """初始化熔断器
+
+        Args:
+            name (str): 上游服务名称，用于指标标签
+            config (Dict, optional): 熔断配置，未提供的项使用 DEFAULT_BREAKER_CONFIG
+        """
+        self.name = name
+        self.config = {**DEFAULT_BREAKER_CONFIG, **(config or {})}
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._opened_at = 0.0
+        # 最近的调用结果：(时间, 是否失败, 是否慢调用)
+        self._calls = deque(maxlen=self.config['window'])
+        self._probes = 0
+        self._probe_successes = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+
+    def available(self) -> bool:
+        """当前是否允许发出请求（不占用半开状态的探测名额）"""
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN:
+                return time.monotonic() - self._opened_at >= self.config['open_seconds']
+            return self._probes < self.config['half_open_calls']
+
+    def acquire(self):
+        """发出请求前调用，熔断器打开时抛出 CircuitOpenError
+
+        调用后必须调用 record() 或 release() 之一
+        """
+        with self._lock:
+            if self._state == OPEN:
+                remaining = self.config['open_seconds'] - (time.monotonic() - self._opened_at)
+                if remaining > 0:
+                    metrics.inc('circuit_rejected', upstream=self.name)
+                    raise CircuitOpenError(self.name, remaining)
+                self._transition(HALF_OPEN)
+            if self._state == HALF_OPEN:
+                if self._probes >= self.config['half_open_calls']:
+                    metrics.inc('circuit_rejected', upstream=self.name)
+                    raise CircuitOpenError(self.name, self.config['open_seconds'])
+                self._probes += 1
+
+    def release(self):
+        """请求被调用方放弃（如对冲请求落选），不计入统计"""
+        with self._lock:
+            if self._state == HALF_OPEN and self._probes:
+                self._probes -= 1
+
+    def record(self, success: bool, seconds: float):
+        """记录一次调用的结果
+
+        Args:
+            success (bool): 调用是否成功
+            seconds (float): 调用耗时（流式请求为首字延迟）
+        """
+        slow = success and seconds > self.config['slow_call_seconds']
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probes = max(0, self._probes - 1)
+                if not success or slow:
+                    self._transition(OPEN)
+                    return
+                self._probe_successes += 1
+                if self._probe_successes >= self.config['half_open_calls']:
+                    self._transition(CLOSED)
+                return
+
+            now = time.monotonic()
+            self._calls.append((now, not success, slow))
+            if self._state != CLOSED:
+                return
+            cutoff = now - self.config['window_seconds']
+            recent = [call for call in self._calls if call[0] >= cutoff]
+            if len(recent) < self.config['min_calls']:
+                return
+            failures = sum(1 for _, failed, _ in recent if failed)
+            slow_calls = sum(1 for _, _, is_slow in recent if is_slow)
+            if failures / len(recent) >= self.config['failure_ratio'] \
+                    or slow_calls / len(recent) >= self.config['slow_ratio']:
+                self._transition(OPEN)
+
+    @contextmanager
+    def guard(self, is_failure: Optional[Callable[[BaseException], bool]] = None):
+        """包裹一次调用：先检查熔断状态，代码块抛出异常时记为失败，否则按耗时记为成功或慢调用
+
+        Args:
+            is_failure (Callable, optional): 判断异常是否算作上游故障（如 4xx 不算），默认都算
+        """
+        self.acquire()
+        start = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            self.record(is_failure is not None and not is_failure(e), time.monotonic() - start)
+            raise
+        except BaseException:
+            # 请求被取消（asyncio.CancelledError 等），不计入统计
+            self.release()
+            raise
+        self.record(True, time.monotonic() - start)
+
+    def _transition(self, state: str):
+        """切换状态（调用方持有锁）"""
+        if state == self._state:
+            return
+        self._state = state
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+        if state in (OPEN, CLOSED):
+            self._calls.clear()
+        self._probes = 0
+        self._probe_successes = 0
+        metrics.inc('circuit_transitions', upstream=self.name, state=state)
+        print(f"熔断器 {self.name}: -> {state}")
+
+    def status(self) -> Dict:
+        """获取熔断器状态"""
+        with self._lock:
+            status = {'state': self._state, 'recent_calls': len(self._calls)}
+            if self._state == OPEN:
+                status['retry_after'] = max(0.0, self.config['open_seconds'] - (time.monotonic() - self._opened_at))
+            return status
+
+
+class CircuitBreakers:
+    """进程内共享的熔断器表，每个上游服务（asr、llm、tts、dida365）一个熔断器"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._config: Dict = {}
+
+    def configure(self, breaker_config: Optional[Dict]):
+        """设置熔断配置，只影响之后新建的熔断器
+
+        Args:
+            breaker_config (Dict, optional): 配置文件中的 circuit_breakers 配置段，格式为：
+            {
+                "default": {...},        # 所有上游共用的配置，格式见 DEFAULT_BREAKER_CONFIG
+                "llm": {...}             # 单个上游的配置，覆盖 default 中的项
+            }
+        """
+        if breaker_config:
+            with self._lock:
+                self._config = breaker_config
+
+    def get(self, name: str) -> CircuitBreaker:
+        """获取指定上游服务的熔断器，不存在时创建"""
+        breaker = self._breakers.get(name)
+        if breaker is not None:
+            return breaker
+        with self._lock:
+            breaker = self._breakers.get(name)
+            if breaker is None:
+                config = {**self._config.get('default', {}), **self._config.get(name, {})}
+                breaker = self._breakers[name] = CircuitBreaker(name, config)
+            return breaker
+
+    def status(self) -> Dict:
+        """获取所有熔断器的状态"""
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {name: breaker.status() for name, breaker in breakers.items()}
+
+
+# 进程内共享的熔断器表
+breakers = CircuitBreakers()
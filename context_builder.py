@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""任务分析提示词中的任务上下文
+
+按与用户指令的相关性对未完成任务排序，紧凑序列化后在 token 预算内截断，
+避免提示词长度、LLM延迟和费用随任务数量线性增长。
+"""
+import json
+import logging
+import math
+import re
+from datetime import datetime
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+import pytz
+
+from dida365_api import DIDA_DATETIME_FORMATS
+from metrics import metrics
+
+logger = logging.getLogger('aristotle')
+
+DEFAULT_CONTEXT_CONFIG = {
+    'token_budget': 3000,        # 任务列表的 token 预算
+    'project_token_budget': 800, # 项目列表的 token 预算
+    'max_content_chars': 60,     # 每个任务保留的内容字数
+    'weights': {
+        'lexical': 3.0,          # 任务标题/内容与指令的字词重合度
+        'date': 1.0,             # 开始/截止时间与当前时间的接近程度
+        'recency': 0.5,          # 最近修改过的任务
+        'priority': 0.2          # 任务优先级（0-3）
+    }
+}
+
+# 剩余预算不足以放下一个最短的任务时停止
+MIN_TASK_TOKENS = 20
+
+_CJK = re.compile(r'[㐀-鿿豈-﫿]')
+_WORD = re.compile(r'[a-z0-9]+')
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算文本的 token 数：中文约每字1个 token，其余字符约每4个1个 token"""
+    cjk = len(_CJK.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+@lru_cache(maxsize=65536)
+def _terms(text: str) -> frozenset:
+    """提取用于字词匹配的词项：中文按单字和相邻双字，英文和数字按单词"""
+    text = text.lower()
+    terms = set(_WORD.findall(text))
+    for run in re.findall(r'[㐀-鿿豈-﫿]+', text):
+        terms.update(run)
+        terms.update(run[i:i + 2] for i in range(len(run) - 1))
+    return frozenset(terms)
+
+
+def _task_terms(task: Dict) -> frozenset:
+    return _terms(f"{task.get('title') or ''} {task.get('content') or ''}")
+
+
+def term_weights(command_terms: frozenset, tasks: List[Dict]) -> Dict[str, float]:
+    """按逆文档频率计算指令词项的权重：出现在大量任务中的词项（如常见字）区分度低，权重小
+
+    只在任务中出现过的词项才有权重，指令中的"把"、"改到"等不影响相关性
+    """
+    counts = dict.fromkeys(command_terms, 0)
+    for task in tasks:
+        for term in command_terms & _task_terms(task):
+            counts[term] += 1
+    total = len(tasks)
+    return {
+        term: len(term) * math.log(1 + total / count)
+        for term, count in counts.items() if count
+    }
+
+
+@lru_cache(maxsize=4096)
+def _parse_time(value: str) -> Optional[datetime]:
+    for fmt in DIDA_DATETIME_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def _short_time(value: Optional[str], tz) -> Optional[str]:
+    """把滴答清单时间转换为本地时间的 "yyyy-MM-dd HH:mm"，便于LLM阅读"""
+    parsed = _parse_time(value) if value else None
+    if parsed is None:
+        return value
+    return parsed.astimezone(tz).strftime('%Y-%m-%d %H:%M')
+
+
+def compact_task(task: Dict, tz, max_content_chars: int) -> str:
+    """把任务序列化为一行紧凑的JSON，只保留LLM需要的非空字段"""
+    item = {
+        'id': task.get('id'),
+        'projectId': task.get('projectId'),
+        'title': task.get('title')
+    }
+    content = (task.get('content') or '').strip()
+    if content:
+        item['content'] = content[:max_content_chars]
+    for key in ('startDate', 'dueDate'):
+        if task.get(key):
+            item[key] = _short_time(task[key], tz)
+    if task.get('isAllDay'):
+        item['isAllDay'] = True
+    if task.get('priority'):
+        item['priority'] = task['priority']
+    return json.dumps(item, ensure_ascii=False, separators=(',', ':'))
+
+
+def score_task(task: Dict, weights_by_term: Dict[str, float], now: datetime, weights: Dict,
+               mentioned_projects: set) -> float:
+    """计算任务与指令的相关性得分
+
+    Args:
+        task (Dict): 任务
+        weights_by_term (Dict[str, float]): 指令词项的权重，见 term_weights()
+        now (datetime): 当前时间（带时区）
+        weights (Dict): 各项得分的权重
+        mentioned_projects (set): 指令中提到的项目ID
+
+    Returns:
+        float: 相关性得分，越大越相关
+    """
+    score = 0.0
+
+    if weights_by_term:
+        # 按命中词项的权重占比计分，取值 0-1
+        matched = weights_by_term.keys() & _task_terms(task)
+        lexical = sum(weights_by_term[term] for term in matched) / sum(weights_by_term.values())
+        score += weights['lexical'] * lexical
+    if task.get('projectId') in mentioned_projects:
+        score += weights['lexical'] * 0.5
+
+    dates = [_parse_time(task[key]) for key in ('dueDate', 'startDate') if task.get(key)]
+    dates = [value for value in dates if value is not None]
+    if dates:
+        days = min(abs((value - now).total_seconds()) for value in dates) / 86400
+        score += weights['date'] / (1 + days)
+
+    modified = _parse_time(task['modifiedTime']) if task.get('modifiedTime') else None
+    if modified is not None:
+        days = max(0.0, (now - modified).total_seconds() / 86400)
+        score += weights['recency'] / (1 + days)
+
+    score += weights['priority'] * (task.get('priority') or 0) / 3
+    return score
+
+
+def build_task_context(command: str, tasks: List[Dict], projects: List[Dict],
+                       config: Optional[Dict] = None, timezone: str = 'Asia/Shanghai',
+                       now: Optional[datetime] = None) -> Dict:
+    """构造提示词中的任务和项目上下文
+
+    Args:
+        command (str): 用户指令
+        tasks (List[Dict]): 未完成的任务
+        projects (List[Dict]): 项目列表
+        config (Dict, optional): 配置文件中的 context 配置段，未提供的项使用 DEFAULT_CONTEXT_CONFIG
+        timezone (str): 任务时间显示使用的时区
+        now (datetime, optional): 当前时间，默认取系统时间
+
+    Returns:
+        Dict: 上下文信息，格式为：
+        {
+            "tasks": "按相关性排序的任务，每行一个",
+            "projects": "项目列表",
+            "kept": 保留的任务数,
+            "dropped": 超出预算被丢弃的任务数,
+            "tokens": 任务和项目上下文的估算 token 数
+        }
+    """
+    config = {**DEFAULT_CONTEXT_CONFIG, **(config or {})}
+    weights = {**DEFAULT_CONTEXT_CONFIG['weights'], **config.get('weights', {})}
+    tz = pytz.timezone(timezone)
+    now = now or datetime.now(tz)
+
+    weights_by_term = term_weights(_terms(command or ''), tasks)
+    mentioned_projects = {
+        project.get('id') for project in projects
+        if project.get('name') and project['name'] in (command or '')
+    }
+    ranked = sorted(
+        tasks,
+        key=lambda task: score_task(task, weights_by_term, now, weights, mentioned_projects),
+        reverse=True
+    )
+
+    lines, used = [], 0
+    for task in ranked:
+        if config['token_budget'] - used < MIN_TASK_TOKENS:
+            break
+        line = compact_task(task, tz, config['max_content_chars'])
+        cost = estimate_tokens(line) + 1
+        if used + cost > config['token_budget']:
+            # 继续尝试后面更短的任务，尽量用满预算
+            continue
+        lines.append(line)
+        used += cost
+
+    project_lines, project_used = [], 0
+    for project in projects:
+        line = json.dumps({'id': project.get('id'), 'name': project.get('name')},
+                          ensure_ascii=False, separators=(',', ':'))
+        cost = estimate_tokens(line) + 1
+        if project_used + cost > config['project_token_budget']:
+            break
+        project_lines.append(line)
+        project_used += cost
+
+    dropped = len(tasks) - len(lines)
+    if dropped:
+        metrics.inc('context_tasks_dropped', dropped)
+        logger.info(f"任务上下文：保留 {len(lines)}/{len(tasks)} 个任务，超出预算丢弃 {dropped} 个")
+    if len(project_lines) < len(projects):
+        logger.info(f"项目上下文：保留 {len(project_lines)}/{len(projects)} 个项目")
+    metrics.inc('context_tasks_kept', len(lines))
+
+    return {
+        'tasks': '\n'.join(lines) if lines else '（无）',
+        'projects': '\n'.join(project_lines) if project_lines else '（无）',
+        'kept': len(lines),
+        'dropped': dropped,
+        'tokens': used + project_used
+    }
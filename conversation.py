@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""多轮对话的会话记录
+
+每个浏览器会话保存最近几轮的指令和回复，"改成下午三点"、"好的"这类后续指令可以结合上文理解。
+发给LLM的消息按固定的顺序排列：
+
+    [固定的系统提示词, 更早对话的摘要, 最近几轮的 (指令, 回复), 本轮的时间/任务上下文和指令]
+
+前面的部分在相邻两轮之间保持不变，模型服务可以复用提示词前缀的缓存；每轮只新增一条紧凑的指令
+和回复，任务列表等动态内容只出现在最后一条消息中。历史超过轮数或 token 上限时，把较早的一半
+压缩为每轮一行的摘要，摘要本身也有 token 上限。
+"""
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from context_builder import estimate_tokens
+from metrics import metrics
+
+logger = logging.getLogger('aristotle')
+
+DEFAULT_CONVERSATION_CONFIG = {
+    'max_sessions': 256,          # 同时保存的会话数，超出时淘汰最久未使用的会话
+    'ttl': 1800,                  # 会话空闲多少秒后过期
+    'max_turns': 6,               # 原样保留的最近轮数
+    'history_token_budget': 1200, # 最近几轮的 token 上限
+    'summary_token_budget': 300   # 摘要的 token 上限
+}
+
+# 回复中保留的任务字段，后续指令可以据此找到上一轮提到的任务
+REPLY_TASK_FIELDS = ('id', 'projectId', 'title', 'startDate', 'dueDate', 'date')
+# 摘要中每轮回复保留的字数
+SUMMARY_REPLY_CHARS = 40
+# 每条消息的格式开销（角色标记等）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def message_tokens(message: Dict) -> int:
+    """估算一条消息的 token 数"""
+    return estimate_tokens(message['content']) + MESSAGE_OVERHEAD_TOKENS
+
+
+def compact_reply(response_text: str, actions: Optional[List[Dict]] = None) -> str:
+    """把本轮的回复和执行的操作序列化为一行紧凑的JSON，作为历史中的 assistant 消息"""
+    reply = {'response': response_text}
+    if actions:
+        reply['actions'] = [
+            {
+                'action': action.get('action'),
+                'task_data': {key: value for key, value in (action.get('task_data') or {}).items()
+                              if key in REPLY_TASK_FIELDS}
+            }
+            for action in actions
+        ]
+    return json.dumps(reply, ensure_ascii=False, separators=(',', ':'))
+
+
+class Conversation:
+    """一个会话的对话记录"""
+
+    def __init__(self, session_id: str):
+        self.id = session_id
+        # 每轮为 (user 消息, assistant 消息, 摘要行)
+        self.turns: List[tuple] = []
+        self.summary: List[str] = []
+        self.last_used = time.time()
+        # 上一轮发给LLM的消息，用于统计本轮可复用的前缀
+        self.last_prompt: List[Dict] = []
+
+    def history(self) -> List[Dict]:
+        """获取放在系统提示词和本轮消息之间的历史消息"""
+        messages = []
+        if self.summary:
+            messages.append({'role': 'system', 'content': '更早的对话摘要：\n' + '\n'.join(self.summary)})
+        for user, assistant, _ in self.turns:
+            messages.extend((user, assistant))
+        return messages
+
+
+class ConversationStore:
+    """进程内的会话表，所有线程共享"""
+
+    def __init__(self, config: Optional[Dict] = None):
+        """初始化会话表
+
+        Args:
+            config (Dict, optional): 配置文件中的 conversation 配置段，未提供的项使用 DEFAULT_CONVERSATION_CONFIG
+        """
+        self.config = {**DEFAULT_CONVERSATION_CONFIG, **(config or {})}
+        self._sessions: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        # 最近一次的系统提示词，所有会话共用，新会话的第一轮也可以复用
+        self._last_system: Optional[Dict] = None
+        self._totals = {'turns': 0, 'prompt_tokens': 0, 'cacheable_tokens': 0, 'summarized_turns': 0}
+
+    def get(self, session_id: Optional[str]) -> Conversation:
+        """获取会话，会话ID为空、不存在或已过期时创建新会话
+
+        Args:
+            session_id (str, optional): 浏览器保存的会话ID
+
+        Returns:
+            Conversation: 会话
+        """
+        now = time.time()
+        with self._lock:
+            expired = [key for key, value in self._sessions.items()
+                       if now - value.last_used > self.config['ttl']]
+            for key in expired:
+                del self._sessions[key]
+
+            conversation = self._sessions.get(session_id) if session_id else None
+            if conversation is None:
+                conversation = Conversation(uuid.uuid4().hex)
+                self._sessions[conversation.id] = conversation
+                while len(self._sessions) > self.config['max_sessions']:
+                    self._sessions.popitem(last=False)
+            self._sessions.move_to_end(conversation.id)
+            conversation.last_used = now
+            return conversation
+
+    def measure(self, conversation: Conversation, messages: List[Dict]) -> Dict:
+        """统计本轮提示词的 token 数，以及与上一轮相同、可以复用缓存的前缀
+
+        Args:
+            conversation (Conversation): 会话
+            messages (List[Dict]): 本轮发给LLM的消息
+
+        Returns:
+            Dict: {"prompt_tokens": 估算的提示词 token 数, "cacheable_tokens": 可复用前缀的 token 数}
+        """
+        with self._lock:
+            previous = conversation.last_prompt or ([self._last_system] if self._last_system else [])
+            cacheable = 0
+            for current, before in zip(messages, previous):
+                if current != before:
+                    break
+                cacheable += message_tokens(current)
+            total = sum(message_tokens(message) for message in messages)
+            conversation.last_prompt = list(messages)
+            self._last_system = messages[0]
+            self._totals['turns'] += 1
+            self._totals['prompt_tokens'] += total
+            self._totals['cacheable_tokens'] += cacheable
+
+        metrics.inc('prompt_tokens', total, part='total')
+        metrics.inc('prompt_tokens', cacheable, part='cacheable_prefix')
+        logger.info(f"提示词约 {total} tokens，其中 {cacheable} tokens 与上一轮前缀相同可复用缓存"
+                    f"（{cacheable / total:.0%}），历史 {len(conversation.turns)} 轮")
+        return {'prompt_tokens': total, 'cacheable_tokens': cacheable}
+
+    def record(self, conversation: Conversation, command: str, response_text: str,
+               actions: Optional[List[Dict]] = None):
+        """记录一轮对话，历史过长时把较早的轮次压缩为摘要
+
+        Args:
+            conversation (Conversation): 会话
+            command (str): 用户指令
+            response_text (str): 播放给用户的回复
+            actions (List[Dict], optional): 本轮执行的任务操作
+        """
+        user = {'role': 'user', 'content': command}
+        assistant = {'role': 'assistant', 'content': compact_reply(response_text, actions)}
+        titles = [(action.get('task_data') or {}).get('title') for action in actions or []]
+        line = f"- 用户：{command}；助手：{response_text[:SUMMARY_REPLY_CHARS]}"
+        if any(titles):
+            line += f"（{'、'.join(filter(None, titles))}）"
+
+        with self._lock:
+            conversation.turns.append((user, assistant, line))
+            self._compact(conversation)
+
+    def _compact(self, conversation: Conversation):
+        """历史超过轮数或 token 上限时，把较早的一半轮次并入摘要（调用方持有锁）
+
+        一次压缩一半而不是每轮压缩一条，历史消息的前缀在多数轮次之间保持不变
+        """
+        def history_tokens():
+            return sum(message_tokens(user) + message_tokens(assistant)
+                       for user, assistant, _ in conversation.turns)
+
+        max_turns = max(1, self.config['max_turns'])
+        budget = self.config['history_token_budget']
+        if len(conversation.turns) <= max_turns and history_tokens() <= budget:
+            return
+
+        folded = 0
+        while conversation.turns and (len(conversation.turns) > max_turns // 2
+                                      or history_tokens() > budget // 2):
+            conversation.summary.append(conversation.turns.pop(0)[2])
+            folded += 1
+        while conversation.summary and sum(estimate_tokens(line) + 1 for line in conversation.summary) \
+                > self.config['summary_token_budget']:
+            conversation.summary.pop(0)
+        self._totals['summarized_turns'] += folded
+        metrics.inc('conversation_summarized_turns', folded)
+
+    def stats(self) -> Dict:
+        """获取会话数和提示词前缀复用情况"""
+        with self._lock:
+            totals = dict(self._totals)
+            sessions = len(self._sessions)
+        return {
+            'sessions': sessions,
+            **totals,
+            'cacheable_ratio': totals['cacheable_tokens'] / totals['prompt_tokens'] if totals['prompt_tokens'] else 0.0
+        }
@@ -1,15 +1,30 @@
 # -*- coding: utf-8 -*-
 import json
 import sqlite3
+import hashlib
 import requests
 import base64
+from circuit_breaker import breakers
+from http_session import sessions
+from metrics import metrics
+from rate_limiter import get_scheduler, INTERACTIVE, BACKGROUND, RETRYABLE_STATUS
 from typing import Optional, List, Dict
 from pathlib import Path
 import webbrowser
 from http.server import HTTPServer, BaseHTTPRequestHandler
 import threading
+import queue
 import urllib.parse
 import time
+import sys
+import logging
+from datetime import datetime, timedelta
+import pytz
+from contextlib import contextmanager
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger('aristotle')
 
 class OAuthCallbackHandler(BaseHTTPRequestHandler):
     """OAuth callback handler"""
@@ -36,8 +51,170 @@ class OAuthCallbackHandler(BaseHTTPRequestHandler):
         """禁用HTTP服务器的日志输出"""
         pass
 
+# 本地数据库默认的PRAGMA设置，可通过配置中的 sqlite_pragmas 覆盖
+# WAL模式下读操作不会被正在进行的同步写入阻塞
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',       # WAL模式下NORMAL已足够安全，避免每次提交都fsync
+    'cache_size': -32000,          # 负数表示KB，约32MB页缓存
+    'mmap_size': 268435456,        # 256MB内存映射读
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000           # 写锁冲突时最多等待5秒
+}
+
+# 滴答清单返回的时间格式，例如 "2019-11-13T03:00:00+0000" 或 "2019-11-13T03:00:00.000+0000"
+DIDA_DATETIME_FORMATS = ('%Y-%m-%dT%H:%M:%S%z', '%Y-%m-%dT%H:%M:%S.%f%z')
+
+# 本地数据库中的时间统一存为UTC的 "yyyy-MM-ddTHH:mm:ss"，可直接按字符串比较和走索引
+DB_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+# 任务表中由服务端数据填充的列，以及对应的任务字段
+TASK_COLUMNS = (
+    ('id', 'id'),
+    ('project_id', 'projectId'),
+    ('title', 'title'),
+    ('content', 'content'),
+    ('status', 'status'),
+    ('start_date', 'startDate'),
+    ('due_date', 'dueDate'),
+    ('priority', 'priority'),
+    ('is_all_day', 'isAllDay'),
+    ('time_zone', 'timeZone'),
+    ('modified_time', 'modifiedTime')
+)
+
+@lru_cache(maxsize=4096)
+def _convert_to_utc(value: str) -> str:
+    """将带时区的时间字符串转换为UTC的数据库时间格式，无法解析时原样返回"""
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        parsed = None
+        for fmt in DIDA_DATETIME_FORMATS:
+            try:
+                parsed = datetime.strptime(value, fmt)
+                break
+            except ValueError:
+                continue
+    if parsed is None or parsed.tzinfo is None:
+        return value
+    return parsed.astimezone(pytz.utc).strftime(DB_DATETIME_FORMAT)
+
+class DidaAPIError(Exception):
+    """滴答清单API请求失败
+    
+    Attributes:
+        status_code (int, optional): HTTP状态码；连接失败或超时时为None
+    """
+    
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+class DidaAuthRequired(DidaAPIError):
+    """令牌无效且无法自动刷新，需要在终端中重新授权"""
+    
+    def __init__(self, message: str = "滴答清单授权已失效，请在终端运行 python dida365_api.py 重新授权"):
+        super().__init__(message, 401)
+
+def is_upstream_failure(error: Exception) -> bool:
+    """判断请求异常是否说明滴答清单服务本身有问题（连接失败、超时、5xx），用于熔断统计
+    
+    4xx（参数错误、任务不存在等）和需要重新授权不算作上游故障
+    """
+    if isinstance(error, DidaAuthRequired):
+        return False
+    if isinstance(error, DidaAPIError):
+        return error.status_code is None or error.status_code >= 500
+    return True
+
+class SQLiteConnectionPool:
+    """SQLite连接池
+    
+    连接在线程间复用（同一时刻只被一个线程持有），避免每个请求都重新打开数据库和设置PRAGMA。
+    """
+    
+    def __init__(self, db_path: str, pragmas: Dict, max_idle: int = 8):
+        """初始化连接池
+        
+        Args:
+            db_path (str): 数据库文件路径
+            pragmas (Dict): 新建连接时设置的PRAGMA
+            max_idle (int): 最多保留的空闲连接数，超出的连接在归还时关闭
+        """
+        self.db_path = db_path
+        self.pragmas = pragmas
+        self._idle = queue.LifoQueue(maxsize=max_idle)
+    
+    def acquire(self) -> sqlite3.Connection:
+        """取出一个空闲连接，没有空闲连接时新建"""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        # 连接会在不同线程间传递，但同一时刻只有一个线程使用
+        conn = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False)
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+    
+    def release(self, conn: sqlite3.Connection):
+        """归还连接；未结束的事务会被回滚"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+        except sqlite3.Error:
+            conn.close()
+    
+    def close(self):
+        """关闭所有空闲连接"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
 class DidaAPI:
-    _local = threading.local()
+    # 数据库结构版本，保存在 PRAGMA user_version 中
+    SCHEMA_VERSION = 5
+    
+    # 本地日期（如按日期查询任务）所使用的时区
+    DEFAULT_TIMEZONE = 'Asia/Shanghai'
+    
+    # 进程内共享的项目目录缓存：同步后直接刷新，过期后从本地数据库重新加载
+    _project_cache: Optional[List[Dict]] = None
+    _project_cache_loaded_at = 0.0
+    _project_cache_lock = threading.Lock()
+    
+    # 按配置文件路径共享的客户端实例，见 shared()
+    _shared_instances: Dict[str, 'DidaAPI'] = {}
+    _shared_lock = threading.Lock()
+    
+    @classmethod
+    def shared(cls, config_path: str = "config.json") -> 'DidaAPI':
+        """获取进程内共享的客户端实例，首次调用时才创建
+        
+        共享实例只读取一次配置、只执行一次数据库初始化和令牌加载，
+        并通过连接池在请求之间复用SQLite连接。
+        使用完数据库后应调用 close() 把当前线程的连接归还连接池。
+        
+        Args:
+            config_path (str): Path to configuration file
+        
+        Returns:
+            DidaAPI: 共享的客户端实例
+        """
+        instance = cls._shared_instances.get(config_path)
+        if instance is None:
+            with cls._shared_lock:
+                instance = cls._shared_instances.get(config_path)
+                if instance is None:
+                    instance = cls(config_path)
+                    cls._shared_instances[config_path] = instance
+        return instance
     
     def __init__(self, config_path: str = "config.json"):
         """Initialize Dida365 API client
@@ -51,6 +228,28 @@ class DidaAPI:
         
         self.config = config['dida365']
         self.access_token = None
+        self.refresh_token = None
+        self.token_expires_at = None
+        
+        # 令牌刷新锁：并发的401只触发一次刷新，其余线程等待并复用刷新结果
+        self._token_lock = threading.Lock()
+        self._token_refresher: Optional[threading.Thread] = None
+        
+        # 每个线程当前持有的数据库连接，连接本身来自连接池
+        self._local = threading.local()
+        self._pool = SQLiteConnectionPool(
+            self.config['db_path'],
+            {**SQLITE_PRAGMAS, **self.config.get('sqlite_pragmas', {})},
+            max_idle=self.config.get('sqlite_pool_size', 8)
+        )
+        
+        # 共享的keep-alive会话，所有DidaAPI实例复用同一个连接池
+        sessions.configure(config.get('http'))
+        self.session = sessions.get('dida365')
+        breakers.configure(config.get('circuit_breakers'))
+        
+        # 所有Dida请求共用的限流和重试调度器
+        self.scheduler = get_scheduler('dida365', self.config.get('rate_limit'))
         
         # Initialize database for the current thread
         self._init_database()
@@ -59,14 +258,19 @@ class DidaAPI:
         self._load_token()
         
         # If no valid token, perform authorization
-        if not self.access_token:
+        # 只在有终端的主线程中进行交互式授权；否则请求会直接抛出 DidaAuthRequired
+        if not self.access_token and self._can_prompt():
             self._authorize()
     
     @property
     def conn(self):
-        """Get thread-local database connection"""
+        """Get thread-local database connection
+        
+        首次使用时从连接池取出连接并绑定到当前线程，直到 close() 归还。
+        连接使用自动提交模式（isolation_level=None），写操作通过 _transaction() 显式开启事务
+        """
         if not hasattr(self._local, 'conn'):
-            self._local.conn = sqlite3.connect(self.config['db_path'])
+            self._local.conn = self._pool.acquire()
         return self._local.conn
     
     @property
@@ -76,8 +280,46 @@ class DidaAPI:
             self._local.cursor = self.conn.cursor()
         return self._local.cursor
     
+    @contextmanager
+    def _transaction(self):
+        """在显式事务中执行写操作
+        
+        使用 BEGIN IMMEDIATE 在事务开始时获取写锁，成功时提交，异常时回滚。
+        已处于事务中时直接复用外层事务。
+        
+        Yields:
+            sqlite3.Cursor: 当前线程的数据库游标
+        """
+        if self.conn.in_transaction:
+            yield self.cursor
+            return
+        
+        self.cursor.execute('BEGIN IMMEDIATE')
+        try:
+            yield self.cursor
+        except BaseException:
+            self.conn.rollback()
+            raise
+        else:
+            self.conn.commit()
+    
     def _init_database(self):
-        """Initialize SQLite database"""
+        """Initialize SQLite database
+        
+        按 PRAGMA user_version 记录的版本依次执行尚未执行的迁移
+        """
+        migrations = [self._migrate_v1, self._migrate_v2, self._migrate_v3, self._migrate_v4,
+                      self._migrate_v5]
+        with self._transaction() as cursor:
+            cursor.execute('PRAGMA user_version')
+            version = cursor.fetchone()[0]
+            for target, migration in enumerate(migrations[version:], start=version + 1):
+                migration()
+                cursor.execute(f'PRAGMA user_version = {target}')
+                print(f"本地数据库已迁移到版本 {target}")
+    
+    def _migrate_v1(self):
+        """版本1：基础数据表及增量同步所需的列"""
         # Create auth table
         self.cursor.execute('''
         CREATE TABLE IF NOT EXISTS auth (
@@ -111,25 +353,233 @@ class DidaAPI:
         )
         ''')
         
-        self.conn.commit()
+        # 增量同步所需的列（旧数据库中不存在时补齐）
+        self._ensure_columns('tasks', {
+            'content_hash': 'TEXT',
+            'deleted': 'INTEGER DEFAULT 0'
+        })
+        self._ensure_columns('projects', {
+            'remote_version': 'TEXT',
+            'data_hash': 'TEXT',
+            'deleted': 'INTEGER DEFAULT 0'
+        })
+    
+    def _migrate_v2(self):
+        """版本2：任务的日期、优先级等字段及查询索引"""
+        self._ensure_columns('tasks', {
+            'start_date': 'TEXT',
+            'due_date': 'TEXT',
+            'priority': 'INTEGER DEFAULT 0',
+            'is_all_day': 'INTEGER DEFAULT 0',
+            'time_zone': 'TEXT',
+            'modified_time': 'TEXT'
+        })
+        
+        # (project_id, status) 同时覆盖按项目同步和按项目查询未完成任务
+        self.cursor.execute('DROP INDEX IF EXISTS idx_tasks_project_id')
+        self.cursor.execute(
+            'CREATE INDEX IF NOT EXISTS idx_tasks_project_status ON tasks (project_id, status)'
+        )
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_due_date ON tasks (due_date)')
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_start_date ON tasks (start_date)')
+        
+        # 旧数据没有新字段，清空指纹使下次增量同步重新写入全部任务
+        self.cursor.execute('UPDATE tasks SET content_hash = NULL')
+        self.cursor.execute('UPDATE projects SET data_hash = NULL, remote_version = NULL')
+    
+    def _migrate_v3(self):
+        """版本3：待写回服务端的本地修改（outbox）"""
+        # 有未写回服务端的本地修改的任务，同步时不会被服务端数据覆盖或删除
+        self._ensure_columns('tasks', {'local_pending': 'INTEGER DEFAULT 0'})
+        
+        self.cursor.execute('''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            op TEXT NOT NULL,
+            task_id TEXT NOT NULL,
+            local_id TEXT,
+            project_id TEXT,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER DEFAULT 0,
+            last_error TEXT,
+            available_at REAL NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_outbox_status ON outbox (status, id)')
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_outbox_task_id ON outbox (task_id, status)')
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_outbox_local_id ON outbox (local_id)')
+    
+    def _migrate_v4(self):
+        """版本4：刷新令牌及访问令牌的过期时间"""
+        self._ensure_columns('auth', {
+            'refresh_token': 'TEXT',
+            'expires_at': 'REAL'
+        })
+    
+    def _migrate_v5(self):
+        """版本5：outbox 记录第一次发送的时间，用于重试创建时判断服务端的同名任务是否早已存在"""
+        self._ensure_columns('outbox', {'first_sent_at': 'REAL'})
+    
+    def _ensure_columns(self, table: str, columns: Dict[str, str]):
+        """为已存在的表补齐缺失的列
+        
+        Args:
+            table (str): 表名
+            columns (Dict[str, str]): 列名到列定义的映射
+        """
+        self.cursor.execute(f'PRAGMA table_info({table})')
+        existing = {row[1] for row in self.cursor.fetchall()}
+        for name, definition in columns.items():
+            if name not in existing:
+                self.cursor.execute(f'ALTER TABLE {table} ADD COLUMN {name} {definition}')
     
     def _load_token(self):
-        """Load access token from database"""
-        self.cursor.execute('SELECT access_token FROM auth ORDER BY created_at DESC LIMIT 1')
+        """Load access token, refresh token and expiry from database"""
+        self.cursor.execute('''
+        SELECT access_token, refresh_token, expires_at FROM auth ORDER BY id DESC LIMIT 1
+        ''')
         result = self.cursor.fetchone()
         if result:
-            self.access_token = result[0]
+            self.access_token, self.refresh_token, self.token_expires_at = result
     
-    def _save_token(self, access_token: str):
+    def _save_token(self, access_token: str, refresh_token: Optional[str] = None,
+                    expires_in: Optional[float] = None):
         """Save access token to database
         
         Args:
             access_token (str): Access token to save
+            refresh_token (str, optional): 刷新令牌，未返回时沿用原有的刷新令牌
+            expires_in (float, optional): 访问令牌的有效期（秒）
         """
-        self.cursor.execute('INSERT INTO auth (access_token) VALUES (?)', (access_token,))
-        self.conn.commit()
+        refresh_token = refresh_token or self.refresh_token
+        expires_at = time.time() + float(expires_in) if expires_in else None
+        with self._transaction() as cursor:
+            cursor.execute('''
+            INSERT INTO auth (access_token, refresh_token, expires_at) VALUES (?, ?, ?)
+            ''', (access_token, refresh_token, expires_at))
         self.access_token = access_token
+        self.refresh_token = refresh_token
+        self.token_expires_at = expires_at
+    
+    @staticmethod
+    def _can_prompt() -> bool:
+        """是否可以进行交互式授权：只允许在有终端的主线程中调用 input()"""
+        return threading.current_thread() is threading.main_thread() \
+            and sys.stdin is not None and sys.stdin.isatty()
     
+    def _request_token(self, data: Dict) -> Dict:
+        """向令牌接口换取访问令牌并保存
+        
+        Args:
+            data (Dict): 表单参数（授权码或刷新令牌）
+        
+        Returns:
+            Dict: 令牌接口的响应
+        
+        Raises:
+            DidaAPIError: 请求失败或响应中没有 access_token
+        """
+        headers = {
+            'Content-Type': 'application/x-www-form-urlencoded',
+            'Accept': 'application/json',
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+        }
+        data = {
+            'client_id': self.config['client_id'],
+            'client_secret': self.config['client_secret'],
+            **data
+        }
+        try:
+            response = self.session.post(
+                self.config['token_url'],
+                headers=headers,
+                data=data,
+                timeout=sessions.timeout('dida365')
+            )
+        except requests.exceptions.RequestException as e:
+            raise DidaAPIError(f"请求失败: {str(e)}")
+        
+        if response.status_code != 200:
+            raise DidaAPIError(
+                f"获取访问令牌失败 - HTTP {response.status_code}: {response.text or '服务器未返回错误信息'}",
+                response.status_code
+            )
+        response_data = response.json()
+        if 'access_token' not in response_data:
+            raise DidaAPIError("响应中未包含access_token")
+        
+        self._save_token(
+            response_data['access_token'],
+            response_data.get('refresh_token'),
+            response_data.get('expires_in')
+        )
+        return response_data
+    
+    def refresh_access_token(self, stale_token: Optional[str] = None):
+        """使用刷新令牌获取新的访问令牌
+        
+        多个线程同时调用时只有一个线程发送刷新请求，其余线程等待后直接使用新令牌。
+        
+        Args:
+            stale_token (str, optional): 调用方认为已失效的令牌；当前令牌已经不是它时，
+                说明其他线程（或进程）已完成刷新，不再重复刷新
+        
+        Raises:
+            DidaAuthRequired: 没有刷新令牌或刷新令牌已失效，需要重新授权
+        """
+        with self._token_lock:
+            if stale_token is not None:
+                # 其他进程可能已经刷新并写入了数据库
+                self._load_token()
+                if self.access_token and self.access_token != stale_token:
+                    return
+            if not self.refresh_token:
+                raise DidaAuthRequired()
+            
+            with metrics.timer('dida', op='token_refresh') as stage:
+                try:
+                    self._request_token({
+                        'grant_type': 'refresh_token',
+                        'refresh_token': self.refresh_token
+                    })
+                except DidaAPIError as e:
+                    stage.fail()
+                    if e.status_code in (400, 401):
+                        # 刷新令牌被拒绝，只能重新授权
+                        raise DidaAuthRequired() from e
+                    raise
+            logger.info("滴答清单访问令牌已刷新")
+    
+    def start_token_refresher(self, margin: float = 3600, check_interval: float = 300):
+        """启动后台线程，在访问令牌过期前 margin 秒内主动刷新
+        
+        Args:
+            margin (float): 提前刷新的时间（秒）
+            check_interval (float): 检查令牌过期时间的间隔（秒）
+        """
+        if self._token_refresher and self._token_refresher.is_alive():
+            return
+        
+        def run():
+            while True:
+                expires_at = self.token_expires_at
+                if expires_at and self.refresh_token and time.time() >= expires_at - margin:
+                    try:
+                        self.refresh_access_token()
+                    except DidaAuthRequired as e:
+                        logger.error(str(e))
+                    except Exception as e:
+                        logger.warning(f"主动刷新访问令牌失败，稍后重试: {str(e)}")
+                    finally:
+                        self.close()
+                time.sleep(check_interval)
+        
+        self._token_refresher = threading.Thread(target=run, name='token-refresher', daemon=True)
+        self._token_refresher.start()
+
     def _authorize(self):
         """执行OAuth认证流程"""
         # 构建认证URL，确保scope格式正确
@@ -193,81 +643,90 @@ class DidaAPI:
         
         if not auth_code:
             raise Exception("未能获取认证码")
-            
-        # 使用认证码获取访问令牌
-        headers = {
-            'Content-Type': 'application/x-www-form-urlencoded',
-            'Accept': 'application/json',
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        }
         
-        # 准备请求数据
-        data = {
-            'client_id': self.config['client_id'],
-            'client_secret': self.config['client_secret'],
+        # 使用认证码获取访问令牌
+        print(f"\n=== 获取访问令牌 ===")
+        print(f"请求URL: {self.config['token_url']}")
+        self._request_token({
             'code': auth_code,
             'grant_type': 'authorization_code',
             'redirect_uri': self.config['redirect_uri']
-        }
-        
-        try:
-            print(f"\n=== 获取访问令牌 ===")
-            print(f"请求URL: {self.config['token_url']}")
-            print(f"请求头: {headers}")
-            print(f"请求数据: {data}")
-            
-            response = requests.post(
-                self.config['token_url'],
-                headers=headers,
-                data=data,
-                timeout=30,
-                verify=True
-            )
-            
-            if response.status_code == 200:
-                response_data = response.json()
-                if 'access_token' in response_data:
-                    access_token = response_data['access_token']
-                    self._save_token(access_token)
-                    print("\n认证成功！")
-                else:
-                    raise Exception("响应中未包含access_token")
-            else:
-                error_msg = f"HTTP {response.status_code}"
-                try:
-                    error_data = response.json()
-                    error_msg = f"{error_msg}: {json.dumps(error_data, ensure_ascii=False)}"
-                except:
-                    if response.text:
-                        error_msg = f"{error_msg}: {response.text}"
-                    else:
-                        error_msg = f"{error_msg}: 服务器未返回错误信息"
-                print("\n=== 错误信息 ===")
-                print(f"响应状态码: {response.status_code}")
-                print(f"响应头: {dict(response.headers)}")
-                print(f"响应内容: {response.text}")
-                raise Exception(f"获取访问令牌失败 - {error_msg}")
-                
-        except requests.exceptions.RequestException as e:
-            raise Exception(f"请求失败: {str(e)}")
-    
-    def _make_request(self, method: str, endpoint: str, **kwargs) -> dict:
+        })
+        print("\n认证成功！")
+
+    def _make_request(self, method: str, endpoint: str, lane: str = INTERACTIVE, **kwargs) -> dict:
         """Make API request with better error handling
         
         Args:
             method (str): HTTP method
             endpoint (str): API endpoint
+            lane (str): 限流通道，INTERACTIVE（语音指令）或 BACKGROUND（同步）
             **kwargs: Request parameters
         
         Returns:
             dict: API response
         
         Raises:
+            CircuitOpenError: 滴答清单服务熔断中，请求未发出
             Exception: When API request fails
         """
+        with metrics.timer('dida', op=f'{method} {self._endpoint_template(endpoint)}'), \
+                breakers.get('dida365').guard(is_upstream_failure):
+            return self._send_request(method, endpoint, lane, **kwargs)
+    
+    @staticmethod
+    def _endpoint_template(endpoint: str) -> str:
+        """将接口路径中的ID替换为占位符，例如 project/123/data -> project/{id}/data
+        
+        滴答清单的接口路径是 "资源/ID/资源/ID" 交替的结构
+        """
+        parts = endpoint.strip('/').split('/')
+        return '/'.join(part if i % 2 == 0 else '{id}' for i, part in enumerate(parts))
+    
+    def _request_with_retry(self, method: str, url: str, headers: Dict, lane: str, **kwargs):
+        """经过限流调度发送请求，遇到限流、服务端错误或连接错误时退避重试
+        
+        GET请求对 RETRYABLE_STATUS 和连接错误都会重试；其他请求可能已被服务端处理，
+        只在明确被拒绝（429）时重试，避免重复创建任务。
+        
+        Returns:
+            requests.Response: 最后一次请求的响应
+        
+        Raises:
+            requests.exceptions.RequestException: 重试耗尽后仍然连接失败
+        """
+        idempotent = method.upper() == 'GET'
+        self.scheduler.record_request()
+        attempt = 0
+        while True:
+            self.scheduler.acquire(lane)
+            try:
+                response = self.session.request(method, url, headers=headers, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if not idempotent or not self.scheduler.allow_retry(attempt, type(e).__name__):
+                    raise
+                delay = self.scheduler.backoff(attempt)
+                print(f"请求失败（{type(e).__name__}），{delay:.2f}秒后重试...")
+            else:
+                retryable = response.status_code == 429 or (
+                    idempotent and response.status_code in RETRYABLE_STATUS
+                )
+                if not retryable or not self.scheduler.allow_retry(attempt, str(response.status_code)):
+                    return response
+                delay = self.scheduler.backoff(attempt, response.headers.get('Retry-After'))
+                print(f"服务端返回 {response.status_code}，{delay:.2f}秒后重试...")
+            time.sleep(delay)
+            attempt += 1
+    
+    def _send_request(self, method: str, endpoint: str, lane: str, **kwargs) -> dict:
+        """发送API请求并处理响应（参数同 _make_request）"""
+        if not self.access_token:
+            raise DidaAuthRequired()
+        
         # 确保请求头符合API要求
+        token = self.access_token
         headers = {
-            'Authorization': f'Bearer {self.access_token}',
+            'Authorization': f'Bearer {token}',
             'Content-Type': 'application/json',
             'Accept': 'application/json',
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
@@ -284,17 +743,19 @@ class DidaAPI:
             if 'json' in kwargs:
                 print(f"请求数据: {kwargs['json']}")
             
-            response = requests.request(method, url, headers=headers, **kwargs)
+            kwargs.setdefault('timeout', sessions.timeout('dida365'))
+            response = self._request_with_retry(method, url, headers, lane, **kwargs)
             
             print(f"响应状态码: {response.status_code}")
             print(f"响应头: {dict(response.headers)}")
             print(f"响应内容: {response.text[:500]}...")  # 只打印前500个字符
             
             if response.status_code == 401:
-                print("Token已过期，重新认证...")
-                self._authorize()
+                # 不在请求线程中进行交互式授权：无法刷新时抛出 DidaAuthRequired
+                print("Token已过期，刷新访问令牌...")
+                self.refresh_access_token(stale_token=token)
                 headers['Authorization'] = f'Bearer {self.access_token}'
-                response = requests.request(method, url, headers=headers, **kwargs)
+                response = self._request_with_retry(method, url, headers, lane, **kwargs)
                 
             response.raise_for_status()  # 对非2xx状态码抛出异常
             
@@ -315,13 +776,15 @@ class DidaAPI:
                 except:
                     if e.response.text:
                         error_msg = f"{error_msg} - {e.response.text}"
-            raise Exception(f"API请求失败: {error_msg}")
+            status_code = e.response.status_code if getattr(e, 'response', None) is not None else None
+            raise DidaAPIError(f"API请求失败: {error_msg}", status_code)
     
-    def get_project_with_data(self, project_id: str) -> Dict:
+    def get_project_with_data(self, project_id: str, lane: str = INTERACTIVE) -> Dict:
         """Get project details including tasks and columns
         
         Args:
             project_id (str): Project ID
+            lane (str): 限流通道，同步时使用 BACKGROUND
         
         Returns:
             Dict: Project information with format:
@@ -347,71 +810,337 @@ class DidaAPI:
                 }]
             }
         """
-        return self._make_request('GET', f'project/{project_id}/data')
+        return self._make_request('GET', f'project/{project_id}/data', lane=lane)
 
-    def sync_with_server(self):
+    def _fetch_projects_data(self, projects: List[Dict], concurrency: int):
+        """按项目顺序获取项目详情，可选使用有界线程池并发请求
+        
+        只在工作线程中发起HTTP请求，不触碰数据库；调用方在当前线程中消费结果并写库。
+        
+        Args:
+            projects (List[Dict]): 项目列表
+            concurrency (int): 最大并发数，<= 1 时串行获取
+        
+        Yields:
+            tuple: (project, project_data, error)，出错时 project_data 为 None
+        """
+        if concurrency <= 1 or len(projects) <= 1:
+            for project in projects:
+                try:
+                    yield project, self.get_project_with_data(project['id'], BACKGROUND), None
+                except Exception as e:
+                    yield project, None, e
+            return
+        
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(projects)),
+                                thread_name_prefix='dida-sync') as executor:
+            futures = [
+                (project, executor.submit(self.get_project_with_data, project['id'], BACKGROUND))
+                for project in projects
+            ]
+            for project, future in futures:
+                try:
+                    yield project, future.result(), None
+                except Exception as e:
+                    yield project, None, e
+
+    @staticmethod
+    def _to_db_datetime(value: Optional[str]) -> Optional[str]:
+        """将滴答清单的时间字符串转换为数据库中的UTC时间格式，无法解析时原样返回"""
+        if not value:
+            return None
+        if value.endswith('+0000') and value[10:11] == 'T':
+            # 服务端返回的时间通常已是UTC，直接截取，避免逐条解析
+            return value[:19]
+        return _convert_to_utc(value)
+    
+    @staticmethod
+    def _from_db_datetime(value: Optional[str]) -> Optional[str]:
+        """将数据库中的UTC时间转换回滴答清单的时间格式"""
+        if not value:
+            return None
+        return f"{value}+0000" if len(value) == 19 else value
+    
+    def _to_db_bound(self, value: str, end: bool = False) -> str:
+        """将查询条件中的日期或时间转换为数据库中的UTC时间
+        
+        Args:
+            value (str): "yyyy-MM-dd" 或滴答清单时间格式；不带时区时按 DEFAULT_TIMEZONE 处理
+            end (bool): 为True且 value 只有日期时，返回该日期次日零点（用作开区间上界）
+        
+        Returns:
+            str: 数据库时间格式的字符串
+        """
+        if len(value) == 10:
+            local = pytz.timezone(self.DEFAULT_TIMEZONE).localize(datetime.strptime(value, '%Y-%m-%d'))
+            if end:
+                local = pytz.timezone(self.DEFAULT_TIMEZONE).normalize(local + timedelta(days=1))
+            return local.astimezone(pytz.utc).strftime(DB_DATETIME_FORMAT)
+        return self._to_db_datetime(value)
+    
+    def _task_row(self, task: Dict) -> tuple:
+        """将任务数据转换为 TASK_COLUMNS 顺序的数据库行"""
+        return (
+            task['id'],
+            task.get('projectId'),
+            task.get('title'),
+            task.get('content'),
+            task.get('status', 0),
+            self._to_db_datetime(task.get('startDate')),
+            self._to_db_datetime(task.get('dueDate')),
+            task.get('priority', 0),
+            1 if task.get('isAllDay') else 0,
+            task.get('timeZone'),
+            task.get('modifiedTime')
+        )
+    
+    def _upsert_tasks(self, rows: List[tuple], content_hashes: Optional[List[str]] = None,
+                      local_pending: bool = False):
+        """批量写入任务行（已存在时更新，保留 created_at）
+        
+        Args:
+            rows (List[tuple]): _task_row 生成的数据库行
+            content_hashes (List[str], optional): 与 rows 对应的内容指纹；
+                不提供时指纹置空，下次增量同步会重新写入这些任务
+            local_pending (bool): 这些行是否包含尚未写回服务端的本地修改
+        """
+        if content_hashes is None:
+            content_hashes = [None] * len(rows)
+        columns = [column for column, _ in TASK_COLUMNS]
+        updates = ', '.join(f'{column} = excluded.{column}' for column in columns[1:])
+        self.cursor.executemany(f'''
+        INSERT INTO tasks ({', '.join(columns)}, content_hash, local_pending, deleted, updated_at)
+        VALUES ({', '.join('?' * len(columns))}, ?, ?, 0, CURRENT_TIMESTAMP)
+        ON CONFLICT(id) DO UPDATE SET {updates},
+            content_hash = excluded.content_hash,
+            local_pending = excluded.local_pending,
+            deleted = 0,
+            updated_at = CURRENT_TIMESTAMP
+        ''', [row + (content_hash, int(local_pending)) for row, content_hash in zip(rows, content_hashes)])
+    
+    @staticmethod
+    def _fingerprint(data) -> str:
+        """计算数据内容指纹（对键排序后的JSON做SHA-1）"""
+        payload = json.dumps(data, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+    
+    @staticmethod
+    def _remote_version(project: Dict) -> Optional[str]:
+        """从项目列表条目中提取服务端版本标识（etag / modifiedTime），没有时返回None"""
+        version = project.get('etag') or project.get('modifiedTime')
+        return str(version) if version else None
+
+    def sync_with_server(self, concurrency: Optional[int] = None,
+                         incremental: Optional[bool] = None) -> Dict:
         """Synchronize local database with server data
         
         现在使用新的 API 接口同步项目及其任务数据
+        
+        增量模式下：
+        - 项目列表带有 etag/modifiedTime 且与本地记录一致时，直接跳过该项目的请求
+        - 项目数据的内容指纹与本地一致时，跳过该项目的所有写入
+        - 只写入内容指纹发生变化的任务
+        全量模式忽略本地指纹，重写所有项目和任务。
+        两种模式都会把服务端已不存在的任务和项目批量标记为已删除（deleted = 1）。
+        
+        Args:
+            concurrency (int, optional): 并发获取项目数据的线程数。
+                不指定时使用配置中的 sync_concurrency（默认1，即串行）
+            incremental (bool, optional): 是否使用增量同步。
+                不指定时根据配置中的 sync_mode 决定（"incremental" 或 "full"，默认 "full"）
+        
+        Returns:
+            Dict: 同步统计信息，格式为：
+            {
+                "projects": 项目总数,
+                "skipped_projects": 未变化而跳过的项目数,
+                "failed_projects": 同步失败的项目数,
+                "tasks_written": 写入的任务数,
+                "tasks_completed": 服务端不再返回、标记为已完成的任务数,
+                "tasks_deleted": 所属项目已删除、标记为删除的任务数
+            }
         """
+        if concurrency is None:
+            concurrency = int(self.config.get('sync_concurrency', 1))
+        if incremental is None:
+            incremental = self.config.get('sync_mode', 'full') == 'incremental'
+        
         # Get all projects first
-        projects = self._make_request('GET', 'project')
+        projects = self._make_request('GET', 'project', lane=BACKGROUND)
         
-        total_tasks = 0
+        stats = {
+            'projects': len(projects),
+            'skipped_projects': 0,
+            'failed_projects': 0,
+            'tasks_written': 0,
+            'tasks_completed': 0,
+            'tasks_deleted': 0
+        }
         
-        # Update local project data and sync tasks for each project
+        # 读取本地保存的项目指纹
+        self.cursor.execute('SELECT id, remote_version, data_hash FROM projects WHERE deleted = 0')
+        local_projects = {row[0]: (row[1], row[2]) for row in self.cursor.fetchall()}
+        
+        # 服务端版本未变化的项目无需请求详情
+        to_fetch = []
         for project in projects:
-            project_id = project['id']
-            
-            # Get detailed project data including tasks
-            try:
-                project_data = self.get_project_with_data(project_id)
-                
-                # Update project info
-                self.cursor.execute('''
-                INSERT OR REPLACE INTO projects (id, name, color, updated_at)
-                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
-                ''', (project['id'], project['name'], project.get('color')))
-                
-                print(f"\n正在同步项目: {project['name']} (ID: {project['id']})")
-                
-                # Update tasks for this project
-                if 'tasks' in project_data:
-                    for task in project_data['tasks']:
-                        self.cursor.execute('''
-                        INSERT OR REPLACE INTO tasks (
-                            id, project_id, title, content, status, updated_at
-                        ) VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-                        ''', (
-                            task['id'],
-                            task['projectId'],
-                            task['title'],
-                            task.get('content'),
-                            task.get('status', 0)
-                        ))
-                        total_tasks += 1
+            remote_version = self._remote_version(project)
+            local = local_projects.get(project['id'])
+            if incremental and remote_version and local and local[0] == remote_version:
+                stats['skipped_projects'] += 1
+                continue
+            to_fetch.append(project)
+        
+        # 先（可能并发地）获取全部项目数据，网络等待期间不持有数据库写锁
+        fetched = list(self._fetch_projects_data(to_fetch, concurrency))
+        
+        # Update local project data and sync tasks for each project
+        # 所有数据库写入都在当前线程的单个事务中完成；WAL模式下读操作不受影响
+        with metrics.timer('sqlite', op='sync_write'), self._transaction() as cursor:
+            for project, project_data, error in fetched:
+                if error is not None:
+                    print(f"同步项目 {project['name']} 时出错: {str(error)}")
+                    stats['failed_projects'] += 1
+                    continue
                 
-            except Exception as e:
-                print(f"同步项目 {project['name']} 时出错: {str(e)}")
+                # 每个项目使用一个保存点，单个项目写入失败时只回滚该项目
+                cursor.execute('SAVEPOINT sync_project')
+                try:
+                    tasks = project_data.get('tasks', [])
+                    task_hashes = [self._fingerprint(task) for task in tasks]
+                    data_hash = self._fingerprint({'project': project, 'tasks': task_hashes})
+                    local = local_projects.get(project['id'])
+                    if incremental and local and local[1] == data_hash:
+                        stats['skipped_projects'] += 1
+                        remote_version = self._remote_version(project)
+                        if remote_version and remote_version != local[0]:
+                            cursor.execute(
+                                'UPDATE projects SET remote_version = ? WHERE id = ?',
+                                (remote_version, project['id'])
+                            )
+                        cursor.execute('RELEASE sync_project')
+                        continue
+                    
+                    print(f"\n正在同步项目: {project['name']} (ID: {project['id']})")
+                    written, completed = self._sync_project_tasks(
+                        project['id'], tasks, task_hashes, incremental
+                    )
+                    
+                    # 任务写入成功后再记录项目指纹，保证失败时下次会重新同步
+                    cursor.execute('''
+                    INSERT OR REPLACE INTO projects (
+                        id, name, color, remote_version, data_hash, deleted, updated_at
+                    ) VALUES (?, ?, ?, ?, ?, 0, CURRENT_TIMESTAMP)
+                    ''', (
+                        project['id'],
+                        project['name'],
+                        project.get('color'),
+                        self._remote_version(project),
+                        data_hash
+                    ))
+                    cursor.execute('RELEASE sync_project')
+                    stats['tasks_written'] += written
+                    stats['tasks_completed'] += completed
+                    
+                except Exception as e:
+                    cursor.execute('ROLLBACK TO sync_project')
+                    cursor.execute('RELEASE sync_project')
+                    print(f"同步项目 {project['name']} 时出错: {str(e)}")
+                    stats['failed_projects'] += 1
+                    continue
+            
+            # 服务端已删除的项目：项目及其任务一并标记为删除
+            removed_projects = set(local_projects) - {project['id'] for project in projects}
+            if removed_projects:
+                removed = [(project_id,) for project_id in removed_projects]
+                cursor.executemany('''
+                UPDATE projects SET deleted = 1, updated_at = CURRENT_TIMESTAMP WHERE id = ?
+                ''', removed)
+                cursor.executemany('''
+                UPDATE tasks SET deleted = 1, updated_at = CURRENT_TIMESTAMP
+                WHERE project_id = ? AND deleted = 0 AND local_pending = 0
+                ''', removed)
+                stats['tasks_deleted'] += max(cursor.rowcount, 0)
+        
+        # 同步拿到的项目列表就是最新的项目目录
+        self._set_project_cache(projects)
+        
+        print(f"\n同步完成！共同步了 {len(projects)} 个项目（跳过 {stats['skipped_projects']} 个未变化项目），"
+              f"写入 {stats['tasks_written']} 个任务，{stats['tasks_completed']} 个任务已完成，"
+              f"删除 {stats['tasks_deleted']} 个任务")
+        return stats
+    
+    def _sync_project_tasks(self, project_id: str, tasks: List[Dict],
+                            task_hashes: List[str], incremental: bool):
+        """将单个项目的任务写入本地数据库
+        
+        Args:
+            project_id (str): 项目ID
+            tasks (List[Dict]): 服务端返回的该项目全部未完成任务
+            task_hashes (List[str]): 与 tasks 一一对应的内容指纹
+            incremental (bool): 为True时只写入内容指纹变化的任务
+        
+        Returns:
+            tuple: (写入的任务数, 标记为已完成的任务数)
+        """
+        self.cursor.execute(
+            'SELECT id, content_hash, deleted, local_pending, status FROM tasks WHERE project_id = ?', (project_id,)
+        )
+        local_tasks = {row[0]: (row[1], row[2], row[3], row[4]) for row in self.cursor.fetchall()}
+        
+        rows = []
+        changed_hashes = []
+        for task, content_hash in zip(tasks, task_hashes):
+            local = local_tasks.get(task['id'])
+            # 尚未写回服务端的本地修改优先，保证读到自己的写入
+            if local and local[2]:
                 continue
+            if incremental and local and local[0] == content_hash and not local[1]:
+                continue
+            rows.append(self._task_row(task))
+            changed_hashes.append(content_hash)
+        
+        if rows:
+            self._upsert_tasks(rows, changed_hashes)
         
-        self.conn.commit()
-        print(f"\n同步完成！共同步了 {len(projects)} 个项目，{total_tasks} 个任务")
+        # 项目数据接口只返回未完成的任务，不返回已完成或已删除的任务，也无法区分二者：
+        # 不再返回的未完成任务标记为已完成，仍可通过 include_completed=True 查到，不当作删除。
+        # 清空指纹，任务重新出现在服务端（如取消完成）时会被重新写入
+        server_ids = {task['id'] for task in tasks}
+        missing = [
+            (task_id,) for task_id, (_, deleted, local_pending, status) in local_tasks.items()
+            if task_id not in server_ids and not deleted and not local_pending and not status
+        ]
+        if missing:
+            self.cursor.executemany('''
+            UPDATE tasks SET status = 2, content_hash = NULL, updated_at = CURRENT_TIMESTAMP WHERE id = ?
+            ''', missing)
+        
+        return len(rows), len(missing)
     
-    def get_local_tasks(self, project_id: Optional[str] = None, include_completed: bool = True) -> List[Dict]:
+    def get_local_tasks(self, project_id: Optional[str] = None, include_completed: bool = True,
+                        date: Optional[str] = None, due_from: Optional[str] = None,
+                        due_to: Optional[str] = None, min_priority: Optional[int] = None,
+                        limit: Optional[int] = None) -> List[Dict]:
         """Get tasks from local database
         
         Args:
             project_id (str, optional): Project ID to filter tasks
             include_completed (bool): Whether to include completed tasks (default: True)
+            date (str, optional): 只返回开始或截止时间在该日期（"yyyy-MM-dd"，本地时区）的任务
+            due_from (str, optional): 截止时间下界（含），"yyyy-MM-dd" 或 "yyyy-MM-dd'T'HH:mm:ssZ"
+            due_to (str, optional): 截止时间上界（不含）；只给日期时包含该日期全天
+            min_priority (int, optional): 最低优先级（0=普通，1=中等，2=高，3=紧急）
+            limit (int, optional): 最多返回的任务数
             
         Returns:
             List[Dict]: List of tasks
         """
-        base_sql = '''
-            SELECT id, project_id, title, content, status
+        columns = [column for column, _ in TASK_COLUMNS]
+        base_sql = f'''
+            SELECT {', '.join(columns)}
             FROM tasks
-            WHERE 1=1
+            WHERE deleted = 0
         '''
         
         params = []
@@ -421,21 +1150,64 @@ class DidaAPI:
             
         if not include_completed:
             base_sql += ' AND (status = 0 OR status IS NULL)'
+        
+        if date:
+            # 分别在 start_date / due_date 索引上做范围查询
+            day_start, day_end = self._to_db_bound(date), self._to_db_bound(date, end=True)
+            base_sql += ''' AND (
+                (start_date >= ? AND start_date < ?) OR (due_date >= ? AND due_date < ?)
+            )'''
+            params.extend([day_start, day_end, day_start, day_end])
+        
+        if due_from:
+            base_sql += ' AND due_date >= ?'
+            params.append(self._to_db_bound(due_from))
+        
+        if due_to:
+            base_sql += ' AND due_date < ?'
+            params.append(self._to_db_bound(due_to, end=True))
+        
+        if min_priority is not None:
+            base_sql += ' AND priority >= ?'
+            params.append(min_priority)
             
         base_sql += ' ORDER BY updated_at DESC'
         
-        self.cursor.execute(base_sql, params)
+        if limit:
+            base_sql += ' LIMIT ?'
+            params.append(limit)
+        
+        with metrics.timer('sqlite', op='get_local_tasks'):
+            self.cursor.execute(base_sql, params)
+            rows = self.cursor.fetchall()
         
-        tasks = []
-        for row in self.cursor.fetchall():
-            tasks.append({
-                'id': row[0],
-                'projectId': row[1],
-                'title': row[2],
-                'content': row[3],
-                'status': row[4]
-            })
-        return tasks
+        return [self._row_to_task(row) for row in rows]
+    
+    def get_local_task(self, task_id: str) -> Optional[Dict]:
+        """Get a single task from local database
+        
+        Args:
+            task_id (str): Task ID
+        
+        Returns:
+            Dict: 任务信息（格式同 get_local_tasks），不存在或已删除时返回None
+        """
+        columns = [column for column, _ in TASK_COLUMNS]
+        self.cursor.execute(
+            f'SELECT {", ".join(columns)} FROM tasks WHERE id = ? AND deleted = 0', (task_id,)
+        )
+        row = self.cursor.fetchone()
+        if row is None:
+            return None
+        return self._row_to_task(row)
+    
+    def _row_to_task(self, row: tuple) -> Dict:
+        """将 TASK_COLUMNS 顺序的数据库行转换为滴答清单格式的任务"""
+        task = {key: value for (_, key), value in zip(TASK_COLUMNS, row)}
+        task['startDate'] = self._from_db_datetime(task['startDate'])
+        task['dueDate'] = self._from_db_datetime(task['dueDate'])
+        task['isAllDay'] = bool(task['isAllDay'])
+        return task
     
     def get_projects(self) -> List[Dict]:
         """Get all projects
@@ -458,6 +1230,44 @@ class DidaAPI:
             return [response]
         return response
     
+    def get_cached_projects(self) -> List[Dict]:
+        """Get all projects from the local project catalogue
+        
+        不请求服务端：优先使用内存缓存，缓存过期（配置中的 project_cache_ttl，默认600秒）
+        或被清除后从本地数据库的 projects 表重新加载。本地尚未同步过项目时才请求服务端。
+        
+        Returns:
+            List[Dict]: List of projects, same format as get_projects()
+        """
+        ttl = self.config.get('project_cache_ttl', 600)
+        cls = type(self)
+        with cls._project_cache_lock:
+            if cls._project_cache is not None and time.time() - cls._project_cache_loaded_at < ttl:
+                return list(cls._project_cache)
+        
+        with metrics.timer('sqlite', op='get_projects'):
+            self.cursor.execute('SELECT id, name, color FROM projects WHERE deleted = 0 ORDER BY name')
+            rows = self.cursor.fetchall()
+        projects = [{'id': row[0], 'name': row[1], 'color': row[2]} for row in rows]
+        
+        if not projects:
+            projects = self.get_projects()
+        
+        self._set_project_cache(projects)
+        return list(projects)
+    
+    def invalidate_project_cache(self):
+        """清除项目目录缓存，下次 get_cached_projects 时从本地数据库重新加载"""
+        cls = type(self)
+        with cls._project_cache_lock:
+            cls._project_cache = None
+    
+    def _set_project_cache(self, projects: List[Dict]):
+        cls = type(self)
+        with cls._project_cache_lock:
+            cls._project_cache = list(projects)
+            cls._project_cache_loaded_at = time.time()
+    
     def get_task(self, project_id: str, task_id: str) -> Dict:
         """Get task details by project ID and task ID
         
@@ -519,18 +1329,8 @@ class DidaAPI:
         
         # 同步新任务到本地数据库
         try:
-            self.cursor.execute('''
-            INSERT OR REPLACE INTO tasks (
-                id, project_id, title, content, status, updated_at
-            ) VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-            ''', (
-                new_task['id'],
-                new_task.get('projectId'),
-                new_task['title'],
-                new_task.get('content'),
-                new_task.get('status', 0)
-            ))
-            self.conn.commit()
+            with metrics.timer('sqlite', op='upsert_task'), self._transaction():
+                self._upsert_tasks([self._task_row(new_task)])
             print(f"任务已创建并同步到本地: {new_task['title']}")
         except Exception as e:
             print(f"任务创建成功，但同步到本地数据库失败: {str(e)}")
@@ -589,21 +1389,12 @@ class DidaAPI:
             
             # 同步更新后的任务到本地数据库
             try:
-                self.cursor.execute('''
-                UPDATE tasks SET
-                    title = ?,
-                    content = ?,
-                    status = ?,
-                    updated_at = CURRENT_TIMESTAMP
-                WHERE id = ? AND project_id = ?
-                ''', (
-                    updated_task.get('title'),
-                    updated_task.get('content'),
-                    updated_task.get('status', 0),
-                    task_id,
-                    project_id
-                ))
-                self.conn.commit()
+                with metrics.timer('sqlite', op='upsert_task'), self._transaction():
+                    self._upsert_tasks([self._task_row({
+                        'id': task_id,
+                        'projectId': project_id,
+                        **updated_task
+                    })])
                 print(f"任务已更新并同步到本地: {updated_task.get('title')}")
             except Exception as e:
                 print(f"任务更新成功，但同步到本地数据库失败: {str(e)}")
@@ -615,18 +1406,19 @@ class DidaAPI:
             raise
 
     def close(self):
-        """Close database connection for current thread"""
+        """Release database connection of current thread back to the pool"""
         if hasattr(self._local, 'cursor'):
             self._local.cursor.close()
             delattr(self._local, 'cursor')
         if hasattr(self._local, 'conn'):
-            self._local.conn.close()
+            self._pool.release(self._local.conn)
             delattr(self._local, 'conn')
     
     def __del__(self):
         """Cleanup when object is deleted"""
         try:
             self.close()
+            self._pool.close()
         except:
             pass
 
@@ -636,7 +1428,12 @@ if __name__ == "__main__":
     api = DidaAPI()
     
     # Sync data
-    api.sync_with_server()
+    try:
+        api.sync_with_server()
+    except DidaAuthRequired:
+        # 令牌已失效且无法刷新：在终端中重新授权
+        api._authorize()
+        api.sync_with_server()
     
     # Get all projects
     tasks = api.get_local_tasks()
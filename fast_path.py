@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+"""常见查询指令的快速路径
+
+"今天有什么任务"、"明天有什么安排"、"看看工作项目"这类查询只需要一次本地SQLite查询，
+不需要调用LLM。这里用关键词和正则规则识别查询意图、中文日期表达和项目名称，
+只有规则能够确定意图时才走快速路径，其余指令仍然交给LLM分析。
+"""
+import re
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import pytz
+
+from dida365_api import DIDA_DATETIME_FORMATS
+
+# 表示查询的词
+QUERY_PATTERN = re.compile(
+    r'有什么|有哪些|有啥|有没有|有多少|哪些|什么安排|做什么|干什么|看看|看一下|查看|查一下|查查|查询|'
+    r'列出|列一下|显示|说说|念一下|读一下'
+)
+# 表示修改数据的词，出现时不走快速路径
+WRITE_PATTERN = re.compile(
+    r'创建|新建|添加|加个|加一个|增加|建一个|记一下|记下|提醒|改|更新|推迟|延后|延期|提前|挪到|移到|'
+    r'完成|做完|删|取消|设为|设成|设置|标记|帮我安排|安排一下|安排个|安排一个|写入'
+)
+# 快速路径无法准确回答的时间范围和时段，出现时交给LLM
+UNSUPPORTED_TIME_PATTERN = re.compile(
+    r'这周|本周|下周|上周|这个星期|下个星期|这个月|本月|下个月|上个月|最近|周末|接下来|以后|之后|之前|'
+    r'上午|下午|晚上|早上|中午|凌晨|几点|点钟|过期|逾期|完成了|已完成'
+)
+# 去掉日期、项目和查询词后允许剩下的虚词
+FILLER_PATTERN = re.compile(
+    r'任务|事情|事儿|事|安排|日程|计划|待办|清单|列表|项目|里面|里|中|上|下|所有|全部|还|都|'
+    r'我的|我|你|帮|请|给|一下|要做|要|需要|做|的|了|吗|呢|吧|啊|呀|哦|么|在|是|个|那|这'
+)
+# 剩余的非虚词字数超过该值时认为规则没有把握（如"明天有没有会议"中的"会议"）
+MAX_UNMATCHED_CHARS = 0
+
+RELATIVE_DAYS = {'大后天': 3, '后天': 2, '明天': 1, '明日': 1, '今天': 0, '今日': 0, '今儿': 0, '昨天': -1}
+RELATIVE_DAY_PATTERN = re.compile('|'.join(sorted(RELATIVE_DAYS, key=len, reverse=True)))
+
+WEEKDAYS = '一二三四五六日'
+WEEKDAY_PATTERN = re.compile(r'(下下|下个?|这个?|本)?(?:周|星期|礼拜)([一二三四五六日天])')
+
+_CN_NUMBER = r'[0-9零一二两三四五六七八九十]{1,3}'
+MONTH_DAY_PATTERN = re.compile(rf'(?:({_CN_NUMBER})月)?({_CN_NUMBER})[日号]')
+
+# 回复中最多念出的任务数
+MAX_SPOKEN_TASKS = 8
+
+
+def _cn_to_int(text: str) -> Optional[int]:
+    """把 "二十三"、"12"、"十" 这类数字转换为整数"""
+    if text.isdigit():
+        return int(text)
+    digits = {'零': 0, '一': 1, '二': 2, '两': 2, '三': 3, '四': 4, '五': 5, '六': 6, '七': 7, '八': 8, '九': 9}
+    if '十' in text:
+        tens, _, ones = text.partition('十')
+        value = (digits.get(tens, -100) if tens else 1) * 10 + (digits.get(ones, -100) if ones else 0)
+    else:
+        value = digits.get(text, -100) if len(text) == 1 else -100
+    return value if value >= 0 else None
+
+
+def _find_dates(command: str, today: datetime) -> List[Tuple[Tuple[int, int], datetime]]:
+    """找出指令中的日期表达
+
+    Returns:
+        List[Tuple[Tuple[int, int], datetime]]: 每个日期表达的 ((起始位置, 结束位置), 日期)
+    """
+    found = []
+    for match in RELATIVE_DAY_PATTERN.finditer(command):
+        found.append((match.span(), today + timedelta(days=RELATIVE_DAYS[match.group()])))
+
+    for match in WEEKDAY_PATTERN.finditer(command):
+        prefix, day = match.group(1) or '', match.group(2)
+        weekday = 6 if day in '日天' else WEEKDAYS.index(day)
+        monday = today - timedelta(days=today.weekday())
+        if prefix.startswith('下下'):
+            date = monday + timedelta(weeks=2, days=weekday)
+        elif prefix.startswith('下'):
+            date = monday + timedelta(weeks=1, days=weekday)
+        elif prefix:
+            date = monday + timedelta(days=weekday)
+        else:
+            # 只说"周五"时指今天或之后最近的一个周五
+            date = today + timedelta(days=(weekday - today.weekday()) % 7)
+        found.append((match.span(), date))
+
+    for match in MONTH_DAY_PATTERN.finditer(command):
+        month = _cn_to_int(match.group(1)) if match.group(1) else today.month
+        day = _cn_to_int(match.group(2))
+        if month is None or day is None:
+            continue
+        try:
+            date = today.replace(month=month, day=day)
+        except ValueError:
+            continue
+        found.append((match.span(), date))
+    return found
+
+
+def _find_project(command: str, projects: List[Dict]) -> Tuple[Optional[Dict], List[Tuple[int, int]]]:
+    """找出指令中提到的项目，提到多个不同项目时返回 (None, [])"""
+    lowered = command.lower()
+    matches = []
+    for project in projects:
+        name = (project.get('name') or '').strip().lower()
+        if name and name in lowered:
+            start = lowered.index(name)
+            matches.append(((start, start + len(name)), project))
+    if not matches:
+        return None, []
+    # 项目名互相包含时（如"工作"和"工作日志"）取最长的一个
+    matches.sort(key=lambda item: item[0][1] - item[0][0], reverse=True)
+    (start, end), project = matches[0]
+    for (other_start, other_end), other in matches[1:]:
+        if other.get('id') != project.get('id') and (other_start >= end or other_end <= start):
+            return None, []
+    return project, [(start, end)]
+
+
+def _date_label(date: datetime, today: datetime) -> str:
+    offset = (date.date() - today.date()).days
+    named = {0: '今天', 1: '明天', 2: '后天', -1: '昨天'}
+    if offset in named:
+        return named[offset]
+    return f"{date.month}月{date.day}日（星期{WEEKDAYS[date.weekday()]}）"
+
+
+def match_intent(command: str, projects: List[Dict], timezone: str = 'Asia/Shanghai',
+                 now: Optional[datetime] = None) -> Optional[Dict]:
+    """用规则识别简单的任务查询指令
+
+    Args:
+        command (str): 用户指令
+        projects (List[Dict]): 本地缓存的项目列表
+        timezone (str): 解析"今天"、"周五"等使用的时区
+        now (datetime, optional): 当前时间，默认取系统时间
+
+    Returns:
+        Optional[Dict]: 能确定意图时返回：
+        {
+            "rule": "date" | "project" | "date_project",   # 命中的规则
+            "date": "yyyy-MM-dd" 或 None,
+            "project": 项目 或 None,
+            "label": 回复中使用的描述，如 "明天"、"工作项目里"
+        }
+        否则返回None，由LLM处理
+    """
+    command = (command or '').strip()
+    if not command or not QUERY_PATTERN.search(command) or WRITE_PATTERN.search(command):
+        return None
+
+    now = now or datetime.now(pytz.timezone(timezone))
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    dates = _find_dates(command, today)
+    if len({date.date() for _, date in dates}) > 1:
+        # "今天和明天"这类多个日期交给LLM
+        return None
+    project, project_spans = _find_project(command, projects)
+    if not dates and project is None:
+        return None
+
+    # 去掉日期和项目名后，剩下的内容只能是查询词和虚词
+    spans = [span for span, _ in dates] + project_spans
+    rest = ''.join(ch for index, ch in enumerate(command)
+                   if not any(start <= index < end for start, end in spans))
+    if UNSUPPORTED_TIME_PATTERN.search(rest):
+        return None
+    rest = FILLER_PATTERN.sub('', QUERY_PATTERN.sub('', rest))
+    rest = re.sub(r'[\s\W_]', '', rest)
+    if len(rest) > MAX_UNMATCHED_CHARS:
+        return None
+
+    return _make_intent(dates[0][1] if dates else None, project, today)
+
+
+def _make_intent(date: Optional[datetime], project: Optional[Dict], today: datetime) -> Dict:
+    labels = []
+    if date is not None:
+        labels.append(_date_label(date, today))
+    if project is not None:
+        labels.append(f"{project.get('name')}项目里")
+    return {
+        'rule': 'date_project' if date and project else ('date' if date else 'project'),
+        'date': date.strftime('%Y-%m-%d') if date else None,
+        'project': project,
+        'label': '在'.join(labels) if len(labels) > 1 else labels[0]
+    }
+
+
+def degraded_intent(command: str, projects: List[Dict], timezone: str = 'Asia/Shanghai',
+                    now: Optional[datetime] = None) -> Optional[Dict]:
+    """LLM不可用时，尽量从指令中找出要查询的日期和项目
+
+    指令中要有查询词且没有修改任务的词，但不要求只包含查询词：能确定唯一的日期或项目就按它查询。
+    像"明天下午三点开会"这样没有查询词的指令可能是要创建任务；"这周有什么任务"、"今天和明天"
+    以及没有日期和项目的"有什么任务"，在本地都无法准确回答。这些情况都返回None。
+
+    Args:
+        command (str): 用户指令
+        projects (List[Dict]): 本地缓存的项目列表
+        timezone (str): 解析日期使用的时区
+        now (datetime, optional): 当前时间，默认取系统时间
+
+    Returns:
+        Optional[Dict]: 格式同 match_intent；无法在本地准确回答时返回None
+    """
+    command = (command or '').strip()
+    if not QUERY_PATTERN.search(command) or WRITE_PATTERN.search(command):
+        return None
+    now = now or datetime.now(pytz.timezone(timezone))
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    dates = _find_dates(command, today)
+    if len({date.date() for _, date in dates}) > 1:
+        return None
+    project, project_spans = _find_project(command, projects)
+    if not dates and project is None:
+        return None
+
+    spans = [span for span, _ in dates] + project_spans
+    rest = ''.join(ch for index, ch in enumerate(command)
+                   if not any(start <= index < end for start, end in spans))
+    if UNSUPPORTED_TIME_PATTERN.search(rest):
+        return None
+    return _make_intent(dates[0][1] if dates else None, project, today)
+
+
+def _local_time(value: Optional[str], tz) -> Optional[datetime]:
+    for fmt in DIDA_DATETIME_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).astimezone(tz)
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+def format_reply(intent: Dict, tasks: List[Dict], timezone: str = 'Asia/Shanghai') -> str:
+    """把查询结果组织成口语化的回复
+
+    Args:
+        intent (Dict): match_intent 的返回值
+        tasks (List[Dict]): 查询到的未完成任务
+        timezone (str): 显示时间使用的时区
+
+    Returns:
+        str: 播放给用户的回复
+    """
+    label = intent['label']
+    if not tasks:
+        return f"{label}没有待办的任务。"
+
+    tz = pytz.timezone(timezone)
+    items = []
+    for task in tasks:
+        moment = None
+        if intent['date'] and not task.get('isAllDay'):
+            for key in ('startDate', 'dueDate'):
+                local = _local_time(task.get(key), tz)
+                if local is not None and local.strftime('%Y-%m-%d') == intent['date']:
+                    moment = local
+                    break
+        items.append((moment is None, moment.strftime('%H:%M') if moment else '', task.get('title') or '未命名任务'))
+    # 有具体时间的任务按时间排在前面
+    items.sort(key=lambda item: (item[0], item[1]))
+
+    spoken = [f"{clock} {title}" if clock else title for _, clock, title in items[:MAX_SPOKEN_TASKS]]
+    reply = f"{label}有{len(tasks)}个任务：{'、'.join(spoken)}"
+    if len(tasks) > MAX_SPOKEN_TASKS:
+        reply += f"，还有{len(tasks) - MAX_SPOKEN_TASKS}个就不一一念了"
+    return reply + "。"
+
+
+def format_degraded_reply(intent: Optional[Dict], tasks: List[Dict], timezone: str = 'Asia/Shanghai') -> str:
+    """LLM不可用时的回复
+
+    Args:
+        intent (Dict, optional): degraded_intent 的返回值
+        tasks (List[Dict]): 按 intent 查询到的未完成任务
+        timezone (str): 显示时间使用的时区
+
+    Returns:
+        str: 播放给用户的回复
+    """
+    if intent is None:
+        return "AI服务暂时不可用，暂时无法处理这条指令，请稍后再试。"
+    return "AI服务暂时不可用，先从本地任务中查到：" + format_reply(intent, tasks, timezone)
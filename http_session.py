@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# 未在配置中指定时使用的默认值
+DEFAULT_POOL_CONNECTIONS = 4
+DEFAULT_POOL_MAXSIZE = 16
+DEFAULT_TIMEOUT = {'connect': 5, 'read': 30}
+
+
+class SessionManager:
+    """进程内共享的HTTP会话管理器
+
+    每个上游服务（如 dida365、silicon_flow）使用一个带连接池的 requests.Session，
+    在所有线程间复用 keep-alive 连接，避免每次请求都重新进行TCP和TLS握手。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions: Dict[str, requests.Session] = {}
+        self._config: Dict = {}
+
+    def configure(self, http_config: Optional[Dict]):
+        """设置连接池和超时配置
+
+        只影响之后新建的会话，已创建的会话保持原有连接池大小。
+
+        Args:
+            http_config (Dict, optional): 配置文件中的 http 配置段，格式为：
+            {
+                "pool_connections": 4,     # 每个会话缓存的连接池（主机）数量
+                "pool_maxsize": 16,        # 每个主机最多保持的连接数
+                "preconnect": true,        # 启动时是否预先建立连接
+                "timeouts": {
+                    "llm": {"connect": 5, "read": 120},
+                    ...
+                }
+            }
+        """
+        if http_config:
+            with self._lock:
+                self._config = http_config
+
+    def get(self, name: str) -> requests.Session:
+        """获取指定上游服务的共享会话，不存在时创建
+
+        Args:
+            name (str): 上游服务名称
+
+        Returns:
+            requests.Session: 共享会话
+        """
+        session = self._sessions.get(name)
+        if session is not None:
+            return session
+
+        with self._lock:
+            session = self._sessions.get(name)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=self._config.get('pool_connections', DEFAULT_POOL_CONNECTIONS),
+                    pool_maxsize=self._config.get('pool_maxsize', DEFAULT_POOL_MAXSIZE)
+                )
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self._sessions[name] = session
+            return session
+
+    def timeout(self, operation: str) -> Tuple[float, float]:
+        """获取指定操作的 (连接超时, 读取超时)
+
+        Args:
+            operation (str): 操作名称，对应配置中 timeouts 下的键
+
+        Returns:
+            Tuple[float, float]: 可直接传给 requests 的 timeout 参数
+        """
+        timeouts = {**DEFAULT_TIMEOUT, **self._config.get('timeouts', {}).get(operation, {})}
+        return timeouts['connect'], timeouts['read']
+
+    def preconnect(self, name: str, url: str, connections: int = 1):
+        """预先建立到上游服务的连接，使首个请求无需等待握手
+
+        连接失败只打印提示，不抛出异常。
+
+        Args:
+            name (str): 上游服务名称
+            url (str): 上游服务地址
+            connections (int): 预先建立的连接数
+        """
+        session = self.get(name)
+        connect_timeout = self.timeout(name)[0]
+
+        def open_connection(_):
+            try:
+                session.head(url, timeout=(connect_timeout, connect_timeout))
+            except requests.RequestException as e:
+                print(f"预连接 {name} 失败: {str(e)}")
+
+        with ThreadPoolExecutor(max_workers=max(1, connections)) as executor:
+            list(executor.map(open_connection, range(max(1, connections))))
+
+    def close(self):
+        """关闭所有会话及其连接"""
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+
+# 进程内共享的会话管理器
+sessions = SessionManager()
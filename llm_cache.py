@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""LLM指令分析结果缓存
+
+"今天有什么任务"、"看看工作项目"这类只读指令会被反复说出，每次都带着很长的提示词
+调用一次LLM。缓存的键由规范化后的指令、当天日期、模型、上一轮回复和提示词中的任务/项目上下文组成，
+任务数据变化后上下文随之变化，旧结果自然不会再被命中；同步或写入改变数据时也会整体清空。
+只缓存不修改数据的回复（普通回复和 get_task），命中后仍然照常执行查询操作。
+"""
+import hashlib
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import pytz
+
+from metrics import metrics
+
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_TTL = 300
+
+# 可以缓存的操作类型：只读取数据，重复执行不会产生副作用
+READ_ONLY_ACTIONS = frozenset({'get_task'})
+
+
+def normalize_command(command: str) -> str:
+    """规范化指令：统一全角/半角和大小写，去掉空白和标点
+
+    例如 "今天有什么任务？" 和 "今天 有什么任务" 得到相同的结果
+    """
+    text = unicodedata.normalize('NFKC', command or '').lower()
+    return ''.join(ch for ch in text if not unicodedata.category(ch).startswith(('P', 'Z', 'C')))
+
+
+def is_read_only(actions: List[Dict]) -> bool:
+    """LLM回复中的操作是否都是只读操作（没有操作时也视为只读）"""
+    return all(action.get('action') in READ_ONLY_ACTIONS for action in actions)
+
+
+def previous_reply(messages: List[Dict]) -> Optional[str]:
+    """取出 messages 中最后一条助手回复，没有会话历史时返回None"""
+    for message in reversed(messages):
+        if message.get('role') == 'assistant':
+            return message.get('content')
+    return None
+
+
+class LLMResultCache:
+    """带TTL的LRU缓存，保存LLM回复的原始文本"""
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, ttl: float = DEFAULT_TTL,
+                 timezone: str = 'Asia/Shanghai'):
+        """初始化缓存
+
+        Args:
+            max_entries (int): 最多缓存的结果数，超出时淘汰最久未使用的结果
+            ttl (float): 结果的有效期（秒）
+            timezone (str): 计算"当天"使用的时区
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.timezone = pytz.timezone(timezone)
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def make_key(self, command: str, context: Dict, model: str,
+                 previous: Optional[str] = None) -> str:
+        """计算缓存键
+
+        只包含上一轮的助手回复而不是整段会话历史：同一条指令紧跟在不同的回复之后含义可能不同
+        （如"好的"），但会话中反复出现的查询不应因为历史变长而永远无法命中。
+
+        Args:
+            command (str): 用户指令
+            context (Dict): context_builder.build_task_context 的返回值
+            model (str): 指令路由到的主模型名称，见 ModelRouter.primary_model
+            previous (str, optional): 上一轮的助手回复，见 previous_reply()
+
+        Returns:
+            str: 缓存键
+        """
+        today = datetime.now(self.timezone).strftime('%Y-%m-%d')
+        digest = hashlib.sha1()
+        for part in (normalize_command(command), today, model, previous or '', context['tasks'], context['projects']):
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """查找缓存的LLM回复，未命中或已过期时返回None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[0] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self._misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self._hits += 1
+        metrics.inc('llm_cache', result='hit' if entry else 'miss')
+        return entry[1] if entry else None
+
+    def put(self, key: str, content: str):
+        """保存LLM回复；调用方需保证回复中只有只读操作，见 is_read_only()"""
+        with self._lock:
+            self._entries[key] = (time.time(), content)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                metrics.inc('llm_cache', result='evicted')
+
+    def invalidate(self, reason: str = ''):
+        """清空缓存，在同步或写入改变了任务数据时调用"""
+        with self._lock:
+            if not self._entries:
+                return
+            self._entries.clear()
+        metrics.inc('llm_cache_invalidations', reason=reason)
+
+    def invalidate_on_writes(self, actions: List[Dict], results: List[Tuple[bool, str]]):
+        """有写入操作执行成功时清空缓存
+
+        Args:
+            actions (List[Dict]): 执行的操作
+            results (List[Tuple[bool, str]]): 与 actions 对应的 (是否成功, 结果信息)
+        """
+        if any(success for action, (success, _) in zip(actions, results)
+               if action.get('action') not in READ_ONLY_ACTIONS):
+            self.invalidate('write')
+
+    def stats(self) -> Dict:
+        """获取缓存状态和命中率"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_ratio': self._hits / lookups if lookups else 0.0
+            }
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+# 计算分位数时使用的滚动窗口（秒）以及每个序列最多保留的样本数
+DEFAULT_WINDOW = 300
+DEFAULT_MAX_SAMPLES = 2048
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+METRIC_PREFIX = 'aristotle'
+
+
+class _Series:
+    """单个 (stage, op) 序列：累计的次数、错误数、耗时总和，以及滚动窗口内的耗时样本"""
+
+    __slots__ = ('count', 'errors', 'total', 'samples')
+
+    def __init__(self, max_samples: int):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.samples = deque(maxlen=max_samples)
+
+
+class Metrics:
+    """进程内的延迟和计数指标
+
+    - observe/timer 记录各阶段耗时，按滚动窗口计算 p50/p95/p99
+    - inc 记录普通计数器（如重试次数、缓存命中数）
+    - render_prometheus 输出 Prometheus 文本格式
+    """
+
+    def __init__(self, window: float = DEFAULT_WINDOW, max_samples: int = DEFAULT_MAX_SAMPLES):
+        self.window = window
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+        self._series: Dict[Tuple[str, str], _Series] = {}
+        self._counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+
+    def observe(self, stage: str, seconds: float, error: bool = False, op: str = ''):
+        """记录一次耗时
+
+        Args:
+            stage (str): 阶段名称，如 asr、llm、tts、dida、sqlite
+            seconds (float): 耗时（秒）
+            error (bool): 本次调用是否失败
+            op (str): 阶段内的具体操作，如 Dida 接口或 SQL 查询名称
+        """
+        now = time.time()
+        with self._lock:
+            series = self._series.get((stage, op))
+            if series is None:
+                series = self._series[(stage, op)] = _Series(self.max_samples)
+            series.count += 1
+            series.total += seconds
+            if error:
+                series.errors += 1
+            series.samples.append((now, seconds))
+
+    @contextmanager
+    def timer(self, stage: str, op: str = ''):
+        """统计代码块耗时的上下文管理器，代码块抛出异常时记为错误
+
+        可以在代码块中调用 yield 出的对象的 fail() 方法，把未抛异常的失败也记为错误。
+        """
+        outcome = _Outcome()
+        start = time.perf_counter()
+        try:
+            yield outcome
+        except BaseException:
+            outcome.failed = True
+            raise
+        finally:
+            self.observe(stage, time.perf_counter() - start, outcome.failed, op)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """增加计数器
+
+        Args:
+            name (str): 计数器名称（输出时自动加前缀和 _total 后缀）
+            value (float): 增量
+            **labels: 标签
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def snapshot(self) -> Dict:
+        """获取当前指标快照
+
+        Returns:
+            Dict: {"latency": {"stage[:op]": {...}}, "counters": {...}}
+        """
+        cutoff = time.time() - self.window
+        latency = {}
+        with self._lock:
+            for (stage, op), series in self._series.items():
+                recent = sorted(seconds for ts, seconds in series.samples if ts >= cutoff)
+                latency[f'{stage}:{op}' if op else stage] = {
+                    'stage': stage,
+                    'op': op,
+                    'count': series.count,
+                    'errors': series.errors,
+                    'error_rate': series.errors / series.count if series.count else 0.0,
+                    'sum': series.total,
+                    'quantiles': {q: _quantile(recent, q) for q in QUANTILES}
+                }
+            counters = dict(self._counters)
+        return {'latency': latency, 'counters': counters}
+
+    def render_prometheus(self) -> str:
+        """以 Prometheus 文本格式输出所有指标"""
+        snapshot = self.snapshot()
+        name = f'{METRIC_PREFIX}_stage_latency_seconds'
+        errors_name = f'{METRIC_PREFIX}_stage_errors_total'
+        lines = [
+            f'# HELP {name} Stage latency over the last {int(self.window)}s window.',
+            f'# TYPE {name} summary'
+        ]
+        error_lines = [
+            f'# HELP {errors_name} Failed calls per stage.',
+            f'# TYPE {errors_name} counter'
+        ]
+        for series in sorted(snapshot['latency'].values(), key=lambda s: (s['stage'], s['op'])):
+            labels = {'stage': series['stage']}
+            if series['op']:
+                labels['op'] = series['op']
+            for q, value in series['quantiles'].items():
+                if value is not None:
+                    lines.append(f'{name}{_labels({**labels, "quantile": str(q)})} {value:.6f}')
+            lines.append(f'{name}_sum{_labels(labels)} {series["sum"]:.6f}')
+            lines.append(f'{name}_count{_labels(labels)} {series["count"]}')
+            error_lines.append(f'{errors_name}{_labels(labels)} {series["errors"]}')
+
+        counter_lines = []
+        declared = set()
+        for (counter, labels), value in sorted(snapshot['counters'].items()):
+            metric = f'{METRIC_PREFIX}_{counter}_total'
+            if metric not in declared:
+                counter_lines.append(f'# TYPE {metric} counter')
+                declared.add(metric)
+            counter_lines.append(f'{metric}{_labels(dict(labels))} {value:g}')
+
+        return '\n'.join(lines + error_lines + counter_lines) + '\n'
+
+    def reset(self):
+        """清空所有指标"""
+        with self._lock:
+            self._series.clear()
+            self._counters.clear()
+
+
+class _Outcome:
+    """timer() 中用于标记失败的对象"""
+
+    __slots__ = ('failed',)
+
+    def __init__(self):
+        self.failed = False
+
+    def fail(self):
+        self.failed = True
+
+
+def _quantile(ordered: list, q: float) -> Optional[float]:
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    escaped = []
+    for key, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append(f'{key}="{value}"')
+    return '{' + ','.join(escaped) + '}'
+
+
+# 进程内共享的指标实例
+metrics = Metrics()
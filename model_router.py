@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""按指令复杂度选择LLM模型，并为慢请求发出对冲请求
+
+默认的推理模型（如 DeepSeek-R1-Distill-Qwen-14B）回复质量高，但先输出思考过程，延迟高且波动大。
+"今天有什么任务"、"好的"这类简短的指令交给更快的模型，需要规划、批量修改的指令仍交给推理模型。
+
+主模型超过其观测到的 p95 首字延迟仍没有输出时，再向备用模型发出同样的请求，
+先开始输出的一方胜出，另一方被取消。因此最多约 5% 的请求会多调用一次模型。
+"""
+import threading
+from collections import deque
+from typing import Dict, Optional, Tuple
+
+from metrics import metrics
+
+DEFAULT_ROUTING_CONFIG = {
+    'enabled': True,
+    'fast_model': 'Qwen/Qwen2.5-7B-Instruct',       # 简单指令使用的模型
+    'complex_model': None,                          # 复杂指令使用的模型，默认为 models.llm
+    'fallback_model': 'Qwen/Qwen2.5-14B-Instruct',  # 对冲请求使用的模型
+    'simple_max_chars': 15,                         # 不超过该字数且不含复杂关键词的指令视为简单指令
+    'complex_keywords': [],                         # 出现时视为复杂指令的词
+    'hedge_enabled': True,
+    'hedge_quantile': 0.95,                         # 主模型首字延迟超过该分位数时发出对冲请求
+    'hedge_min_samples': 10,                        # 样本不足时使用 hedge_default_delay
+    'hedge_default_delay': 5.0,
+    'hedge_min_delay': 1.0,
+    'hedge_max_delay': 10.0
+}
+
+# 每个模型保留的延迟样本数
+LATENCY_SAMPLES = 200
+
+
+class ModelRouter:
+    """模型路由规则和各模型的首字延迟统计，同步和 asyncio 客户端共用"""
+
+    def __init__(self, config: Optional[Dict] = None):
+        """初始化路由器
+
+        Args:
+            config (Dict, optional): 配置文件中的 silicon_flow.routing 配置段，
+                未提供的项使用 DEFAULT_ROUTING_CONFIG
+        """
+        self.config = {**DEFAULT_ROUTING_CONFIG, **(config or {})}
+        self._latencies: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.config['enabled'])
+
+    def is_simple(self, command: str) -> bool:
+        """判断指令是否足够简单，可以交给快速模型"""
+        command = (command or '').strip()
+        if len(command) > self.config['simple_max_chars']:
+            return False
+        return not any(keyword in command for keyword in self.config['complex_keywords'])
+
+    def primary_model(self, command: str, default_model: str) -> str:
+        """指令会路由到的主模型，同 route() 但不记录指标，用于计算缓存键等"""
+        if not self.enabled:
+            return default_model
+        if self.is_simple(command):
+            return self.config['fast_model'] or default_model
+        return self.config['complex_model'] or default_model
+
+    def route(self, command: str, default_model: str) -> Tuple[str, Optional[str]]:
+        """为指令选择模型
+
+        Args:
+            command (str): 用户指令
+            default_model (str): 配置中的默认模型（models.llm）
+
+        Returns:
+            Tuple[str, Optional[str]]: (主模型, 对冲请求使用的备用模型)；不需要对冲时备用模型为None
+        """
+        if not self.enabled:
+            return default_model, None
+        primary = self.primary_model(command, default_model)
+        metrics.inc('llm_route', route='simple' if self.is_simple(command) else 'complex', model=primary)
+
+        fallback = self.config['fallback_model']
+        if not self.config['hedge_enabled'] or not fallback or fallback == primary:
+            fallback = None
+        return primary, fallback
+
+    def hedge_delay(self, model: str) -> float:
+        """计算发出对冲请求前等待的秒数：该模型最近首字延迟的 p95，限制在配置的上下限之间"""
+        with self._lock:
+            samples = sorted(self._latencies.get(model, ()))
+        if len(samples) < self.config['hedge_min_samples']:
+            delay = self.config['hedge_default_delay']
+        else:
+            index = min(len(samples) - 1, int(round(self.config['hedge_quantile'] * (len(samples) - 1))))
+            delay = samples[index]
+        return min(max(delay, self.config['hedge_min_delay']), self.config['hedge_max_delay'])
+
+    def record(self, model: str, seconds: float):
+        """记录一次首字延迟（流式）或完整响应时间（非流式）"""
+        with self._lock:
+            samples = self._latencies.get(model)
+            if samples is None:
+                samples = self._latencies[model] = deque(maxlen=LATENCY_SAMPLES)
+            samples.append(seconds)
+        metrics.observe('llm_first_token', seconds, op=model)
+
+    def record_hedge(self, winner: str, primary: str, elapsed: float):
+        """记录对冲请求的结果
+
+        备用模型胜出时主模型被取消，以已等待的时间作为主模型延迟的一个（偏小的）样本，
+        否则 p95 只统计较快完成的请求，会越来越小，对冲请求越来越多
+
+        Args:
+            winner (str): 胜出的模型
+            primary (str): 主模型
+            elapsed (float): 从发出主模型请求到决出胜负的秒数
+        """
+        if winner != primary:
+            self.record(primary, elapsed)
+        metrics.inc('llm_hedge', result='fallback_won' if winner != primary else 'primary_won')
+
@@ -0,0 +1,405 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional
+
+from circuit_breaker import CircuitOpenError
+from dida365_api import DidaAPI, DidaAPIError, DidaAuthRequired
+from metrics import metrics
+from rate_limiter import BACKGROUND
+
+logger = logging.getLogger('aristotle')
+
+# 本地创建、尚未写回服务端的任务使用的临时ID前缀
+LOCAL_ID_PREFIX = 'local-'
+
+
+class TaskOutbox:
+    """任务写入的 write-behind outbox
+
+    create_task / update_task 先写本地数据库并记录到 outbox 表后立即返回，
+    后台线程按写入顺序把修改发送到滴答清单：
+    - 合并窗口内对同一任务的多次修改合并为一次API调用
+    - 更新请求携带完整字段，可安全重试；创建请求在结果不确定（超时、5xx）后重试前，
+      先在服务端查找是否已经创建成功，避免重复创建
+    - 写回完成前，本地任务带有 local_pending 标记，同步不会覆盖或删除它
+    """
+
+    def __init__(self, dida_api: DidaAPI, merge_window: float = 2.0, poll_interval: float = 5.0,
+                 max_attempts: int = 8, backoff_base: float = 1.0, backoff_max: float = 300.0):
+        """初始化 outbox
+
+        Args:
+            dida_api (DidaAPI): 共享的滴答清单客户端
+            merge_window (float): 合并窗口（秒），修改在窗口结束后才发送
+            poll_interval (float): 没有新写入时检查 outbox 的间隔（秒）
+            max_attempts (int): 单条修改的最大发送次数，超过后标记为失败
+            backoff_base (float): 发送失败后重试的基础延迟（秒）
+            backoff_max (float): 重试的最大延迟（秒）
+        """
+        self.dida_api = dida_api
+        self.merge_window = merge_window
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # ---- 写入（请求线程） ----
+
+    def create_task(self, title: str, project_id: Optional[str] = None, **kwargs) -> Dict:
+        """在本地创建任务并排队写回服务端（参数同 DidaAPI.create_task）
+
+        Returns:
+            Dict: 本地任务信息，id 为临时ID，写回后会替换为服务端ID
+        """
+        local_id = f'{LOCAL_ID_PREFIX}{uuid.uuid4().hex}'
+        payload = {'title': title, **kwargs}
+        if project_id:
+            payload['projectId'] = project_id
+        task = {'id': local_id, 'projectId': project_id, 'status': 0, **payload}
+
+        api = self.dida_api
+        with api._transaction() as cursor:
+            api._upsert_tasks([api._task_row(task)], local_pending=True)
+            cursor.execute('''
+            INSERT INTO outbox (op, task_id, local_id, project_id, payload, available_at)
+            VALUES ('create', ?, ?, ?, ?, ?)
+            ''', (local_id, local_id, project_id, json.dumps(payload, ensure_ascii=False),
+                  time.time() + self.merge_window))
+
+        metrics.inc('outbox_enqueued', op='create')
+        self._wakeup.set()
+        return task
+
+    def update_task(self, task_id: str, project_id: str, **kwargs) -> Dict:
+        """在本地更新任务并排队写回服务端（参数同 DidaAPI.update_task）
+
+        合并窗口内对同一任务的未发送修改会合并到同一条 outbox 记录中。
+
+        Returns:
+            Dict: 更新后的本地任务信息
+        """
+        api = self.dida_api
+        now = time.time()
+        with api._transaction() as cursor:
+            task_id = self._resolve_task_id(task_id)
+            current = api.get_local_task(task_id) or {'id': task_id, 'projectId': project_id}
+            task = {**current, **kwargs, 'id': task_id, 'projectId': project_id}
+            api._upsert_tasks([api._task_row(task)], local_pending=True)
+
+            cursor.execute('''
+            SELECT id, op, payload FROM outbox
+            WHERE task_id = ? AND status = 'pending'
+            ORDER BY id DESC LIMIT 1
+            ''', (task_id,))
+            pending = cursor.fetchone()
+            if pending:
+                # 还未发送：合并到已有记录，并重新开始合并窗口
+                merged = {**json.loads(pending[2]), **kwargs, 'projectId': project_id}
+                cursor.execute('''
+                UPDATE outbox SET payload = ?, project_id = ?,
+                    available_at = MAX(available_at, ?), updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+                ''', (json.dumps(merged, ensure_ascii=False), project_id, now + self.merge_window, pending[0]))
+                metrics.inc('outbox_merged', op=pending[1])
+            else:
+                cursor.execute('''
+                INSERT INTO outbox (op, task_id, project_id, payload, available_at)
+                VALUES ('update', ?, ?, ?, ?)
+                ''', (task_id, project_id, json.dumps(kwargs, ensure_ascii=False), now + self.merge_window))
+                metrics.inc('outbox_enqueued', op='update')
+
+        self._wakeup.set()
+        return task
+
+    def _resolve_task_id(self, task_id: str) -> str:
+        """把已写回服务端的临时ID转换为服务端ID"""
+        if not task_id.startswith(LOCAL_ID_PREFIX):
+            return task_id
+        cursor = self.dida_api.cursor
+        cursor.execute('SELECT task_id FROM outbox WHERE local_id = ? ORDER BY id LIMIT 1', (task_id,))
+        row = cursor.fetchone()
+        return row[0] if row else task_id
+
+    # ---- 后台发送 ----
+
+    def start(self):
+        """启动后台发送线程，上次退出时未完成的修改会重新发送"""
+        if self._thread and self._thread.is_alive():
+            return
+        with self.dida_api._transaction() as cursor:
+            # 发送中被中断的记录结果不确定，按失败重试处理
+            cursor.execute('''
+            UPDATE outbox SET status = 'pending', attempts = attempts + 1, last_error = '发送中断'
+            WHERE status = 'inflight'
+            ''')
+            # 清理一天前已完成的记录
+            cursor.execute('''
+            DELETE FROM outbox WHERE status = 'done' AND updated_at < datetime('now', '-1 day')
+            ''')
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run_loop, name='task-outbox', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        """停止后台发送线程"""
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def flush(self, timeout: float = 30.0) -> bool:
+        """忽略合并窗口，等待所有待发送的修改完成
+
+        Returns:
+            bool: 超时前是否全部发送完毕（失败的记录也视为已处理）
+        """
+        deadline = time.time() + timeout
+        with self.dida_api._transaction() as cursor:
+            cursor.execute("UPDATE outbox SET available_at = ? WHERE status = 'pending'", (time.time(),))
+        self._wakeup.set()
+        while time.time() < deadline:
+            if self.status()['pending'] == 0:
+                return True
+            time.sleep(0.05)
+        return False
+
+    def status(self) -> Dict:
+        """获取各状态的记录数及最近的失败"""
+        cursor = self.dida_api.cursor
+        cursor.execute('SELECT status, COUNT(*) FROM outbox GROUP BY status')
+        counts = dict(cursor.fetchall())
+        cursor.execute('''
+        SELECT id, op, task_id, attempts, last_error FROM outbox
+        WHERE status = 'failed' ORDER BY id DESC LIMIT 5
+        ''')
+        failed = [
+            {'id': row[0], 'op': row[1], 'task_id': row[2], 'attempts': row[3], 'error': row[4]}
+            for row in cursor.fetchall()
+        ]
+        return {
+            'pending': counts.get('pending', 0) + counts.get('inflight', 0),
+            'failed': counts.get('failed', 0),
+            'done': counts.get('done', 0),
+            'recent_failures': failed
+        }
+
+    def _run_loop(self):
+        try:
+            while not self._stop.is_set():
+                wait = self._dispatch_next()
+                if wait is None:
+                    continue
+                self._wakeup.wait(wait)
+                self._wakeup.clear()
+        finally:
+            self.dida_api.close()
+
+    def _dispatch_next(self) -> Optional[float]:
+        """发送最早的一条待发送修改
+
+        Returns:
+            float: 下次检查前应等待的秒数；为None时立即处理下一条
+        """
+        api = self.dida_api
+        with api._transaction() as cursor:
+            cursor.execute('''
+            SELECT id, op, task_id, local_id, project_id, payload, attempts, available_at
+            FROM outbox WHERE status = 'pending' ORDER BY id LIMIT 1
+            ''')
+            row = cursor.fetchone()
+            if row is None:
+                return self.poll_interval
+            entry = dict(zip(
+                ('id', 'op', 'task_id', 'local_id', 'project_id', 'payload', 'attempts', 'available_at'), row
+            ))
+            # 按写入顺序发送：最早的记录还在合并窗口内时，后面的记录也等待
+            if entry['available_at'] > time.time():
+                return min(entry['available_at'] - time.time(), self.poll_interval)
+            cursor.execute('''
+            UPDATE outbox SET status = 'inflight', first_sent_at = COALESCE(first_sent_at, ?),
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+            ''', (time.time(), entry['id']))
+
+        entry['payload'] = json.loads(entry['payload'])
+        try:
+            with metrics.timer('outbox', op=entry['op']):
+                if entry['op'] == 'create':
+                    self._send_create(entry)
+                else:
+                    self._send_update(entry)
+        except Exception as e:
+            self._handle_failure(entry, e)
+            return None
+
+        metrics.inc('outbox_sent', op=entry['op'])
+        return None
+
+    def _send_create(self, entry: Dict):
+        api = self.dida_api
+        payload = entry['payload']
+
+        created = None
+        if entry['attempts'] > 0:
+            # 上次发送结果不确定，先确认服务端是否已经创建
+            created = self._find_created_task(entry)
+        if created is None:
+            created = api._make_request('POST', 'task', lane=BACKGROUND, json=payload)
+
+        local_id, server_id = entry['task_id'], created['id']
+        with api._transaction() as cursor:
+            # 用服务端ID替换临时ID，后续排队的修改也改为指向服务端ID
+            cursor.execute('DELETE FROM tasks WHERE id = ?', (local_id,))
+            cursor.execute('''
+            UPDATE outbox SET task_id = ?, project_id = COALESCE(project_id, ?)
+            WHERE task_id = ? AND id != ?
+            ''', (server_id, created.get('projectId'), local_id, entry['id']))
+            # 创建请求发送期间又排队的修改还没有写回，本地任务要保留这些修改，直到它们也写回服务端
+            pending_payloads = self._pending_payloads(server_id, entry['id'])
+            task = dict(created)
+            for payload in pending_payloads:
+                task.update(payload)
+            task['id'] = server_id
+            api._upsert_tasks([api._task_row(task)], local_pending=bool(pending_payloads))
+            cursor.execute('''
+            UPDATE outbox SET status = 'done', task_id = ?, project_id = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+            ''', (server_id, created.get('projectId'), entry['id']))
+        print(f"任务已写回服务端: {created.get('title')} ({local_id} -> {server_id})")
+
+    def _send_update(self, entry: Dict):
+        api = self.dida_api
+        task_data = {'id': entry['task_id'], 'projectId': entry['project_id'], **entry['payload']}
+        updated = api._make_request('POST', f"task/{entry['task_id']}", lane=BACKGROUND, json=task_data)
+
+        with api._transaction() as cursor:
+            # 之后还有排队的修改时保留本地数据，等最后一次修改写回后再以服务端为准
+            if not self._has_pending(entry['task_id'], entry['id']):
+                api._upsert_tasks([api._task_row({
+                    'id': entry['task_id'],
+                    'projectId': entry['project_id'],
+                    **updated
+                })])
+            cursor.execute(
+                "UPDATE outbox SET status = 'done', updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+                (entry['id'],)
+            )
+        print(f"任务修改已写回服务端: {updated.get('title')}")
+
+    def _has_pending(self, task_id: str, after_id: int) -> bool:
+        cursor = self.dida_api.cursor
+        cursor.execute('''
+        SELECT 1 FROM outbox WHERE task_id = ? AND id > ? AND status IN ('pending', 'inflight') LIMIT 1
+        ''', (task_id, after_id))
+        return cursor.fetchone() is not None
+
+    def _pending_payloads(self, task_id: str, after_id: int) -> List[Dict]:
+        """按写入顺序获取某条记录之后该任务尚未写回的修改"""
+        cursor = self.dida_api.cursor
+        cursor.execute('''
+        SELECT payload FROM outbox WHERE task_id = ? AND id > ? AND status IN ('pending', 'inflight')
+        ORDER BY id
+        ''', (task_id, after_id))
+        return [json.loads(row[0]) for row in cursor.fetchall()]
+
+    def _find_created_task(self, entry: Dict) -> Optional[Dict]:
+        """在服务端查找上次发送时可能已经创建的任务
+
+        在目标项目中查找标题相同的任务，排除已经属于其他 outbox 记录的任务，以及第一次发送前
+        就已同步到本地的任务；两次发送之间后台同步写入本地的任务仍可能是上次创建的。
+        未指定项目时无法查找，返回None。
+        """
+        project_id = entry['payload'].get('projectId')
+        if not project_id:
+            return None
+        project_data = self.dida_api.get_project_with_data(project_id, lane=BACKGROUND)
+        candidates = [
+            task for task in project_data.get('tasks', [])
+            if task.get('title') == entry['payload'].get('title')
+        ]
+        cursor = self.dida_api.cursor
+        for task in candidates:
+            cursor.execute('SELECT 1 FROM outbox WHERE task_id = ? AND id != ? LIMIT 1', (task['id'], entry['id']))
+            if cursor.fetchone() is not None:
+                continue
+            cursor.execute('''
+            SELECT 1 FROM tasks, outbox
+            WHERE tasks.id = ? AND outbox.id = ?
+                AND tasks.created_at < COALESCE(datetime(outbox.first_sent_at, 'unixepoch'), outbox.created_at)
+            ''', (task['id'], entry['id']))
+            if cursor.fetchone() is None:
+                logger.info(f"outbox: 任务 {task['title']} 已在服务端创建，直接使用 {task['id']}")
+                return task
+        return None
+
+    def _handle_failure(self, entry: Dict, error: Exception):
+        """发送失败：可重试的错误退避后重试，否则标记为失败并撤销本地修改标记"""
+        api = self.dida_api
+        if isinstance(error, (CircuitOpenError, DidaAuthRequired)):
+            # 滴答清单熔断中或需要重新授权，修改并未被服务端拒绝：不计入尝试次数，一直保留到
+            # 熔断器允许探测、或授权恢复后再发送，不会因此放弃修改或撤销本地创建的任务
+            if isinstance(error, CircuitOpenError):
+                delay = error.retry_after
+            else:
+                delay = self.backoff_max
+            with api._transaction() as cursor:
+                cursor.execute('''
+                UPDATE outbox SET status = 'pending', last_error = ?, available_at = ?,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+                ''', (str(error), time.time() + delay, entry['id']))
+            return
+
+        attempts = entry['attempts'] + 1
+        status_code = getattr(error, 'status_code', None)
+        retryable = not isinstance(error, DidaAPIError) or status_code is None \
+            or status_code == 429 or status_code >= 500
+
+        with api._transaction() as cursor:
+            if retryable and attempts < self.max_attempts:
+                ceiling = min(self.backoff_max, self.backoff_base * (2 ** attempts))
+                cursor.execute('''
+                UPDATE outbox SET status = 'pending', attempts = ?, last_error = ?,
+                    available_at = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+                ''', (attempts, str(error), time.time() + random.uniform(ceiling / 2, ceiling), entry['id']))
+                metrics.inc('outbox_retries', op=entry['op'])
+                logger.warning(f"outbox: 第 {attempts} 次发送失败，稍后重试: {str(error)}")
+                return
+
+            cursor.execute('''
+            UPDATE outbox SET status = 'failed', attempts = ?, last_error = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+            ''', (attempts, str(error), entry['id']))
+            if entry['op'] == 'create':
+                # 服务端不存在该任务：之后排队的修改也无法发送，一并标记失败并撤销本地创建
+                cursor.execute('''
+                UPDATE outbox SET status = 'failed', last_error = '任务创建失败', updated_at = CURRENT_TIMESTAMP
+                WHERE task_id = ? AND status = 'pending'
+                ''', (entry['task_id'],))
+                cursor.execute('UPDATE tasks SET deleted = 1, local_pending = 0 WHERE id = ?',
+                               (entry['task_id'],))
+            elif not self._has_pending(entry['task_id'], entry['id']):
+                # 撤销本地修改标记，并让下次同步重新以服务端数据覆盖该项目
+                cursor.execute('UPDATE tasks SET local_pending = 0, content_hash = NULL WHERE id = ?',
+                               (entry['task_id'],))
+                cursor.execute('UPDATE projects SET data_hash = NULL, remote_version = NULL WHERE id = ?',
+                               (entry['project_id'],))
+        metrics.inc('outbox_failed', op=entry['op'])
+        logger.error(f"outbox: 修改写回失败，已放弃（{entry['op']} {entry['task_id']}）: {str(error)}")
+
+    def pending_tasks(self) -> List[str]:
+        """获取有未写回修改的任务ID"""
+        cursor = self.dida_api.cursor
+        cursor.execute("SELECT DISTINCT task_id FROM outbox WHERE status IN ('pending', 'inflight')")
+        return [row[0] for row in cursor.fetchall()]
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""语音指令处理流程中与Web框架无关的步骤
+
+线程版（app.py，WSGI）和 asyncio 版（asgi_app.py，ASGI）共用这些函数，
+保证两种实现的提示词、回复解析和结果汇总完全一致。
+"""
+import json
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import pytz
+
+from context_builder import build_task_context
+from prompts.task_prompts import TASK_SYSTEM_PROMPT, TASK_TURN_PROMPT
+
+# 语音回复的最大长度，超出部分截断
+MAX_RESPONSE_CHARS = 500
+
+WEEKDAY_NAMES = '一二三四五六日'
+
+
+def format_current_time(timezone: str = 'Asia/Shanghai') -> str:
+    """获取当前时间，包含星期信息，例如 "2024年03月21日 星期四 15:30\""""
+    current_datetime = datetime.now(pytz.timezone(timezone))
+    weekday = WEEKDAY_NAMES[current_datetime.weekday()]
+    return current_datetime.strftime(f"%Y年%m月%d日 星期{weekday} %H:%M")
+
+
+def build_task_messages(command: str, tasks: List[Dict], projects: List[Dict],
+                        context_config: Optional[Dict] = None,
+                        history: Optional[List[Dict]] = None) -> Tuple[List[Dict], Dict]:
+    """构造任务分析的LLM消息
+
+    固定的系统提示词在最前面，之后是会话历史，当前时间和任务上下文只放在最后一条消息中，
+    相邻两轮的消息前缀保持一致，见 conversation.ConversationStore。
+    任务按与指令的相关性排序并在 token 预算内截断，见 context_builder.build_task_context
+
+    Args:
+        command (str): 用户指令
+        tasks (List[Dict]): 当前未完成的任务
+        projects (List[Dict]): 可用项目
+        context_config (Dict, optional): 配置文件中的 context 配置段
+        history (List[Dict], optional): 会话历史消息，见 conversation.Conversation.history
+
+    Returns:
+        Tuple[List[Dict], Dict]: (chat_completion 的 messages 参数, 提示词中使用的任务上下文)
+    """
+    context = build_task_context(command, tasks, projects, context_config)
+    messages = [
+        {"role": "system", "content": TASK_SYSTEM_PROMPT},
+        *(history or []),
+        {"role": "user", "content": TASK_TURN_PROMPT.format(
+            current_time=format_current_time(),
+            command=command,
+            tasks=context['tasks'],
+            projects=context['projects']
+        )}
+    ]
+    return messages, context
+
+
+def parse_llm_reply(content: str) -> Dict:
+    """解析LLM回复，去掉 <think> 思考过程和 ```json 代码块标记；不是JSON时作为普通回复
+
+    Args:
+        content (str): LLM返回的文本
+
+    Returns:
+        Dict: 解析后的回复，至少包含 response 字段或 action/actions 字段
+    """
+    cleaned_content = content.strip()
+    if cleaned_content.startswith('<think>') and '</think>' in cleaned_content:
+        # 推理模型的思考过程不播放给用户
+        content = cleaned_content = cleaned_content.split('</think>', 1)[1].strip()
+    try:
+        if cleaned_content.startswith('```json'):
+            cleaned_content = cleaned_content[7:]
+        if cleaned_content.endswith('```'):
+            cleaned_content = cleaned_content[:-3]
+        response_data = json.loads(cleaned_content.strip())
+    except json.JSONDecodeError:
+        return {"response": content.strip()}
+    if not isinstance(response_data, dict):
+        return {"response": content.strip()}
+    return response_data
+
+
+class ResponseFieldParser:
+    """增量解析流式返回的LLM回复，顶层 response 字段的字符串一结束就取出其内容
+
+    回复的其余部分（如 actions）还在生成时就可以开始合成语音。只跟踪顶层对象的键和
+    字符串边界，不构造完整的JSON；回复前的 <think> 思考过程和 ```json 标记会被跳过。
+    """
+
+    def __init__(self, field: str = 'response'):
+        self.field = field
+        self.text = ''          # 已收到的完整回复
+        self.response = None    # response 字段的值，字段结束前为None
+        self._pos = 0           # 下一个待扫描字符的位置
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._key = None        # 顶层对象中最近的键
+        self._expect_value = False
+        self._finished = False
+
+    def feed(self, delta: str) -> Optional[str]:
+        """追加一段回复文本
+
+        Args:
+            delta (str): 新收到的回复片段
+
+        Returns:
+            Optional[str]: response 字段在这一段中结束时返回其内容，否则返回None
+        """
+        self.text += delta
+        if self._finished:
+            return None
+        self._scan()
+        return self.response if self._finished and self.response is not None else None
+
+    def _scan(self):
+        text = self.text
+        i = self._pos
+        while i < len(text):
+            c = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == '\\':
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    if self._depth == 1 and self._end_top_level_string(text[self._string_start:i + 1]):
+                        self._pos = i + 1
+                        return
+            elif self._depth == 0:
+                if c == '<' and text.startswith('<think>', i):
+                    end = text.find('</think>', i)
+                    if end < 0:
+                        break
+                    i = end + len('</think>')
+                    continue
+                if c == '<' and '<think>'.startswith(text[i:]):
+                    # 可能是被截断的 <think> 标记，等待更多内容
+                    break
+                if c == '{':
+                    self._depth = 1
+            elif c == '"':
+                self._in_string = True
+                self._string_start = i
+            elif c in '{[':
+                self._depth += 1
+            elif c in '}]':
+                self._depth -= 1
+                if self._depth == 0:
+                    self._finished = True
+                    self._pos = i + 1
+                    return
+            elif self._depth == 1 and c == ':':
+                self._expect_value = True
+            elif self._depth == 1 and c == ',':
+                self._key, self._expect_value = None, False
+            i += 1
+        self._pos = i
+
+    def _end_top_level_string(self, literal: str) -> bool:
+        """处理顶层对象中结束的字符串（键或值），取到 response 字段时返回True"""
+        try:
+            value = json.loads(literal)
+        except ValueError:
+            value = literal[1:-1]
+        if not self._expect_value:
+            self._key = value
+            return False
+        self._expect_value = False
+        if self._key == self.field:
+            self.response = value
+            self._finished = True
+            return True
+        return False
+
+
+def collect_actions(response_data: Dict) -> List[Dict]:
+    """从LLM回复中取出要执行的操作列表
+
+    兼容单个操作（action + task_data）和多个操作（actions 列表）两种格式
+
+    Args:
+        response_data (Dict): 解析后的LLM回复
+
+    Returns:
+        List[Dict]: 操作列表，每项包含 action 和 task_data；不需要执行操作时为空列表
+    """
+    actions = response_data.get('actions')
+    if isinstance(actions, list):
+        return [item for item in actions if isinstance(item, dict) and item.get('action')]
+    if 'action' in response_data and 'task_data' in response_data:
+        return [{'action': response_data['action'], 'task_data': response_data['task_data']}]
+    return []
+
+
+def group_actions(actions: List[Dict]) -> List[List[int]]:
+    """按任务ID分组：同一任务的操作需要按顺序执行，不同组之间可以并发
+
+    Returns:
+        List[List[int]]: 每组操作在 actions 中的下标
+    """
+    groups = {}
+    for index, action in enumerate(actions):
+        task_id = (action.get('task_data') or {}).get('id')
+        groups.setdefault(task_id if task_id else f'#{index}', []).append(index)
+    return list(groups.values())
+
+
+def summarize_action_results(response_data: Dict, results: List[Tuple[bool, str]]) -> Tuple[bool, str, str]:
+    """汇总多个操作的执行结果
+
+    Args:
+        response_data (Dict): 解析后的LLM回复
+        results (List[Tuple[bool, str]]): 每个操作的 (是否成功, 结果信息)
+
+    Returns:
+        Tuple[bool, str, str]: (是否有操作成功, 播放给用户的回复, 结果信息)；
+            全部失败时回复为错误提示，部分失败时在LLM回复后补充失败原因
+    """
+    failures = [message for success, message in results if not success]
+    success = len(failures) < len(results)
+    result_message = "；".join(failures) if failures else "；".join(message for _, message in results)
+
+    if not success:
+        return False, f"抱歉，{result_message}", result_message
+
+    response_text = response_data.get('response', f"好的，{result_message}")
+    if failures:
+        response_text = f"{response_text}。不过有{len(failures)}项操作没有完成：{result_message}"
+    return True, response_text, result_message
+
+
+def truncate_response(text: str) -> str:
+    """如果响应文本太长，只取前 MAX_RESPONSE_CHARS 个字符"""
+    if len(text) > MAX_RESPONSE_CHARS:
+        return text[:MAX_RESPONSE_CHARS - 3] + "..."
+    return text
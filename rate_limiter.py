@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+
+from metrics import metrics
+
+# 请求优先级通道：交互式请求（语音指令）优先于后台同步
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+
+# 可以重试的HTTP状态码
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+DEFAULT_RATE_LIMIT = {
+    'rate': 10,                 # 每秒补充的令牌数
+    'burst': 20,                # 令牌桶容量
+    'background_reserve': 4,    # 为交互式请求保留的令牌数，后台请求不能使用
+    'max_retries': 3,           # 单个请求的最大重试次数
+    'backoff_base': 0.5,        # 指数退避的基础延迟（秒）
+    'backoff_max': 30,          # 单次退避的最大延迟（秒）
+    'retry_budget_ratio': 0.2,  # 每个请求为重试预算增加的额度
+    'retry_budget_min': 10      # 重试预算的初始值和下限参考
+}
+
+
+class RequestScheduler:
+    """上游请求调度器：带优先级通道的令牌桶限流，以及带预算的重试退避
+
+    - 所有请求先从令牌桶取令牌，桶空时等待
+    - 后台请求只在没有交互式请求等待、且剩余令牌多于保留数量时才能取令牌
+    - 重试延迟使用带抖动的指数退避，服务端返回 Retry-After 时以其为准
+    - 重试预算随请求数增长，防止上游故障时重试把请求量放大数倍
+    """
+
+    def __init__(self, name: str, config: Optional[Dict] = None):
+        """初始化调度器
+
+        Args:
+            name (str): 上游服务名称，用于指标标签
+            config (Dict, optional): 限流配置，未提供的项使用 DEFAULT_RATE_LIMIT
+        """
+        self.name = name
+        self.config = {**DEFAULT_RATE_LIMIT, **(config or {})}
+        self.rate = float(self.config['rate'])
+        self.burst = float(self.config['burst'])
+        self.reserve = min(float(self.config['background_reserve']), self.burst - 1)
+
+        self._cond = threading.Condition()
+        self._tokens = self.burst
+        self._updated_at = time.monotonic()
+        self._interactive_waiting = 0
+
+        self._budget_lock = threading.Lock()
+        self._retry_budget = float(self.config['retry_budget_min'])
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def acquire(self, lane: str = INTERACTIVE) -> float:
+        """从令牌桶取一个令牌，必要时等待
+
+        Args:
+            lane (str): 请求通道，INTERACTIVE 或 BACKGROUND
+
+        Returns:
+            float: 等待的秒数
+        """
+        start = time.monotonic()
+        interactive = lane != BACKGROUND
+        needed = 1.0 if interactive else 1.0 + self.reserve
+        with self._cond:
+            if interactive:
+                self._interactive_waiting += 1
+            try:
+                while True:
+                    self._refill()
+                    if self._tokens >= needed and (interactive or not self._interactive_waiting):
+                        self._tokens -= 1
+                        break
+                    wait = max((needed - self._tokens) / self.rate, 0.01)
+                    self._cond.wait(wait)
+            finally:
+                if interactive:
+                    self._interactive_waiting -= 1
+                    self._cond.notify_all()
+
+        waited = time.monotonic() - start
+        if waited > 0.001:
+            metrics.inc('upstream_throttled', upstream=self.name, lane=lane)
+            metrics.observe('throttle_wait', waited, op=f'{self.name}:{lane}')
+        return waited
+
+    def try_acquire(self, lane: str = INTERACTIVE) -> float:
+        """不等待地尝试取一个令牌，供 asyncio 调用方在事件循环中使用
+
+        Args:
+            lane (str): 请求通道，INTERACTIVE 或 BACKGROUND
+
+        Returns:
+            float: 0 表示已取得令牌，否则为下次尝试前建议等待的秒数
+        """
+        interactive = lane != BACKGROUND
+        needed = 1.0 if interactive else 1.0 + self.reserve
+        with self._cond:
+            self._refill()
+            if self._tokens >= needed and (interactive or not self._interactive_waiting):
+                self._tokens -= 1
+                return 0.0
+            return max((needed - self._tokens) / self.rate, 0.01)
+
+    def record_request(self):
+        """每个首次请求为重试预算增加额度"""
+        with self._budget_lock:
+            cap = float(self.config['retry_budget_min']) * 10
+            self._retry_budget = min(cap, self._retry_budget + float(self.config['retry_budget_ratio']))
+
+    def allow_retry(self, attempt: int, reason: str) -> bool:
+        """判断是否还能重试，允许时扣减一次重试预算
+
+        Args:
+            attempt (int): 已重试的次数
+            reason (str): 重试原因（状态码或异常类型），用于指标标签
+
+        Returns:
+            bool: 是否允许重试
+        """
+        if attempt >= int(self.config['max_retries']):
+            return False
+        with self._budget_lock:
+            if self._retry_budget < 1:
+                metrics.inc('upstream_retry_budget_exhausted', upstream=self.name)
+                return False
+            self._retry_budget -= 1
+        metrics.inc('upstream_retries', upstream=self.name, reason=reason)
+        return True
+
+    def backoff(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """计算第 attempt 次重试前的等待时间
+
+        Args:
+            attempt (int): 已重试的次数（从0开始）
+            retry_after (str, optional): 服务端返回的 Retry-After 响应头
+
+        Returns:
+            float: 等待的秒数
+        """
+        backoff_max = float(self.config['backoff_max'])
+        delay = parse_retry_after(retry_after)
+        if delay is not None:
+            return min(delay, backoff_max)
+        # full jitter：在 [0, base * 2^attempt] 内随机取值，避免多个客户端同时重试
+        ceiling = min(backoff_max, float(self.config['backoff_base']) * (2 ** attempt))
+        return random.uniform(0, ceiling)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析 Retry-After 响应头（秒数或HTTP日期），无法解析时返回None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+_schedulers: Dict[str, RequestScheduler] = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(name: str, config: Optional[Dict] = None) -> RequestScheduler:
+    """获取指定上游服务的进程内共享调度器，首次调用时按 config 创建"""
+    scheduler = _schedulers.get(name)
+    if scheduler is None:
+        with _schedulers_lock:
+            scheduler = _schedulers.get(name)
+            if scheduler is None:
+                scheduler = _schedulers[name] = RequestScheduler(name, config)
+    return scheduler
@@ -1,9 +1,63 @@
 import requests
 import json
-from typing import Optional
+import os
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from audio_upload import MultipartBody
+from circuit_breaker import CircuitOpenError, breakers
+from http_session import sessions
+from metrics import metrics
+from model_router import ModelRouter
+from typing import Iterator, Optional, Tuple, Union
 from pathlib import Path
 from datetime import datetime
 
+# 流式请求结束的标记
+_STREAM_END = object()
+
+def parse_stream_line(line: Union[bytes, str]) -> Tuple[bool, str]:
+    """解析流式对话接口（Server-Sent Events）返回的一行
+    
+    Args:
+        line (bytes | str): 一行响应内容，例如 'data: {"choices": [{"delta": {"content": "好"}}]}'
+        
+    Returns:
+        Tuple[bool, str]: (是否已结束, 本行中的回复内容)；推理模型的思考过程（reasoning_content）不计入回复
+    """
+    if isinstance(line, bytes):
+        line = line.decode('utf-8')
+    line = line.strip()
+    if not line.startswith('data:'):
+        return False, ''
+    data = line[5:].strip()
+    if data == '[DONE]':
+        return True, ''
+    chunk = json.loads(data)
+    if chunk.get('error'):
+        raise Exception(f"LLM API错误: {chunk['error']}")
+    choices = chunk.get('choices') or [{}]
+    return False, (choices[0].get('delta') or {}).get('content') or ''
+
+class _StreamAttempt:
+    """对某个模型的一次流式请求，可以在其他线程中取消"""
+    
+    def __init__(self, model: str):
+        self.model = model
+        self.response = None
+        self.cancelled = threading.Event()
+    
+    def cancel(self):
+        """取消请求：关闭响应连接，读取线程随即退出"""
+        self.cancelled.set()
+        response = self.response
+        if response is not None:
+            try:
+                response.close()
+            except Exception:
+                pass
+
 class SiliconFlowAPI:
     def __init__(self, config_path: str = "config.json"):
         """初始化硅基流动API客户端
@@ -24,6 +78,18 @@ class SiliconFlowAPI:
         self.headers = {
             "Authorization": f"Bearer {self.api_token}"
         }
+        
+        # 共享的keep-alive会话，ASR、LLM、TTS请求复用同一个连接池
+        sessions.configure(config.get('http'))
+        self.session = sessions.get('silicon_flow')
+        breakers.configure(config.get('circuit_breakers'))
+        
+        # 按指令复杂度选择模型，慢请求向备用模型发出对冲请求
+        self.router = ModelRouter(silicon_config.get('routing'))
+        self._llm_executor = ThreadPoolExecutor(
+            max_workers=silicon_config.get('llm_concurrency', 16),
+            thread_name_prefix='llm'
+        )
     
     def set_model(self, model_name: str) -> None:
         """设置LLM模型
@@ -43,35 +109,37 @@ class SiliconFlowAPI:
         with open(self.config_path, 'w', encoding='utf-8') as f:
             json.dump(config, f, ensure_ascii=False, indent=4)
     
-    def transcribe_audio(self, audio_file_path: str) -> dict:
+    def transcribe_audio(self, audio, filename: str = 'audio.webm', content_type: str = 'audio/webm') -> dict:
         """ASR模块：将音频文件转换为文字
         
         Args:
-            audio_file_path (str): 音频文件路径
+            audio (str | BinaryIO): 音频文件路径，或从当前位置读取到结尾的文件对象（如 AudioSpool.open()）
+            filename (str): 上传使用的文件名，ASR服务据此判断音频格式
+            content_type (str): 音频的 Content-Type
             
         Returns:
             dict: 转录结果，格式为：
                 成功: {"text": "转录文本"}
                 失败: {"error": "错误信息", "text": ""}
+                熔断中: {"error": "错误信息", "text": "", "degraded": "asr"}
         """
+        breaker = breakers.get('asr')
         try:
-            # 准备API请求
-            url = f"{self.base_url}/audio/transcriptions"
-            headers = {
-                "Authorization": f"Bearer {self.api_token}"
-            }
-            
-            # 读取音频文件
-            with open(audio_file_path, 'rb') as audio_file:
-                files = {
-                    'file': ('audio.webm', audio_file, 'audio/webm')
-                }
-                data = {
-                    'model': "FunAudioLLM/SenseVoiceSmall"  # 直接使用固定的模型名称
-                }
-                
-                print(f"正在调用硅基流动API: {url}")
-                response = requests.post(url, headers=headers, files=files, data=data, timeout=30)
+            breaker.acquire()
+        except CircuitOpenError as e:
+            return {"error": str(e), "text": "", "degraded": "asr"}
+        start_time = time.monotonic()
+        result = self._transcribe_audio(audio, filename, content_type)
+        breaker.record('error' not in result, time.monotonic() - start_time)
+        return result
+    
+    def _transcribe_audio(self, audio, filename: str, content_type: str) -> dict:
+        try:
+            if isinstance(audio, str):
+                with open(audio, 'rb') as audio_file:
+                    response = self._upload_audio(audio_file, filename, content_type)
+            else:
+                response = self._upload_audio(audio, filename, content_type)
             
             # 检查响应状态
             if response.status_code != 200:
@@ -95,11 +163,30 @@ class SiliconFlowAPI:
             print(f"错误: {error_msg}")
             return {"error": error_msg, "text": ""}
     
-    def chat_completion(self, messages: list) -> dict:
+    def _upload_audio(self, audio_file, filename: str, content_type: str) -> requests.Response:
+        """以 multipart 请求上传音频，请求体在发送时按块从文件对象中读取"""
+        url = f"{self.base_url}/audio/transcriptions"
+        start = audio_file.tell()
+        size = audio_file.seek(0, os.SEEK_END) - start
+        audio_file.seek(start)
+        body = MultipartBody(
+            {'model': "FunAudioLLM/SenseVoiceSmall"},  # 直接使用固定的模型名称
+            'file', audio_file, size, filename, content_type
+        )
+        headers = {
+            "Authorization": f"Bearer {self.api_token}",
+            "Content-Type": body.content_type
+        }
+        
+        print(f"正在调用硅基流动API: {url}")
+        return self.session.post(url, headers=headers, data=body, timeout=sessions.timeout('asr'))
+    
+    def chat_completion(self, messages: list, model: Optional[str] = None) -> dict:
         """LLM模块：调用大语言模型进行对话
         
         Args:
             messages (list): 对话历史消息列表
+            model (str, optional): 模型名称，默认使用配置中的 models.llm
             
         Returns:
             dict: 模型回复
@@ -107,16 +194,228 @@ class SiliconFlowAPI:
         url = f"{self.base_url}/chat/completions"
         
         payload = {
-            "model": self.models['llm'],
+            "model": model or self.models['llm'],
             "messages": messages
         }
         
         headers = self.headers.copy()
         headers["Content-Type"] = "application/json"
         
-        response = requests.post(url, json=payload, headers=headers)
+        with breakers.get('llm').guard():
+            response = self.session.post(url, json=payload, headers=headers, timeout=sessions.timeout('llm'))
+            if response.status_code >= 500:
+                raise Exception(f"LLM API错误 (状态码: {response.status_code})")
         return response.json()
     
+    def chat_completion_stream(self, messages: list, model: Optional[str] = None,
+                               attempt: Optional[_StreamAttempt] = None) -> Iterator[str]:
+        """LLM模块：以流式方式调用大语言模型，边生成边返回回复内容
+        
+        Args:
+            messages (list): 对话历史消息列表
+            model (str, optional): 模型名称，默认使用配置中的 models.llm
+            attempt (_StreamAttempt, optional): 对冲请求中用于取消本次请求的对象
+            
+        Yields:
+            str: 依次返回的回复片段
+            
+        Raises:
+            CircuitOpenError: LLM服务熔断中
+            Exception: 当API调用失败时抛出异常
+        """
+        url = f"{self.base_url}/chat/completions"
+        
+        payload = {
+            "model": model or self.models['llm'],
+            "messages": messages,
+            "stream": True
+        }
+        
+        headers = self.headers.copy()
+        headers["Content-Type"] = "application/json"
+        
+        # 以首字延迟判断是否为慢调用；请求被取消时不计入熔断统计
+        breaker = breakers.get('llm')
+        breaker.acquire()
+        start_time = time.monotonic()
+        recorded = False
+        try:
+            with self.session.post(url, json=payload, headers=headers, timeout=sessions.timeout('llm'),
+                                   stream=True) as response:
+                if attempt is not None:
+                    attempt.response = response
+                    if attempt.cancelled.is_set():
+                        return
+                if response.status_code != 200:
+                    raise Exception(f"LLM API错误 (状态码: {response.status_code})")
+                for line in response.iter_lines():
+                    if attempt is not None and attempt.cancelled.is_set():
+                        return
+                    done, content = parse_stream_line(line)
+                    if done:
+                        break
+                    if content:
+                        if not recorded:
+                            breaker.record(True, time.monotonic() - start_time)
+                            recorded = True
+                        yield content
+            if not recorded:
+                breaker.record(True, time.monotonic() - start_time)
+                recorded = True
+        except Exception:
+            if not recorded and not (attempt is not None and attempt.cancelled.is_set()):
+                breaker.record(False, time.monotonic() - start_time)
+                recorded = True
+            raise
+        finally:
+            if not recorded:
+                breaker.release()
+    
+    def _timed_chat_completion(self, messages: list, model: str) -> dict:
+        start_time = time.time()
+        result = self.chat_completion(messages, model)
+        if result and 'choices' in result:
+            self.router.record(model, time.time() - start_time)
+        return result
+    
+    def routed_chat_completion(self, messages: list, command: str) -> dict:
+        """按指令选择模型调用LLM，主模型超过 p95 延迟仍未返回时向备用模型发出对冲请求
+        
+        同步请求在返回前无法中断，落选的请求在后台完成后被丢弃
+        
+        Args:
+            messages (list): 对话历史消息列表
+            command (str): 用户指令，用于选择模型
+            
+        Returns:
+            dict: 先成功返回的模型回复（格式同 chat_completion）
+        """
+        primary, fallback = self.router.route(command, self.models['llm'])
+        start_time = time.time()
+        futures = {self._llm_executor.submit(self._timed_chat_completion, messages, primary): primary}
+        hedged = fallback is None
+        racing = False
+        delay = self.router.hedge_delay(primary) if fallback else None
+        last_result, last_error = None, None
+        
+        while futures:
+            done, _ = wait(futures, timeout=None if hedged else delay, return_when=FIRST_COMPLETED)
+            if not done:
+                print(f"{primary} 超过 {delay:.1f} 秒未返回，向 {fallback} 发出对冲请求")
+                metrics.inc('llm_hedge', result='sent')
+                futures[self._llm_executor.submit(self._timed_chat_completion, messages, fallback)] = fallback
+                hedged = racing = True
+                continue
+            for future in done:
+                model = futures.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    last_error = e
+                    continue
+                if result and 'choices' in result:
+                    for other in futures:
+                        other.cancel()
+                    if racing:
+                        self.router.record_hedge(model, primary, time.time() - start_time)
+                    return result
+                last_result = result
+            if not hedged and not futures:
+                # 主模型在对冲前就失败了，直接改用备用模型
+                metrics.inc('llm_hedge', result='failover')
+                futures[self._llm_executor.submit(self._timed_chat_completion, messages, fallback)] = fallback
+                hedged = True
+        
+        if last_result is not None:
+            return last_result
+        raise last_error
+    
+    def _run_stream_attempt(self, messages: list, attempt: _StreamAttempt, events: queue.Queue):
+        """在线程中读取一个模型的流式回复，把回复片段、结束标记或异常放入队列"""
+        start_time = time.time()
+        first = True
+        try:
+            for content in self.chat_completion_stream(messages, attempt.model, attempt):
+                if first:
+                    self.router.record(attempt.model, time.time() - start_time)
+                    first = False
+                events.put((attempt, content))
+        except Exception as e:
+            if not attempt.cancelled.is_set():
+                events.put((attempt, e))
+            return
+        events.put((attempt, _STREAM_END))
+    
+    def routed_chat_completion_stream(self, messages: list, command: str) -> Iterator[str]:
+        """按指令选择模型，以流式方式调用LLM
+        
+        主模型超过其 p95 首字延迟仍未输出时，向备用模型发出同样的请求；先输出的模型胜出，
+        另一个请求被取消。主模型在输出前失败时直接改用备用模型。
+        
+        Args:
+            messages (list): 对话历史消息列表
+            command (str): 用户指令，用于选择模型
+            
+        Yields:
+            str: 胜出模型依次返回的回复片段
+            
+        Raises:
+            Exception: 所有模型都在输出前失败时抛出最后一个异常
+        """
+        primary, fallback = self.router.route(command, self.models['llm'])
+        events = queue.Queue()
+        attempts = []
+        
+        def start(model):
+            attempt = _StreamAttempt(model)
+            attempts.append(attempt)
+            self._llm_executor.submit(self._run_stream_attempt, messages, attempt, events)
+        
+        start_time = time.time()
+        start(primary)
+        deadline = time.monotonic() + self.router.hedge_delay(primary) if fallback else None
+        winner = None
+        failures = 0
+        try:
+            while True:
+                timeout = None
+                if winner is None and len(attempts) == 1 and deadline is not None:
+                    timeout = max(0.0, deadline - time.monotonic())
+                try:
+                    attempt, item = events.get(timeout=timeout)
+                except queue.Empty:
+                    print(f"{primary} 超过 p95 首字延迟仍未输出，向 {fallback} 发出对冲请求")
+                    metrics.inc('llm_hedge', result='sent')
+                    start(fallback)
+                    continue
+                
+                if winner is None:
+                    if isinstance(item, Exception):
+                        failures += 1
+                        if fallback and len(attempts) == 1:
+                            metrics.inc('llm_hedge', result='failover')
+                            start(fallback)
+                        elif failures == len(attempts):
+                            raise item
+                        continue
+                    winner = attempt
+                    for other in attempts:
+                        if other is not winner:
+                            other.cancel()
+                    if len(attempts) > 1 and failures == 0:
+                        self.router.record_hedge(winner.model, primary, time.time() - start_time)
+                
+                if attempt is not winner:
+                    continue
+                if item is _STREAM_END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            for attempt in attempts:
+                attempt.cancel()
+    
     def text_to_speech(self, text: str, voice: Optional[str] = None) -> bytes:
         """TTS模块：将文字转换为语音
         
@@ -148,7 +447,10 @@ class SiliconFlowAPI:
         print(f"请求参数: {json.dumps(payload, ensure_ascii=False, indent=2)}")
         
         try:
-            response = requests.post(url, json=payload, headers=headers, timeout=30)
+            with breakers.get('tts').guard():
+                response = self.session.post(url, json=payload, headers=headers, timeout=sessions.timeout('tts'))
+                if response.status_code >= 500:
+                    raise Exception(f"TTS API错误 (状态码: {response.status_code})")
             
             # 检查响应状态
             if response.status_code != 200:
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""按句分段的流式语音合成
+
+回复按句切分后以有限并发合成，合成好的句子按顺序通过 Server-Sent Events 推送给浏览器。
+第一句合成完就可以开始播放，不必等整段回复合成完毕，因此也不再需要截断过长的回复。
+"""
+import asyncio
+import base64
+import json
+import re
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from concurrent.futures import Executor
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional
+
+from metrics import metrics
+
+DEFAULT_SENTENCE_CONCURRENCY = 3
+DEFAULT_MAX_SENTENCE_CHARS = 80
+# 短于此长度的句子与下一句合并，减少TTS请求次数
+MIN_SENTENCE_CHARS = 6
+# 创建后超过这么多秒仍未被读取的合成任务会被取消
+DEFAULT_JOB_TTL = 120
+
+_SENTENCE_END = re.compile(r'(?<=[。！？!?；;\n])')
+_CLAUSE_END = re.compile(r'(?<=[，,、：:])')
+
+
+def _split_long(sentence: str, max_chars: int) -> List[str]:
+    """把超长的句子按逗号等切分，单个分句仍超长时按长度切分"""
+    parts, current = [], ''
+    for clause in _CLAUSE_END.split(sentence):
+        while len(clause) > max_chars:
+            if current:
+                parts.append(current)
+                current = ''
+            parts.append(clause[:max_chars])
+            clause = clause[max_chars:]
+        if len(current) + len(clause) > max_chars:
+            parts.append(current)
+            current = ''
+        current += clause
+    if current:
+        parts.append(current)
+    return parts
+
+
+def split_sentences(text: str, max_chars: int = DEFAULT_MAX_SENTENCE_CHARS) -> List[str]:
+    """把回复切分为适合逐句合成的片段
+
+    Args:
+        text (str): 回复文本
+        max_chars (int): 每个片段的最大字数
+
+    Returns:
+        List[str]: 依次播放的片段，标点保留在句末
+    """
+    sentences, pending = [], ''
+    for sentence in _SENTENCE_END.split(text):
+        if not sentence.strip():
+            continue
+        for part in _split_long(sentence, max_chars):
+            pending += part
+            if len(pending.strip()) >= MIN_SENTENCE_CHARS:
+                sentences.append(pending.strip())
+                pending = ''
+    if pending.strip():
+        if sentences and len(sentences[-1]) + len(pending) <= max_chars:
+            sentences[-1] = (sentences[-1] + pending).strip()
+        else:
+            sentences.append(pending.strip())
+    return sentences
+
+
+def format_sse(data: Dict, event: Optional[str] = None) -> str:
+    """格式化一条 Server-Sent Events 消息"""
+    message = f"event: {event}\n" if event else ''
+    return message + f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class _SpeechJobBase(ABC):
+    """一段回复的分句合成任务
+
+    最多提前合成 concurrency 句：读取方每取走一句，才开始合成后面的句子，
+    浏览器断开或任务被取消时不会继续为剩余的句子调用TTS。
+    """
+
+    def __init__(self, text: str, concurrency: int = DEFAULT_SENTENCE_CONCURRENCY,
+                 max_chars: int = DEFAULT_MAX_SENTENCE_CHARS):
+        self.text = text
+        self.sentences = split_sentences(text, max_chars)
+        self.created_at = time.time()
+        self._concurrency = max(1, concurrency)
+        self._pending = []
+        self._cancelled = False
+        self._lock = threading.Lock()
+
+    @abstractmethod
+    def _submit(self, sentence: str):
+        """提交一句话合成，返回可以等待结果的 Future 或 Task"""
+
+    def _fill(self, consumed: int):
+        """保证第 consumed 句之后最多有 concurrency 句正在合成或已合成"""
+        with self._lock:
+            limit = min(len(self.sentences), consumed + self._concurrency)
+            while not self._cancelled and len(self._pending) < limit:
+                self._pending.append(self._submit(self.sentences[len(self._pending)]))
+
+    def cancel(self):
+        """取消尚未完成的合成"""
+        with self._lock:
+            self._cancelled = True
+            for pending in self._pending:
+                pending.cancel()
+
+    def _event(self, index: int, audio: Optional[bytes], error: Optional[str]) -> str:
+        if index == 0:
+            metrics.observe('tts_first_chunk', time.time() - self.created_at)
+        data = {'index': index, 'total': len(self.sentences), 'text': self.sentences[index]}
+        if audio is not None:
+            data['audio'] = f'data:audio/wav;base64,{base64.b64encode(audio).decode("utf-8")}'
+        else:
+            data['error'] = error
+        return format_sse(data)
+
+
+class SpeechJob(_SpeechJobBase):
+    """分句合成任务（线程版），合成在共享线程池中执行"""
+
+    def __init__(self, text: str, synthesize: Callable[[str], bytes], executor: Executor, **kwargs):
+        """创建合成任务并立即开始合成前几句
+
+        Args:
+            text (str): 回复文本
+            synthesize (Callable[[str], bytes]): 合成一句语音的函数
+            executor (Executor): 执行合成的线程池
+            concurrency (int): 每个任务最多同时合成的句数
+            max_chars (int): 每句的最大字数
+        """
+        super().__init__(text, **kwargs)
+        self._synthesize = synthesize
+        self._executor = executor
+        self._fill(0)
+
+    def _submit(self, sentence: str):
+        return self._executor.submit(self._synthesize, sentence)
+
+    def events(self) -> Iterator[str]:
+        """按顺序生成每句语音的SSE消息，最后发送 done 事件；读取方断开时取消剩余的合成"""
+        try:
+            for index in range(len(self.sentences)):
+                self._fill(index)
+                if index >= len(self._pending):
+                    return
+                try:
+                    audio, error = self._pending[index].result(), None
+                except Exception as e:
+                    audio, error = None, str(e)
+                self._fill(index + 1)
+                yield self._event(index, audio, error)
+            yield format_sse({'total': len(self.sentences)}, event='done')
+        finally:
+            self.cancel()
+
+
+class AsyncSpeechJob(_SpeechJobBase):
+    """分句合成任务（asyncio 版），需要在事件循环中创建"""
+
+    def __init__(self, text: str, synthesize: Callable, **kwargs):
+        """创建合成任务并立即开始合成前几句
+
+        Args:
+            text (str): 回复文本
+            synthesize (Callable): 合成一句语音的协程函数
+            concurrency (int): 每个任务最多同时合成的句数
+            max_chars (int): 每句的最大字数
+        """
+        super().__init__(text, **kwargs)
+        self._synthesize = synthesize
+        self._fill(0)
+
+    def _submit(self, sentence: str):
+        task = asyncio.create_task(self._synthesize(sentence))
+        # 被取消的任务也取出其异常，避免 "Task exception was never retrieved" 警告
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return task
+
+    async def events(self) -> AsyncIterator[str]:
+        """按顺序生成每句语音的SSE消息（同 SpeechJob.events）"""
+        try:
+            for index in range(len(self.sentences)):
+                self._fill(index)
+                if index >= len(self._pending):
+                    return
+                try:
+                    audio, error = await self._pending[index], None
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    audio, error = None, str(e)
+                self._fill(index + 1)
+                yield self._event(index, audio, error)
+            yield format_sse({'total': len(self.sentences)}, event='done')
+        finally:
+            self.cancel()
+
+
+class SpeechJobs:
+    """进程内的分句合成任务表
+
+    指令处理接口创建任务并返回任务ID，浏览器随后通过 /api/tts-stream/<任务ID> 读取；
+    每个任务只能被读取一次，超过 ttl 秒未被读取的任务会被取消并清理。
+    """
+
+    def __init__(self, ttl: float = DEFAULT_JOB_TTL):
+        self.ttl = ttl
+        self._jobs: Dict[str, _SpeechJobBase] = {}
+        self._lock = threading.Lock()
+
+    def add(self, job: _SpeechJobBase) -> str:
+        """登记合成任务，返回任务ID"""
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            expired = [key for key, value in self._jobs.items()
+                       if time.time() - value.created_at > self.ttl]
+            for key in expired:
+                self._jobs.pop(key).cancel()
+            self._jobs[job_id] = job
+        return job_id
+
+    def pop(self, job_id: str) -> Optional[_SpeechJobBase]:
+        """取出合成任务，不存在或已被读取时返回None"""
+        with self._lock:
+            return self._jobs.pop(job_id, None)
+
+    def cancel(self, job_id: str):
+        """取消并移除合成任务"""
+        job = self.pop(job_id)
+        if job is not None:
+            job.cancel()
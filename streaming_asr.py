@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+"""录音过程中的流式语音识别
+
+浏览器录音时把 16kHz 单声道 16 位 PCM 分块上传，服务端用基于能量的语音活动检测（VAD）
+在停顿处切分语音段，每段一结束就交给ASR服务识别，多段并发识别。用户停止说话时，前面的
+语音段大多已经识别完毕，只需等待最后一段，不必等整段录音上传后再从头识别。
+
+VAD 按帧计算 RMS 能量，与持续估计的背景噪声比较：
+- 能量超过 max(min_rms, 噪声 × threshold_ratio) 的帧视为语音
+- 语音后连续 silence_ms 的静音结束一个语音段，段首保留 padding_ms 的前置音频避免吞字
+- 语音累计不足 min_speech_ms 的段（咳嗽、碰撞声）丢弃；超过 max_segment_seconds 时强制切分
+"""
+import asyncio
+import io
+import math
+import sys
+import threading
+import time
+import uuid
+import wave
+from abc import ABC, abstractmethod
+from array import array
+from collections import deque
+from concurrent.futures import Executor
+from typing import Callable, Dict, List, Optional
+
+from metrics import metrics
+
+DEFAULT_STREAMING_ASR_CONFIG = {
+    'enabled': True,
+    'sample_rate': 16000,         # 浏览器上传的PCM采样率
+    'frame_ms': 30,               # VAD 每帧的时长
+    'silence_ms': 500,            # 语音后连续静音多久结束一个语音段
+    'min_speech_ms': 200,         # 语音段中语音帧的最短总时长，不足时丢弃
+    'padding_ms': 200,            # 语音段前保留的静音时长
+    'max_segment_seconds': 20,    # 单个语音段的最大时长
+    'threshold_ratio': 3.0,       # 能量超过背景噪声的倍数时视为语音
+    'min_rms': 300,               # 语音帧的最低能量（16位PCM的RMS）
+    'max_seconds': 300,           # 单次录音的最大时长
+    'concurrency': 4,             # 同时识别的语音段数
+    'ttl': 60                     # 超过这么多秒没有收到音频的识别流会被取消
+}
+
+# 背景噪声估计的平滑系数
+NOISE_SMOOTHING = 0.05
+
+
+def pcm_to_wav(pcm: bytes, sample_rate: int) -> bytes:
+    """把16位单声道PCM封装为WAV"""
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(pcm)
+    return buffer.getvalue()
+
+
+def frame_rms(frame: bytes) -> float:
+    """计算一帧16位小端PCM的RMS能量"""
+    samples = array('h', frame)
+    if sys.byteorder == 'big':
+        samples.byteswap()
+    if not samples:
+        return 0.0
+    return math.sqrt(sum(sample * sample for sample in samples) / len(samples))
+
+
+class EnergyVAD:
+    """基于能量的语音活动检测，把连续的PCM切分为语音段"""
+
+    def __init__(self, sample_rate: int = 16000, frame_ms: int = 30, silence_ms: int = 500,
+                 min_speech_ms: int = 200, padding_ms: int = 200, max_segment_seconds: float = 20,
+                 threshold_ratio: float = 3.0, min_rms: float = 300):
+        """初始化VAD，参数含义见 DEFAULT_STREAMING_ASR_CONFIG"""
+        self.sample_rate = sample_rate
+        self.frame_bytes = sample_rate * frame_ms // 1000 * 2
+        self.silence_frames = max(1, silence_ms // frame_ms)
+        self.min_speech_frames = max(1, min_speech_ms // frame_ms)
+        self.padding_frames = padding_ms // frame_ms
+        self.max_frames = max(1, int(max_segment_seconds * 1000 // frame_ms))
+        self.threshold_ratio = threshold_ratio
+        self.min_rms = min_rms
+
+        self._buffer = b''
+        self._noise: Optional[float] = None
+        self._preroll = deque(maxlen=self.padding_frames or 1)
+        self._segment: Optional[List[bytes]] = None
+        self._speech_frames = 0
+        self._silence_run = 0
+
+    def feed(self, pcm: bytes) -> List[bytes]:
+        """输入一块PCM（长度不必是整帧）
+
+        Returns:
+            List[bytes]: 本次输入中结束的语音段（PCM）
+        """
+        self._buffer += pcm
+        segments = []
+        offset = 0
+        while len(self._buffer) - offset >= self.frame_bytes:
+            segment = self._process(self._buffer[offset:offset + self.frame_bytes])
+            offset += self.frame_bytes
+            if segment is not None:
+                segments.append(segment)
+        self._buffer = self._buffer[offset:]
+        return segments
+
+    def flush(self) -> Optional[bytes]:
+        """录音结束时取出尚未结束的语音段，不足一帧的剩余数据也计入"""
+        if self._segment is not None and self._buffer:
+            self._segment.append(self._buffer)
+        self._buffer = b''
+        return self._end_segment(trailing=0)
+
+    def _process(self, frame: bytes) -> Optional[bytes]:
+        rms = frame_rms(frame)
+        if self._noise is None:
+            self._noise = rms
+        speech = rms > max(self.min_rms, self._noise * self.threshold_ratio)
+
+        if self._segment is None:
+            # 只用非语音帧估计背景噪声，避免说话时阈值被抬高
+            if not speech:
+                self._noise += (rms - self._noise) * NOISE_SMOOTHING
+                if self.padding_frames:
+                    self._preroll.append(frame)
+                return None
+            self._segment = list(self._preroll) if self.padding_frames else []
+            self._preroll.clear()
+            self._speech_frames = 0
+            self._silence_run = 0
+
+        self._segment.append(frame)
+        if speech:
+            self._speech_frames += 1
+            self._silence_run = 0
+        else:
+            self._silence_run += 1
+        if self._silence_run >= self.silence_frames:
+            return self._end_segment(trailing=self._silence_run)
+        if len(self._segment) >= self.max_frames:
+            return self._end_segment(trailing=0)
+        return None
+
+    def _end_segment(self, trailing: int) -> Optional[bytes]:
+        """结束当前语音段，段尾只保留 padding_frames 帧静音；语音过短时丢弃"""
+        segment, speech_frames = self._segment, self._speech_frames
+        self._segment = None
+        self._speech_frames = 0
+        self._silence_run = 0
+        if segment is None or speech_frames < self.min_speech_frames:
+            return None
+        drop = max(0, trailing - self.padding_frames)
+        return b''.join(segment[:len(segment) - drop] if drop else segment)
+
+
+class _TranscriptionStreamBase(ABC):
+    """一次录音的流式识别：VAD 切分出的语音段按顺序提交识别，结束时按顺序拼接结果"""
+
+    def __init__(self, config: Optional[Dict] = None):
+        self.config = {**DEFAULT_STREAMING_ASR_CONFIG, **(config or {})}
+        self.sample_rate = self.config['sample_rate']
+        self.vad = EnergyVAD(**{key: self.config[key] for key in (
+            'sample_rate', 'frame_ms', 'silence_ms', 'min_speech_ms', 'padding_ms',
+            'max_segment_seconds', 'threshold_ratio', 'min_rms')})
+        self.max_bytes = int(self.config['max_seconds'] * self.sample_rate * 2)
+        self.received = 0
+        self.created_at = self.last_used = time.time()
+        self._finished_at: Optional[float] = None
+        self._pending = []
+        self._cancelled = False
+        self._lock = threading.Lock()
+
+    @abstractmethod
+    def _submit(self, wav: bytes):
+        """提交一个语音段（WAV）识别，返回可以等待结果的 Future 或 Task"""
+
+    def feed(self, pcm: bytes) -> int:
+        """输入一块录音，结束的语音段立即提交识别
+
+        Returns:
+            int: 已提交识别的语音段数
+
+        Raises:
+            ValueError: 录音超过 max_seconds
+        """
+        with self._lock:
+            self.last_used = time.time()
+            self.received += len(pcm)
+            if self.received > self.max_bytes:
+                raise ValueError(f"录音过长（超过{self.config['max_seconds']}秒）")
+            for segment in self.vad.feed(pcm):
+                self._add_segment(segment)
+            return len(self._pending)
+
+    def _close(self):
+        """录音结束：提交最后一个语音段"""
+        with self._lock:
+            segment = self.vad.flush()
+            if segment is not None:
+                self._add_segment(segment)
+            self._finished_at = time.time()
+
+    def _add_segment(self, segment: bytes):
+        if self._cancelled:
+            return
+        metrics.inc('asr_stream_segments')
+        self._pending.append(self._submit(pcm_to_wav(segment, self.sample_rate)))
+
+    def partial_text(self) -> str:
+        """已按顺序识别完成的前几段的文字"""
+        texts = []
+        for pending in list(self._pending):
+            if not pending.done() or pending.cancelled() or pending.exception() is not None:
+                break
+            texts.append(pending.result().get('text', ''))
+        return ''.join(texts).strip()
+
+    def _combine(self, results: List[Dict]) -> Dict:
+        """拼接各语音段的识别结果，格式同 transcribe_audio"""
+        metrics.observe('asr_stream_tail', time.time() - self._finished_at)
+        for result in results:
+            if 'error' in result:
+                return result
+        return {'text': ''.join(result.get('text', '') for result in results).strip(),
+                'segments': len(results)}
+
+    def cancel(self):
+        """取消尚未完成的识别"""
+        with self._lock:
+            self._cancelled = True
+            for pending in self._pending:
+                pending.cancel()
+
+
+class TranscriptionStream(_TranscriptionStreamBase):
+    """流式识别（线程版），语音段在共享线程池中识别"""
+
+    def __init__(self, transcribe: Callable[[bytes], Dict], executor: Executor, config: Optional[Dict] = None):
+        """创建识别流
+
+        Args:
+            transcribe (Callable[[bytes], Dict]): 识别一段WAV音频的函数，返回值同 transcribe_audio
+            executor (Executor): 执行识别的线程池
+            config (Dict, optional): 配置文件中的 streaming_asr 配置段
+        """
+        super().__init__(config)
+        self._transcribe = transcribe
+        self._executor = executor
+
+    def _submit(self, wav: bytes):
+        return self._executor.submit(self._transcribe, wav)
+
+    def finish(self) -> Dict:
+        """录音结束，等待所有语音段识别完成
+
+        Returns:
+            Dict: 成功时为 {"text": 全部文字, "segments": 语音段数}，任一段失败时为该段的错误结果
+        """
+        self._close()
+        results = []
+        for pending in self._pending:
+            try:
+                results.append(pending.result())
+            except Exception as e:
+                results.append({'error': f"语音识别过程发生异常: {str(e)}", 'text': ''})
+        return self._combine(results)
+
+
+class AsyncTranscriptionStream(_TranscriptionStreamBase):
+    """流式识别（asyncio 版），需要在事件循环中使用"""
+
+    def __init__(self, transcribe: Callable, config: Optional[Dict] = None):
+        """创建识别流
+
+        Args:
+            transcribe (Callable): 识别一段WAV音频的协程函数，返回值同 transcribe_audio
+            config (Dict, optional): 配置文件中的 streaming_asr 配置段
+        """
+        super().__init__(config)
+        self._transcribe = transcribe
+
+    def _submit(self, wav: bytes):
+        task = asyncio.create_task(self._transcribe(wav))
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return task
+
+    async def finish(self) -> Dict:
+        """录音结束，等待所有语音段识别完成（同 TranscriptionStream.finish）"""
+        self._close()
+        results = []
+        for pending in self._pending:
+            try:
+                results.append(await pending)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                results.append({'error': f"语音识别过程发生异常: {str(e)}", 'text': ''})
+        return self._combine(results)
+
+
+class TranscriptionStreams:
+    """进程内的流式识别表，超过 ttl 秒没有收到音频的识别流会被取消并清理"""
+
+    def __init__(self, ttl: float = DEFAULT_STREAMING_ASR_CONFIG['ttl']):
+        self.ttl = ttl
+        self._streams: Dict[str, _TranscriptionStreamBase] = {}
+        self._lock = threading.Lock()
+
+    def add(self, stream: _TranscriptionStreamBase) -> str:
+        """登记识别流，返回识别流ID"""
+        stream_id = uuid.uuid4().hex
+        with self._lock:
+            expired = [key for key, value in self._streams.items()
+                       if time.time() - value.last_used > self.ttl]
+            for key in expired:
+                self._streams.pop(key).cancel()
+            self._streams[stream_id] = stream
+        return stream_id
+
+    def get(self, stream_id: str) -> Optional[_TranscriptionStreamBase]:
+        with self._lock:
+            return self._streams.get(stream_id)
+
+    def pop(self, stream_id: str) -> Optional[_TranscriptionStreamBase]:
+        """取出识别流，不存在或已结束时返回None"""
+        with self._lock:
+            return self._streams.pop(stream_id, None)
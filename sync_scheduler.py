@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger('aristotle')
+
+
+class _SyncRun:
+    """一次正在进行的同步，供并发调用者等待其结果"""
+
+    def __init__(self, trigger: str):
+        self.trigger = trigger
+        self.started_at = time.time()
+        self.done = threading.Event()
+        self.result: Optional[Dict] = None
+
+
+class SyncScheduler:
+    """后台同步调度器
+
+    - 按固定间隔在后台线程中执行同步
+    - 同一时刻最多只有一次同步在执行，并发的同步请求会等待并共享这次同步的结果
+    - 距上次同步完成不足 debounce 秒的请求直接返回上次结果
+    """
+
+    def __init__(self, sync_func: Callable[[], Dict], interval: float = 300,
+                 debounce: float = 30, history_size: int = 20):
+        """初始化同步调度器
+
+        Args:
+            sync_func (Callable[[], Dict]): 执行一次同步的函数，返回同步统计信息
+            interval (float): 后台同步间隔（秒），<= 0 时不启动后台同步
+            debounce (float): 去抖窗口（秒），窗口内的重复请求返回上次结果
+            history_size (int): 保留的同步记录条数
+        """
+        self.sync_func = sync_func
+        self.interval = interval
+        self.debounce = debounce
+
+        self._lock = threading.Lock()
+        self._inflight: Optional[_SyncRun] = None
+        self._last: Optional[Dict] = None
+        self._history = deque(maxlen=history_size)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """启动后台同步线程"""
+        if self.interval <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run_loop, name='sync-scheduler', daemon=True)
+        self._thread.start()
+        logger.info(f"后台同步已启动，间隔 {self.interval} 秒")
+
+    def stop(self, timeout: Optional[float] = None):
+        """停止后台同步线程（不会中断正在进行的同步）"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run_loop(self):
+        while not self._stop.wait(self.interval):
+            self.request_sync(trigger='interval')
+
+    def request_sync(self, force: bool = False, trigger: str = 'request') -> Dict:
+        """请求一次同步
+
+        Args:
+            force (bool): 为True时忽略去抖窗口（仍会加入正在进行的同步）
+            trigger (str): 触发来源，记录在同步结果中
+
+        Returns:
+            Dict: 同步结果，格式为：
+            {
+                "status": "success" | "error",
+                "trigger": 触发来源,
+                "started_at": 开始时间戳,
+                "finished_at": 结束时间戳,
+                "duration": 耗时（秒）,
+                "stats": 同步统计信息（失败时为None）,
+                "error": 错误信息（成功时为None）,
+                "coalesced": 是否复用了其他请求的同步结果
+            }
+        """
+        with self._lock:
+            run = self._inflight
+            if run is None:
+                last = self._last
+                if not force and last and time.time() - last['finished_at'] < self.debounce:
+                    return {**last, 'coalesced': True}
+                run = self._inflight = _SyncRun(trigger)
+                leader = True
+            else:
+                leader = False
+
+        if not leader:
+            run.done.wait()
+            return {**run.result, 'coalesced': True}
+
+        self._execute(run)
+        return {**run.result, 'coalesced': False}
+
+    def _execute(self, run: _SyncRun):
+        stats, error = None, None
+        try:
+            stats = self.sync_func()
+        except Exception as e:
+            error = str(e)
+            logger.error(f"同步失败（{run.trigger}）: {error}")
+
+        finished_at = time.time()
+        result = {
+            'status': 'error' if error else 'success',
+            'trigger': run.trigger,
+            'started_at': run.started_at,
+            'finished_at': finished_at,
+            'duration': round(finished_at - run.started_at, 3),
+            'stats': stats,
+            'error': error
+        }
+        logger.info(f"同步{'失败' if error else '完成'}（{run.trigger}），耗时 {result['duration']:.2f}秒")
+
+        with self._lock:
+            run.result = result
+            self._last = result
+            self._history.append(result)
+            self._inflight = None
+        run.done.set()
+
+    def status(self) -> Dict:
+        """获取调度器状态
+
+        Returns:
+            Dict: 包含是否正在同步、后台线程状态、最近一次结果和历史记录
+        """
+        with self._lock:
+            inflight = self._inflight
+            history: List[Dict] = list(self._history)
+            last = self._last
+        return {
+            'running': inflight is not None,
+            'running_since': inflight.started_at if inflight else None,
+            'scheduler_alive': bool(self._thread and self._thread.is_alive()),
+            'interval': self.interval,
+            'debounce': self.debounce,
+            'last': last,
+            'history': history
+        }
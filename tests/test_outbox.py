@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""TaskOutbox 的行为测试：使用临时 SQLite 数据库，滴答清单API由 FakeDida 代替"""
+import json
+import time
+
+import pytest
+
+from circuit_breaker import CircuitOpenError
+from dida365_api import DidaAPI, DidaAPIError, DidaAuthRequired
+from outbox import LOCAL_ID_PREFIX, TaskOutbox
+
+
+class FakeDida:
+    """记录请求的滴答清单服务端；errors 中的异常按顺序在请求时抛出"""
+
+    def __init__(self):
+        self.tasks = {}
+        self.calls = []
+        # (异常, 抛出前是否已在服务端生效)
+        self.errors = []
+        self.on_request = None
+
+    def request(self, method, endpoint, lane=None, json=None):
+        self.calls.append((method, endpoint, dict(json or {})))
+        if self.on_request:
+            self.on_request(method, endpoint)
+        error, applied = self.errors.pop(0) if self.errors else (None, False)
+        if error is not None and not applied:
+            raise error
+        if endpoint == 'task':
+            task = {**json, 'id': f'srv{len(self.tasks) + 1}', 'status': 0}
+        else:
+            task_id = endpoint.split('/', 1)[1]
+            task = {**self.tasks.get(task_id, {}), **json, 'id': task_id}
+        self.tasks[task['id']] = task
+        if error is not None:
+            raise error
+        return dict(task)
+
+    def get_project_with_data(self, project_id, lane=None):
+        return {'tasks': [dict(task) for task in self.tasks.values() if task.get('projectId') == project_id]}
+
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    config_path = tmp_path / 'config.json'
+    config_path.write_text(json.dumps({'dida365': {'db_path': str(tmp_path / 'tasks.db')}}), encoding='utf-8')
+    monkeypatch.setattr(DidaAPI, '_can_prompt', staticmethod(lambda: False))
+    api = DidaAPI(str(config_path))
+    yield api
+    api.close()
+
+
+@pytest.fixture
+def server(api):
+    server = FakeDida()
+    api._make_request = server.request
+    api.get_project_with_data = server.get_project_with_data
+    return server
+
+
+@pytest.fixture
+def outbox(api, server):
+    return TaskOutbox(api, merge_window=60, max_attempts=3, backoff_base=0.01, backoff_max=0.01)
+
+
+def add_synced_task(api, server, task_id, title, project_id='p1'):
+    task = {'id': task_id, 'projectId': project_id, 'title': title, 'status': 0}
+    server.tasks[task_id] = dict(task)
+    with api._transaction():
+        api._upsert_tasks([api._task_row(task)])
+
+
+def entries(api):
+    api.cursor.execute('SELECT id, op, task_id, status, attempts, available_at, payload FROM outbox ORDER BY id')
+    return [
+        dict(zip(('id', 'op', 'task_id', 'status', 'attempts', 'available_at', 'payload'), row))
+        for row in api.cursor.fetchall()
+    ]
+
+
+def make_ready(api, entry_id=None):
+    """跳过合并窗口：让指定记录（默认全部待发送记录）立即可以发送"""
+    with api._transaction() as cursor:
+        if entry_id is None:
+            cursor.execute("UPDATE outbox SET available_at = 0 WHERE status = 'pending'")
+        else:
+            cursor.execute('UPDATE outbox SET available_at = 0 WHERE id = ?', (entry_id,))
+
+
+def drain(outbox):
+    """在当前线程中发送所有可以发送的记录"""
+    while outbox._dispatch_next() is None:
+        pass
+
+
+def test_updates_within_merge_window_are_merged(api, server, outbox):
+    add_synced_task(api, server, 't1', '写周报')
+
+    outbox.update_task('t1', 'p1', title='写月报')
+    outbox.update_task('t1', 'p1', priority=5)
+
+    assert len(entries(api)) == 1
+    local = api.get_local_task('t1')
+    assert (local['title'], local['priority']) == ('写月报', 5)
+
+    drain(outbox)
+    assert server.calls == []
+
+    make_ready(api)
+    drain(outbox)
+    assert [(method, endpoint) for method, endpoint, _ in server.calls] == [('POST', 'task/t1')]
+    assert server.calls[0][2]['title'] == '写月报'
+    assert server.calls[0][2]['priority'] == 5
+    assert entries(api)[0]['status'] == 'done'
+
+
+def test_head_of_line_entry_blocks_later_entries(api, server, outbox):
+    add_synced_task(api, server, 't1', '写周报')
+    add_synced_task(api, server, 't2', '开会')
+    outbox.update_task('t1', 'p1', title='写月报')
+    outbox.update_task('t2', 'p1', title='开周会')
+    first, second = entries(api)
+
+    make_ready(api, second['id'])
+    wait = outbox._dispatch_next()
+    assert wait is not None and wait > 0
+    assert server.calls == []
+
+    make_ready(api, first['id'])
+    drain(outbox)
+    assert [endpoint for _, endpoint, _ in server.calls] == ['task/t1', 'task/t2']
+
+
+def test_create_then_update_rewrites_task_id(api, server, outbox):
+    task = outbox.create_task('买牛奶', project_id='p1')
+    local_id = task['id']
+    assert local_id.startswith(LOCAL_ID_PREFIX)
+
+    # 创建请求发送期间用户修改了任务
+    def edit_during_create(method, endpoint):
+        if endpoint == 'task':
+            server.on_request = None
+            outbox.update_task(local_id, 'p1', content='两盒')
+    server.on_request = edit_during_create
+
+    make_ready(api)
+    drain(outbox)
+
+    create, update = entries(api)
+    server_id = create['task_id']
+    assert create['status'] == 'done' and server_id == 'srv1'
+    assert update['task_id'] == server_id and update['status'] == 'pending'
+    # 排队的修改写回之前，本地读到的任务仍包含这次修改
+    assert api.get_local_task(local_id) is None
+    assert api.get_local_task(server_id)['content'] == '两盒'
+
+    # 之后使用临时ID的修改也发送到服务端ID
+    outbox.update_task(local_id, 'p1', priority=3)
+    make_ready(api)
+    drain(outbox)
+    assert [endpoint for _, endpoint, _ in server.calls] == ['task', f'task/{server_id}']
+    assert server.tasks[server_id]['content'] == '两盒'
+    assert server.tasks[server_id]['priority'] == 3
+
+
+def test_retry_after_ambiguous_create_reuses_created_task(api, server, outbox):
+    # 第一次发送前就已同步到本地的同名任务不是这次创建的
+    add_synced_task(api, server, 'old', '买牛奶')
+    with api._transaction() as cursor:
+        cursor.execute("UPDATE tasks SET created_at = '2000-01-01 00:00:00' WHERE id = 'old'")
+
+    outbox.create_task('买牛奶', project_id='p1')
+    server.errors.append((DidaAPIError('请求超时', 503), True))
+    make_ready(api)
+    drain(outbox)
+    assert entries(api)[0]['status'] == 'pending'
+    assert entries(api)[0]['attempts'] == 1
+
+    # 两次发送之间，后台同步把服务端已创建的任务写入了本地
+    with api._transaction():
+        api._upsert_tasks([api._task_row(server.tasks['srv2'])])
+
+    make_ready(api)
+    drain(outbox)
+    assert [endpoint for _, endpoint, _ in server.calls] == ['task']
+    assert entries(api)[0]['status'] == 'done'
+    assert entries(api)[0]['task_id'] == 'srv2'
+    assert sorted(task['id'] for task in api.get_local_tasks()) == ['old', 'srv2']
+
+
+@pytest.mark.parametrize('error', [DidaAuthRequired(), CircuitOpenError('dida365', 30)])
+def test_unsent_entries_stay_pending(api, server, outbox, error):
+    task = outbox.create_task('买牛奶', project_id='p1')
+    for _ in range(outbox.max_attempts + 1):
+        server.errors.append((error, False))
+        make_ready(api)
+        drain(outbox)
+
+    entry = entries(api)[0]
+    assert entry['status'] == 'pending'
+    assert entry['attempts'] == 0
+    assert entry['available_at'] > time.time()
+    # 本地创建的任务不会被撤销
+    assert api.get_local_task(task['id'])['title'] == '买牛奶'
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""TTS音频缓存
+
+同一段文字用同一个音色和模型合成的语音总是相同的。"抱歉，没有找到任何任务"这类固定回复、
+常见的确认语以及分句合成后重复出现的短句，都可以直接使用之前合成的音频。
+
+缓存按 (文字, 音色, 模型) 的哈希寻址，分两级：
+- 内存：LRU，按总字节数限制大小
+- 磁盘：每段音频一个文件，进程重启后仍然有效；总大小超过上限时删除最久未使用的文件
+缓存在进程内的所有线程间共享。
+"""
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, Optional
+
+from metrics import metrics
+
+DEFAULT_DIRECTORY = 'tts_cache'
+DEFAULT_MEMORY_MAX_BYTES = 32 * 1024 * 1024
+DEFAULT_DISK_MAX_BYTES = 256 * 1024 * 1024
+
+AUDIO_SUFFIX = '.wav'
+
+
+class TTSCache:
+    """内存 + 磁盘两级的TTS音频缓存"""
+
+    def __init__(self, directory: str = DEFAULT_DIRECTORY,
+                 memory_max_bytes: int = DEFAULT_MEMORY_MAX_BYTES,
+                 disk_max_bytes: int = DEFAULT_DISK_MAX_BYTES):
+        """初始化缓存，扫描磁盘上已有的音频文件
+
+        Args:
+            directory (str): 磁盘缓存目录，不存在时自动创建
+            memory_max_bytes (int): 内存中缓存的音频总字节数上限
+            disk_max_bytes (int): 磁盘缓存的总字节数上限
+        """
+        self.directory = directory
+        self.memory_max_bytes = memory_max_bytes
+        self.disk_max_bytes = disk_max_bytes
+        self._lock = threading.Lock()
+        self._memory: OrderedDict = OrderedDict()
+        self._memory_bytes = 0
+        # 磁盘上的音频：key -> 文件大小，按最近使用时间排序
+        self._disk: OrderedDict = OrderedDict()
+        self._disk_bytes = 0
+        self._counts = {'memory_hit': 0, 'disk_hit': 0, 'miss': 0}
+        os.makedirs(directory, exist_ok=True)
+        self._load_disk_index()
+
+    @staticmethod
+    def key(text: str, voice: str, model: str) -> str:
+        """计算音频的缓存键"""
+        return hashlib.sha256(f'{model}\0{voice}\0{text}'.encode('utf-8')).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + AUDIO_SUFFIX)
+
+    def _load_disk_index(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(AUDIO_SUFFIX):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name[:-len(AUDIO_SUFFIX)], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+        self._evict_disk()
+
+    def get(self, key: str, memory_only: bool = False) -> Optional[bytes]:
+        """查找缓存的音频
+
+        Args:
+            key (str): 缓存键，见 key()
+            memory_only (bool): 为True时只查内存，不读取磁盘（供事件循环中快速判断）
+
+        Returns:
+            Optional[bytes]: 音频数据，未命中时返回None
+        """
+        with self._lock:
+            audio = self._memory.get(key)
+            if audio is not None:
+                self._memory.move_to_end(key)
+                self._count('memory_hit')
+                return audio
+            if memory_only:
+                return None
+            on_disk = key in self._disk
+            if on_disk:
+                self._disk.move_to_end(key)
+
+        if on_disk:
+            try:
+                with open(self._path(key), 'rb') as f:
+                    audio = f.read()
+                # 更新修改时间，重启后按最近使用时间恢复LRU顺序
+                os.utime(self._path(key))
+            except OSError:
+                audio = None
+        with self._lock:
+            if audio is None:
+                self._disk_forget(key)
+                self._count('miss')
+                return None
+            self._remember(key, audio)
+            self._count('disk_hit')
+        return audio
+
+    def put(self, key: str, audio: bytes):
+        """保存音频到内存和磁盘，磁盘文件先写临时文件再原子替换"""
+        with self._lock:
+            self._remember(key, audio)
+            if key in self._disk:
+                return
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(audio)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            print(f"写入TTS磁盘缓存失败: {str(e)}")
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            return
+        with self._lock:
+            if key not in self._disk:
+                self._disk[key] = len(audio)
+                self._disk_bytes += len(audio)
+            self._evict_disk()
+
+    def warm_up(self, phrases: Iterable[str], voice: str, model: str,
+                synthesize: Callable[[str], bytes]) -> int:
+        """预先合成常用语句，已经在缓存中的语句跳过
+
+        Args:
+            phrases (Iterable[str]): 常用语句
+            voice (str): 音色
+            model (str): TTS模型
+            synthesize (Callable[[str], bytes]): 合成语音的函数
+
+        Returns:
+            int: 新合成的语句数
+        """
+        synthesized = 0
+        for phrase in phrases:
+            key = self.key(phrase, voice, model)
+            with self._lock:
+                cached = key in self._memory or key in self._disk
+            if cached:
+                continue
+            try:
+                self.put(key, synthesize(phrase))
+                synthesized += 1
+            except Exception as e:
+                print(f"预合成语音失败（{phrase}）: {str(e)}")
+        return synthesized
+
+    def stats(self) -> Dict:
+        """获取缓存大小和命中率"""
+        with self._lock:
+            lookups = sum(self._counts.values())
+            hits = self._counts['memory_hit'] + self._counts['disk_hit']
+            return {
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_bytes,
+                'disk_entries': len(self._disk),
+                'disk_bytes': self._disk_bytes,
+                **self._counts,
+                'hit_ratio': hits / lookups if lookups else 0.0
+            }
+
+    def _count(self, result: str):
+        self._counts[result] += 1
+        metrics.inc('tts_cache', result=result)
+
+    def _remember(self, key: str, audio: bytes):
+        """放入内存LRU（调用方持有锁），单段音频超过内存上限时不缓存"""
+        if len(audio) > self.memory_max_bytes:
+            return
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_bytes -= len(previous)
+        self._memory[key] = audio
+        self._memory_bytes += len(audio)
+        while self._memory_bytes > self.memory_max_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _disk_forget(self, key: str):
+        size = self._disk.pop(key, None)
+        if size is not None:
+            self._disk_bytes -= size
+
+    def _evict_disk(self):
+        """删除最久未使用的文件，直到磁盘缓存不超过上限（调用方持有锁）"""
+        while self._disk_bytes > self.disk_max_bytes and self._disk:
+            key, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            try:
+                os.unlink(self._path(key))
+            except OSError:
+                pass
+            metrics.inc('tts_cache', result='disk_evicted')